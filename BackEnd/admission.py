@@ -0,0 +1,249 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+# Admission control for expensive endpoints. Requests are checked before the
+# body is read (so a rejected upload costs nothing) and are turned away with
+# an immediate 429 + Retry-After instead of queueing behind everyone else:
+#   - token buckets per (route, caller) and per route overall
+#   - a cap on concurrent analyses
+#   - a cap on upload bytes in flight
+# A request needs a token from both its caller's bucket and the route's; if
+# either is empty neither is spent. Bucket state lives in-process by default;
+# set RATE_LIMIT_STORE to a SQLite file path to share it between uvicorn
+# workers. Concurrency and byte caps are per worker process.
+
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "")
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "4"))
+UPLOAD_MAX_BYTES_IN_FLIGHT = int(os.getenv("UPLOAD_MAX_BYTES_IN_FLIGHT", str(512 * 1024 * 1024)))
+
+
+class Rule:
+    def __init__(self, name, method, pattern, per_caller, per_route, concurrency=None, upload=False):
+        self.name = name
+        self.method = method
+        self.pattern = re.compile(pattern)
+        # (tokens per second, burst)
+        self.per_caller = per_caller
+        self.per_route = per_route
+        self.concurrency = concurrency
+        self.upload = upload
+
+
+RULES = [
+    Rule("login", "POST", r"^/login$", per_caller=(10 / 60, 5), per_route=(50, 100)),
+    Rule("file_case", "POST", r"^/user/file-case$", per_caller=(6 / 60, 3), per_route=(5, 20), upload=True),
+    Rule("analyze", "POST", r"^/evidence/\d+/analyze$", per_caller=(20 / 60, 5), per_route=(2, 10),
+         concurrency=ANALYSIS_MAX_CONCURRENCY),
+    # Starts (or attaches to) the same model call as "analyze"
+    Rule("analyze_stream", "GET", r"^/evidence/\d+/analyze/stream$", per_caller=(20 / 60, 5), per_route=(2, 10),
+         concurrency=ANALYSIS_MAX_CONCURRENCY),
+    # Local-backend stand-in for presigned uploads
+    Rule("direct_upload", "PUT", r"^/storage/uploads/[0-9a-f]+$", per_caller=(30 / 60, 10), per_route=(10, 40), upload=True),
+    # Queues work for the batch scheduler, which bounds its own parallelism
+    Rule("analyze_case", "POST", r"^/cases/\d+/analyze$", per_caller=(6 / 60, 3), per_route=(1, 10)),
+]
+
+
+def refill(buckets, states, now):
+    # Brings each bucket's (tokens, updated) up to now. Returns the token
+    # counts and the first empty bucket as (index, seconds until it has a
+    # token), or None if every bucket has one.
+    refilled = [min(burst, tokens + max(0, now - updated) * rate)
+                for (_, rate, burst), (tokens, updated) in zip(buckets, states)]
+    for i, ((_, rate, _), tokens) in enumerate(zip(buckets, refilled)):
+        if tokens < 1:
+            return refilled, (i, (1 - tokens) / rate)
+    return refilled, None
+
+
+class MemoryBucketStore:
+    blocking = False
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """Take one token. Returns 0 if admitted, else seconds until a token is available."""
+        empty = self.take_all([(key, rate, burst)], now)
+        return empty[1] if empty else 0
+
+    def take_all(self, buckets, now=None):
+        """Take one token from each of buckets [(key, rate, burst)], or none
+        if any is empty. Returns None if admitted, else (index of the empty
+        bucket, seconds until it has a token)."""
+        now = now or time.monotonic()
+        with self._lock:
+            states = [self._buckets.get(key, (burst, now)) for key, _, burst in buckets]
+            refilled, empty = refill(buckets, states, now)
+            spend = 0 if empty else 1
+            for (key, _, _), tokens in zip(buckets, refilled):
+                self._buckets[key] = (tokens - spend, now)
+            return empty
+
+
+class SQLiteBucketStore:
+    # Separate file from test.db so rate limiting never waits on the app's
+    # writer lock. Calls block, so the middleware runs them off the event loop.
+    blocking = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now=None):
+        empty = self.take_all([(key, rate, burst)], now)
+        return empty[1] if empty else 0
+
+    def take_all(self, buckets, now=None):
+        now = now or time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            states = []
+            for key, _, burst in buckets:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                states.append(row if row else (burst, now))
+            refilled, empty = refill(buckets, states, now)
+            spend = 0 if empty else 1
+            conn.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                             [(key, tokens - spend, now) for (key, _, _), tokens in zip(buckets, refilled)])
+            conn.execute("COMMIT")
+            return empty
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class AdmissionController:
+    def __init__(self, rules=RULES, store=None):
+        self.rules = rules
+        self.store = store or (SQLiteBucketStore(RATE_LIMIT_STORE) if RATE_LIMIT_STORE else MemoryBucketStore())
+        self._lock = threading.Lock()
+        self.in_flight = defaultdict(int)
+        self.upload_bytes_in_flight = 0
+        self.metrics = defaultdict(lambda: defaultdict(int))
+
+    def match(self, method, path):
+        for rule in self.rules:
+            if rule.method == method and rule.pattern.match(path):
+                return rule
+        return None
+
+    def admit(self, rule, caller, upload_bytes=0):
+        """Returns (admitted, retry_after_seconds, reason)."""
+        empty = self.store.take_all([(f"{rule.name}:{caller}", *rule.per_caller), (f"{rule.name}:*", *rule.per_route)])
+        if empty:
+            index, wait = empty
+            return self._reject(rule, ("rate_limited_caller", "rate_limited_route")[index], wait)
+
+        with self._lock:
+            if rule.concurrency is not None and self.in_flight[rule.name] >= rule.concurrency:
+                return self._reject(rule, "concurrency", 1, locked=True)
+            # A single upload bigger than the cap is still let through when idle
+            if rule.upload and self.upload_bytes_in_flight and self.upload_bytes_in_flight + upload_bytes > UPLOAD_MAX_BYTES_IN_FLIGHT:
+                return self._reject(rule, "upload_bytes", 1, locked=True)
+            self.in_flight[rule.name] += 1
+            if rule.upload:
+                self.upload_bytes_in_flight += upload_bytes
+            self.metrics[rule.name]["admitted"] += 1
+        return True, 0, None
+
+    def release(self, rule, upload_bytes=0):
+        with self._lock:
+            self.in_flight[rule.name] -= 1
+            if rule.upload:
+                self.upload_bytes_in_flight -= upload_bytes
+
+    def _reject(self, rule, reason, wait, locked=False):
+        if locked:
+            self.metrics[rule.name][reason] += 1
+        else:
+            with self._lock:
+                self.metrics[rule.name][reason] += 1
+        return False, max(1, math.ceil(wait)), reason
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "routes": {
+                    rule.name: {
+                        "in_flight": self.in_flight[rule.name],
+                        "concurrency_limit": rule.concurrency,
+                        **self.metrics[rule.name],
+                    }
+                    for rule in self.rules
+                },
+                "upload_bytes_in_flight": self.upload_bytes_in_flight,
+                "upload_bytes_limit": UPLOAD_MAX_BYTES_IN_FLIGHT,
+                "store": "sqlite" if isinstance(self.store, SQLiteBucketStore) else "memory",
+            }
+
+
+admission = AdmissionController()
+
+
+def request_caller(scope, headers):
+    # No authentication yet, so the client address is the only identity a
+    # caller can't simply make up. Behind a reverse proxy, run uvicorn with
+    # --proxy-headers so this is the real client and not the proxy.
+    return (scope.get("client") or ("unknown",))[0]
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, controller=admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        rule = self.controller.match(scope.get("method"), scope["path"]) if scope["type"] == "http" else None
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        caller = request_caller(scope, headers)
+        upload_bytes = int(headers.get("content-length") or 0) if rule.upload else 0
+
+        if self.controller.store.blocking:
+            admitted, retry_after, reason = await run_in_threadpool(self.controller.admit, rule, caller, upload_bytes)
+        else:
+            admitted, retry_after, reason = self.controller.admit(rule, caller, upload_bytes)
+        if not admitted:
+            body = json.dumps({"detail": "Too many requests, please retry later", "reason": reason}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(rule, upload_bytes)
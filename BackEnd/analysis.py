@@ -0,0 +1,443 @@
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+from sqlalchemy import func, or_, and_, case as sql_case
+
+from ai_utils import get_analyzer
+from database import SessionLocal
+from case_events import transition
+from compute import PRIORITY_BATCH
+from case_export import case_verdict
+from models import AnalysisBatch, Case, Evidence, Notification
+from storage import storage
+from write_queue import write_batcher
+
+# Evidence analysis runs, shared between viewers. The first viewer of
+# GET /evidence/{id}/analyze/stream starts the model in a background thread;
+# anyone else who opens the stream while it is running attaches to the same
+# run and gets the report so far followed by the live chunks. If the run is
+# happening in another worker process we poll the evidence row instead and
+# send the report in one piece once it lands.
+
+# A "processing" row older than this is assumed to be from a crashed worker
+ANALYSIS_STALE_SECONDS = int(os.getenv("ANALYSIS_STALE_SECONDS", "600"))
+ANALYSIS_POLL_INTERVAL = 1.0
+# How long a POST analyze waits on a run started elsewhere before giving up
+ANALYSIS_DUPLICATE_WAIT_SECONDS = 120
+# Model calls in flight for whole-case batches, across all batches
+ANALYSIS_BATCH_WORKERS = int(os.getenv("ANALYSIS_BATCH_WORKERS", "2"))
+# How often a worker touches the batches it still has queued, so a batch
+# waiting behind others isn't mistaken for one from a crashed worker
+ANALYSIS_BATCH_HEARTBEAT_SECONDS = max(1, ANALYSIS_STALE_SECONDS // 4)
+
+# Batch priorities, lower runs first
+PRIORITY_COURT = 0
+PRIORITY_POLICE = 1
+
+# The fixed last line ANALYSIS_PROMPT asks the model for (markdown emphasis
+# around it is tolerated)
+VERDICT_LINE = re.compile(r"^[*_\s]*verdict\s*:\s*(real|ai[_ -]generated)[*_.\s]*$", re.IGNORECASE)
+
+
+def report_verdict(report):
+    """Reads the verdict line at the end of a report: True (real), False
+    (AI-generated) or None if the report doesn't end with one. The prose
+    above it is never guessed at."""
+    lines = [line for line in (report or "").splitlines() if line.strip()]
+    match = VERDICT_LINE.match(lines[-1]) if lines else None
+    if not match:
+        return None
+    return match.group(1).lower() == "real"
+
+
+def complete_analysis(evidence_id, report, resolve_case=True):
+    # Stores the report and, for single-item analysis, resolves the case and
+    # notifies the filer (batches do that once at the end instead)
+    def write(db):
+        evidence = db.query(Evidence).filter(Evidence.id == evidence_id).first()
+        if not evidence:
+            return
+        evidence.analysis_status = "completed"
+        evidence.analysis_report = report
+        evidence.is_authentic = report_verdict(report)
+
+        # A report without a readable verdict leaves the case open for review
+        case = db.query(Case).filter(Case.id == evidence.case_id).first() if resolve_case else None
+        if case and evidence.is_authentic is not None:
+            transition(db, case, "resolved", actor_role="system")
+            db.add(Notification(
+                user_id=case.user_id,
+                case_id=case.id,
+                message=f"Evidence analysis completed for case '{case.title}'. ",
+                type="analysis_complete"
+            ))
+
+    write_batcher.run(write)
+
+
+def fail_analysis(evidence_id):
+    def write(db):
+        db.query(Evidence).filter(Evidence.id == evidence_id).update({"analysis_status": "failed"}, synchronize_session=False)
+
+    write_batcher.run(write)
+
+
+def claim_analysis(evidence_id):
+    # Conditional update so only one worker runs the model for a piece of
+    # evidence at a time. Completed evidence is never re-claimed here.
+    def write(db):
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=ANALYSIS_STALE_SECONDS)
+        return db.query(Evidence).filter(
+            Evidence.id == evidence_id,
+            or_(
+                Evidence.analysis_status.in_(["not_started", "failed"]),
+                Evidence.analysis_status == None,
+                and_(Evidence.analysis_status == "processing", Evidence.updated_at < stale),
+            )
+        ).update({"analysis_status": "processing"}, synchronize_session=False)
+
+    return write_batcher.run(write) == 1
+
+
+def wait_for_analysis(evidence_id, timeout=ANALYSIS_STALE_SECONDS):
+    # For evidence claimed by another run (or worker): polls the row until it
+    # leaves "processing". Returns (status, report).
+    deadline = time.monotonic() + timeout
+    while True:
+        db = SessionLocal()
+        try:
+            status, report = db.query(Evidence.analysis_status, Evidence.analysis_report).filter(Evidence.id == evidence_id).one()
+        finally:
+            db.close()
+        if status != "processing" or time.monotonic() >= deadline:
+            return status, report
+        time.sleep(ANALYSIS_POLL_INTERVAL)
+
+
+class AnalysisRun:
+    def __init__(self, evidence_id):
+        self.evidence_id = evidence_id
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self._lock = threading.Lock()
+        self._waiters = []
+
+    @classmethod
+    def completed(cls, evidence_id, report):
+        run = cls(evidence_id)
+        run.publish(report, finished=True)
+        return run
+
+    def publish(self, chunk=None, finished=False, error=None):
+        # Called from the producer thread; wakes every attached viewer
+        with self._lock:
+            if chunk:
+                self.chunks.append(chunk)
+            if finished:
+                self.finished = True
+                self.error = error
+            waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # viewer's loop already closed
+                pass
+
+    async def follow(self):
+        """Yields the chunks produced so far, then new ones until the run finishes."""
+        sent = 0
+        while True:
+            event = asyncio.Event()
+            with self._lock:
+                chunks = self.chunks[sent:]
+                finished = self.finished
+                if not chunks and not finished:
+                    self._waiters.append((asyncio.get_running_loop(), event))
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+            if finished:
+                return
+            if not chunks:
+                await event.wait()
+
+    def report(self):
+        with self._lock:
+            return "".join(self.chunks)
+
+
+class AnalysisStreams:
+    def __init__(self):
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def attach(self, evidence_id, file_path):
+        """Returns the in-progress run for this evidence, starting one if needed."""
+        with self._lock:
+            run = self._runs.get(evidence_id)
+            if run is None:
+                run = self._runs[evidence_id] = AnalysisRun(evidence_id)
+                threading.Thread(target=self._produce, args=(run, file_path), daemon=True).start()
+            return run
+
+    def _produce(self, run, file_path):
+        try:
+            if claim_analysis(run.evidence_id):
+                self._generate(run, file_path)
+            else:
+                self._wait_for_other_worker(run)
+        except Exception as e:
+            print(f"[ERROR] Analysis stream failed for evidence {run.evidence_id}: {e}")
+            run.publish(finished=True, error="AI analysis failed")
+        finally:
+            # Later viewers read the stored report from the evidence row
+            with self._lock:
+                self._runs.pop(run.evidence_id, None)
+
+    def _generate(self, run, file_path):
+        try:
+            with storage.local_copy(file_path) as path:
+                for chunk in get_analyzer().analyze_stream(path):
+                    run.publish(chunk)
+            report = run.report()
+            if not report:
+                raise Exception("Empty response from Gemini")
+        except Exception:
+            fail_analysis(run.evidence_id)
+            raise
+        complete_analysis(run.evidence_id, report)
+        run.publish(finished=True)
+
+    def _wait_for_other_worker(self, run):
+        status, report = wait_for_analysis(run.evidence_id)
+        if status == "completed":
+            run.publish(report, finished=True)
+        elif status == "processing":
+            run.publish(finished=True, error="Timed out waiting for analysis")
+        else:
+            run.publish(finished=True, error="AI analysis failed")
+
+
+analysis_streams = AnalysisStreams()
+
+
+def sse_event(event, data):
+    # JSON keeps multi-line report chunks on a single data: line
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_analysis_events(run):
+    async for chunk in run.follow():
+        yield sse_event("chunk", {"text": chunk})
+    if run.error:
+        yield sse_event("error", {"detail": run.error})
+    else:
+        yield sse_event("done", {"analysis_status": "completed"})
+
+
+# --- WHOLE-CASE BATCHES ---
+
+def start_case_batch(case_id):
+    """Creates a batch for every not-yet-analyzed item of the case, or returns
+    the batch already running for it. Returns (batch_id, priority, items,
+    created) or None if the case doesn't exist."""
+    def write(db):
+        case = db.query(Case).filter(Case.id == case_id).first()
+        if not case:
+            return None
+        # The scheduler heartbeats its unfinished batches, so only a batch
+        # whose worker died goes this long without an update
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=ANALYSIS_STALE_SECONDS)
+        running = db.query(AnalysisBatch.id).filter(
+            AnalysisBatch.case_id == case_id,
+            AnalysisBatch.status == "running",
+            AnalysisBatch.updated_at >= stale,
+        ).first()
+        if running:
+            return running.id, None, [], False
+
+        items = db.query(Evidence.id, Evidence.file_path).filter(
+            Evidence.case_id == case_id,
+            or_(Evidence.analysis_status != "completed", Evidence.analysis_status == None),
+        ).order_by(Evidence.id).all()
+        priority = PRIORITY_COURT if case.court_id is not None else PRIORITY_POLICE
+        batch = AnalysisBatch(case_id=case_id, priority=priority, total=len(items))
+        db.add(batch)
+        db.flush()
+        return batch.id, priority, [tuple(item) for item in items], True
+
+    return write_batcher.run(write)
+
+
+def record_batch_item(batch_id, ok):
+    column = AnalysisBatch.completed if ok else AnalysisBatch.failed
+
+    def write(db):
+        db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id).update(
+            {column: column + 1, AnalysisBatch.updated_at: datetime.datetime.utcnow()}, synchronize_session=False)
+
+    write_batcher.run(write)
+
+
+def touch_batches(batch_ids):
+    def write(db):
+        db.query(AnalysisBatch).filter(AnalysisBatch.id.in_(batch_ids), AnalysisBatch.status == "running").update(
+            {AnalysisBatch.updated_at: datetime.datetime.utcnow()}, synchronize_session=False)
+
+    write_batcher.run(write)
+
+
+def finish_batch(batch_id):
+    # Aggregates the verdict over all of the case's evidence, then updates
+    # the case and notifies the filer once for the whole batch
+    def write(db):
+        batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id).first()
+        if not batch:
+            return
+        counts = db.query(
+            func.count(Evidence.id).label("evidence_count"),
+            func.coalesce(func.sum(sql_case((Evidence.analysis_status == "completed", 1), else_=0)), 0).label("analyzed_count"),
+            func.coalesce(func.sum(sql_case((Evidence.is_authentic == True, 1), else_=0)), 0).label("authentic_count"),
+            func.coalesce(func.sum(sql_case((Evidence.is_authentic == False, 1), else_=0)), 0).label("flagged_count"),
+        ).filter(Evidence.case_id == batch.case_id).one()._asdict()
+
+        batch.verdict = case_verdict(counts)
+        batch.finished_at = datetime.datetime.utcnow()
+        if batch.total and not batch.completed:
+            batch.status = "failed"
+            return
+        # Some items failed: the verdict only covers part of the case
+        batch.status = "partial" if batch.failed else "completed"
+        if not batch.total:
+            # Nothing was pending, so nothing new to tell the filer
+            return
+
+        case = db.query(Case).filter(Case.id == batch.case_id).first()
+        if not case:
+            return
+        # Only a verdict on every item resolves the case; otherwise it stays
+        # open for another batch or a manual review
+        decided = counts["authentic_count"] + counts["flagged_count"]
+        if not batch.failed and decided == counts["evidence_count"]:
+            transition(db, case, "resolved", actor_role="system")
+        db.add(Notification(
+            user_id=case.user_id,
+            case_id=case.id,
+            message=(
+                f"Evidence analysis {'completed' if batch.status == 'completed' else 'partly completed'} for case '{case.title}': "
+                f"{counts['analyzed_count']} of {counts['evidence_count']} item(s) analyzed, verdict: {batch.verdict.replace('_', ' ')}."
+            ),
+            type="analysis_complete"
+        ))
+
+    write_batcher.run(write)
+
+
+def analyze_item(evidence_id, file_path):
+    # Non-streaming analysis of one item for a batch. Returns True if the
+    # evidence ended up analyzed.
+    if not claim_analysis(evidence_id):
+        # Already analyzed, or being analyzed by a stream / another worker
+        status, _ = wait_for_analysis(evidence_id)
+        return status == "completed"
+    try:
+        with storage.local_copy(file_path) as path:
+            report = get_analyzer().analyze(path, priority=PRIORITY_BATCH)
+        if not report:
+            fail_analysis(evidence_id)
+            return False
+        complete_analysis(evidence_id, report, resolve_case=False)
+        return True
+    except Exception:
+        # This worker holds the claim, so it's the one to release it
+        fail_analysis(evidence_id)
+        raise
+
+
+class BatchScheduler:
+    """
+    Fixed pool of worker threads pulling (priority, seq, ...) items off one
+    priority queue, so court-stage cases jump ahead of police-stage ones and
+    at most ANALYSIS_BATCH_WORKERS model calls run at a time however many
+    batches are queued. The last item of a batch finishes it. A heartbeat
+    thread keeps the batches with items left marked alive.
+    """
+
+    def __init__(self, workers=ANALYSIS_BATCH_WORKERS):
+        self.workers = workers
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._remaining = {}
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_threads(self):
+        # Threads don't survive fork, so each uvicorn worker starts its own pool
+        with self._lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._queue = queue.PriorityQueue()
+            self._remaining = {}
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"analysis-batch-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            self._threads.append(threading.Thread(target=self._heartbeat, name="analysis-batch-heartbeat", daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, batch_id, priority, items):
+        if not items:
+            finish_batch(batch_id)
+            return
+        self._ensure_threads()
+        with self._lock:
+            self._remaining[batch_id] = len(items)
+        for evidence_id, file_path in items:
+            self._queue.put((priority, next(self._seq), batch_id, evidence_id, file_path))
+
+    def _run(self):
+        while True:
+            _, _, batch_id, evidence_id, file_path = self._queue.get()
+            try:
+                ok = analyze_item(evidence_id, file_path)
+            except Exception as e:
+                # analyze_item already failed the item if it had claimed it
+                print(f"[ERROR] Batch {batch_id} analysis failed for evidence {evidence_id}: {e}")
+                ok = False
+            try:
+                record_batch_item(batch_id, ok)
+                with self._lock:
+                    self._remaining[batch_id] -= 1
+                    done = not self._remaining[batch_id]
+                    if done:
+                        del self._remaining[batch_id]
+                if done:
+                    finish_batch(batch_id)
+            except Exception as e:
+                print(f"[ERROR] Failed to record batch {batch_id} progress: {e}")
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(ANALYSIS_BATCH_HEARTBEAT_SECONDS)
+            with self._lock:
+                batch_ids = list(self._remaining)
+            if not batch_ids:
+                continue
+            try:
+                touch_batches(batch_ids)
+            except Exception as e:
+                print(f"[ERROR] Batch heartbeat failed: {e}")
+
+
+batch_scheduler = BatchScheduler()
@@ -0,0 +1,188 @@
+import argparse
+import datetime
+import gzip
+import os
+import shutil
+import threading
+import time
+
+from sqlalchemy import select, insert, delete, update, literal, or_, and_, DateTime
+
+from file_cleanup import cleanup_queue
+from media import unused_hashes, media_dirs
+from models import (
+    Case, Evidence, Notification, CaseHashNode,
+    archived_cases, archived_evidence, archived_notifications, archived_case_hash_nodes,
+)
+from storage import storage
+from write_queue import write_batcher
+
+# Hot/cold tiering. Cases in a terminal state that haven't changed for
+# ARCHIVE_AFTER_DAYS move (with their evidence rows and notifications) into
+# the archived_* tables, as do old read notifications. Their hash trees go
+# along so archived evidence keeps its inclusion proofs. Each batch is one
+# short write transaction so normal traffic keeps flowing between batches.
+# Playback renditions no live evidence uses any more are deleted.
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_STATUSES = [s.strip() for s in os.getenv("ARCHIVE_STATUSES", "resolved,closed,dismissed").split(",")]
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+# Pause between batches to let queued writes through
+ARCHIVE_BATCH_PAUSE = 0.05
+# Set to a directory to gzip archived evidence files out of uploads/
+ARCHIVE_COLD_DIR = os.getenv("ARCHIVE_COLD_DIR", "")
+# Run the job in-process every N hours (0 = only via CLI / admin endpoint)
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "0"))
+
+cases_table = Case.__table__
+evidence_table = Evidence.__table__
+notifications_table = Notification.__table__
+hash_nodes_table = CaseHashNode.__table__
+
+
+def copy_rows(db, source, target, criterion, now):
+    names = [c.name for c in source.columns]
+    rows = select(*source.columns, literal(now, DateTime)).where(criterion)
+    return db.execute(insert(target).from_select(names + ["archived_at"], rows)).rowcount
+
+
+def find_archived(db, table, row_id):
+    # The archived copy of a row that's gone from its hot table, or None
+    return db.execute(select(table).where(table.c.id == row_id)).first()
+
+
+def archive_case_batch(cutoff, batch_size):
+    def write(db):
+        now = datetime.datetime.utcnow()
+        ids = db.execute(
+            select(cases_table.c.id)
+            .where(
+                cases_table.c.status.in_(ARCHIVE_STATUSES),
+                or_(
+                    cases_table.c.updated_at < cutoff,
+                    and_(cases_table.c.updated_at == None, cases_table.c.created_at < cutoff),
+                ),
+            )
+            .order_by(cases_table.c.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return 0, [], []
+
+        copy_rows(db, cases_table, archived_cases, cases_table.c.id.in_(ids), now)
+        copy_rows(db, evidence_table, archived_evidence, evidence_table.c.case_id.in_(ids), now)
+        copy_rows(db, notifications_table, archived_notifications, notifications_table.c.case_id.in_(ids), now)
+        copy_rows(db, hash_nodes_table, archived_case_hash_nodes, hash_nodes_table.c.case_id.in_(ids), now)
+        files = db.execute(
+            select(evidence_table.c.id, evidence_table.c.file_path, evidence_table.c.content_hash)
+            .where(evidence_table.c.case_id.in_(ids))
+        ).all()
+        # Evidence, notifications and hash nodes go with the case (ON DELETE CASCADE)
+        db.execute(delete(cases_table).where(cases_table.c.id.in_(ids)))
+        gone = unused_hashes(db, [content_hash for _, _, content_hash in files], archiving=ids)
+        if gone:
+            # Archived rows shouldn't point at renditions that are about to go
+            db.execute(
+                update(archived_evidence)
+                .where(archived_evidence.c.case_id.in_(ids), archived_evidence.c.content_hash.in_(gone))
+                .values(proxy_path=None, poster_path=None, sprite_path=None, sprite_interval=None)
+            )
+        return len(ids), [(evidence_id, path) for evidence_id, path, _ in files], media_dirs(gone)
+
+    return write_batcher.run(write)
+
+
+def archive_notification_batch(cutoff, batch_size):
+    def write(db):
+        now = datetime.datetime.utcnow()
+        ids = db.execute(
+            select(notifications_table.c.id)
+            .where(notifications_table.c.is_read == True, notifications_table.c.created_at < cutoff)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return 0
+        copy_rows(db, notifications_table, archived_notifications, notifications_table.c.id.in_(ids), now)
+        db.execute(delete(notifications_table).where(notifications_table.c.id.in_(ids)))
+        return len(ids)
+
+    return write_batcher.run(write)
+
+
+def move_to_cold_storage(files):
+    # files: (evidence_id, "/uploads/...") of already-archived rows
+    os.makedirs(ARCHIVE_COLD_DIR, exist_ok=True)
+    moved = []
+    for evidence_id, path in files:
+        if not path:
+            continue
+        src = path.lstrip("/")
+        if not os.path.exists(src):
+            continue
+        dest = os.path.join(ARCHIVE_COLD_DIR, os.path.basename(src) + ".gz")
+        with open(src, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        moved.append((evidence_id, dest, src))
+
+    if moved:
+        def write(db):
+            for evidence_id, dest, _ in moved:
+                db.execute(update(archived_evidence).where(archived_evidence.c.id == evidence_id).values(cold_path=dest))
+        write_batcher.run(write)
+        # Only drop the originals once the new location is recorded
+        for _, _, src in moved:
+            os.remove(src)
+    return len(moved)
+
+
+def run_archive(max_age_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, cold_storage=bool(ARCHIVE_COLD_DIR)):
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=max_age_days)
+    summary = {"cases": 0, "notifications": 0, "cold_files": 0}
+
+    while True:
+        count, files, renditions = archive_case_batch(cutoff, batch_size)
+        if not count:
+            break
+        summary["cases"] += count
+        cleanup_queue.enqueue(renditions)
+        # Object stores have their own lifecycle rules for this
+        if cold_storage and storage.is_local:
+            summary["cold_files"] += move_to_cold_storage(files)
+        time.sleep(ARCHIVE_BATCH_PAUSE)
+
+    while True:
+        count = archive_notification_batch(cutoff, batch_size)
+        if not count:
+            break
+        summary["notifications"] += count
+        time.sleep(ARCHIVE_BATCH_PAUSE)
+
+    return summary
+
+
+def start_archive_scheduler(interval_hours=ARCHIVE_INTERVAL_HOURS):
+    def loop():
+        while True:
+            time.sleep(interval_hours * 3600)
+            try:
+                print(f"[ARCHIVE] {run_archive()}")
+            except Exception as e:
+                print(f"[ERROR] Archive run failed: {e}")
+
+    thread = threading.Thread(target=loop, name="archive-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old resolved cases and read notifications to the archive tables")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--cold-storage", action="store_true", default=bool(ARCHIVE_COLD_DIR),
+                        help="gzip archived evidence files into ARCHIVE_COLD_DIR")
+    args = parser.parse_args()
+    if args.cold_storage and not ARCHIVE_COLD_DIR:
+        parser.error("set ARCHIVE_COLD_DIR to use --cold-storage")
+    print(run_archive(args.days, args.batch_size, args.cold_storage))
+    # Let the cleanup thread finish deleting renditions before exiting
+    cleanup_queue.join()
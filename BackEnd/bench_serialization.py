@@ -0,0 +1,80 @@
+import argparse
+import datetime
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from typing import List
+
+from main import CaseResponse
+from models import Case, Evidence
+from serializers import FastJSONResponse, orjson
+
+# Serialization-only comparison for a big case list:
+#   old: ORM objects with names set as attributes -> response_model validation
+#        (from_attributes) -> jsonable_encoder -> JSONResponse
+#   new: prebuilt dicts (what serializers.case_rows returns) -> FastJSONResponse
+#
+#   python bench_serialization.py --cases 10000
+
+
+def make_cases(n, evidence_per_case):
+    now = datetime.datetime.utcnow()
+    cases = []
+    rows = []
+    for i in range(n):
+        evidence = [
+            Evidence(id=i * evidence_per_case + j, case_id=i, file_path=f"/uploads/{i}_{j}.jpg", file_type="image")
+            for j in range(evidence_per_case)
+        ]
+        case = Case(
+            id=i, user_id=1, police_id=2, court_id=5, title=f"Case {i}",
+            description="Lorem ipsum dolor sit amet " * 4, incident_date="2026-03-02",
+            status="pending", created_at=now, evidence=evidence,
+        )
+        case.user_name = "Citizen"
+        case.police_name = "Police Station"
+        case.court_name = "High Court"
+        cases.append(case)
+        rows.append({
+            "id": i, "user_id": 1, "police_id": 2, "title": case.title, "description": case.description,
+            "incident_date": case.incident_date, "status": case.status, "created_at": now,
+            "police_name": "Police Station", "court_id": 5, "court_name": "High Court", "user_name": "Citizen",
+            "evidence": [{"id": e.id, "file_path": e.file_path, "file_type": e.file_type} for e in evidence],
+        })
+    return cases, rows
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=10000)
+    parser.add_argument("--evidence", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cases, rows = make_cases(args.cases, args.evidence)
+    adapter = TypeAdapter(List[CaseResponse])
+
+    def old_path():
+        validated = adapter.validate_python(cases, from_attributes=True)
+        return JSONResponse(jsonable_encoder(validated)).body
+
+    def new_path():
+        return FastJSONResponse(rows).body
+
+    print(f"{args.cases} cases x {args.evidence} evidence, encoder: {'orjson' if orjson else 'json'}")
+    old_time, old_size = best_of(old_path, args.repeat)
+    new_time, new_size = best_of(new_path, args.repeat)
+    print(f"orm + response_model : {old_time * 1000:8.1f} ms  ({old_size} bytes)")
+    print(f"dict + fast encoder  : {new_time * 1000:8.1f} ms  ({new_size} bytes)")
+    print(f"speedup              : {old_time / new_time:8.1f}x")
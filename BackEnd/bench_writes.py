@@ -0,0 +1,109 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import configure_sqlite, SQLITE_BUSY_TIMEOUT
+from models import Base, Notification, User
+from write_queue import WriteBatcher
+
+# Compares one-commit-per-request (with the old default connection settings and
+# with WAL + busy timeout) against the batched writer, with several
+# processes (like uvicorn --workers N) hammering the same SQLite file.
+#
+#   python bench_writes.py --workers 4 --threads 8 --writes 500
+
+
+def make_engine(db_path, tuned=True):
+    if not tuned:
+        # What database.py used to do: default journal, driver-managed transactions
+        return create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT})
+    configure_sqlite(engine)
+    return engine
+
+
+def notification_insert(i):
+    def write(db):
+        db.add(Notification(user_id=1, message=f"bench {i}", type="bench"))
+    return write
+
+
+def worker(mode, db_path, threads, writes, results):
+    engine = make_engine(db_path, tuned=mode != "legacy")
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    batcher = WriteBatcher(bind=engine) if mode == "batched" else None
+    errors = []
+
+    def request_loop(t):
+        for i in range(writes):
+            write = notification_insert(t * writes + i)
+            try:
+                if batcher:
+                    batcher.run(write)
+                else:
+                    db = Session()
+                    try:
+                        write(db)
+                        db.commit()
+                    finally:
+                        db.close()
+            except Exception as e:
+                errors.append(str(e))
+
+    pool = [threading.Thread(target=request_loop, args=(t,)) for t in range(threads)]
+    for th in pool:
+        th.start()
+    for th in pool:
+        th.join()
+    results.put((len(errors), batcher.stats if batcher else None))
+
+
+def run(mode, workers, threads, writes):
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = make_engine(db_path, tuned=mode != "legacy")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert().values(id=1, name="bench", email="bench@bench"))
+    engine.dispose()
+
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=worker, args=(mode, db_path, threads, writes, results)) for _ in range(workers)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    errors = 0
+    batches = 0
+    for _ in procs:
+        err, stats = results.get()
+        errors += err
+        if stats:
+            batches += stats["batches"]
+
+    total = workers * threads * writes
+    line = f"{mode:<10} | {total} writes in {elapsed:.2f}s | {(total - errors) / elapsed:,.0f} writes/s | errors: {errors}"
+    if mode == "batched":
+        line += f" | commits: {batches}"
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{args.workers} processes x {args.threads} threads x {args.writes} writes")
+    run("legacy", args.workers, args.threads, args.writes)
+    run("per-commit", args.workers, args.threads, args.writes)
+    run("batched", args.workers, args.threads, args.writes)
@@ -0,0 +1,217 @@
+import argparse
+import datetime
+import math
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+
+from database import SessionLocal
+from models import Case, CaseEvent, CaseDailyRollup, StageDurationRollup
+from write_queue import write_batcher
+
+# Case workflow history. Every status change goes through transition(), which
+# appends a case_events row and bumps the daily rollups for the case's police
+# station, its court (once it has one) and the "all" scope in the same write
+# transaction. Analytics read only the rollups, so a chart costs
+# O(days in range) whatever the size of the history.
+
+# Status a case enters -> rollup counter it bumps
+COUNTERS = {
+    "pending": "filed",
+    "under_review": "reviewed",
+    "sent_to_court": "sent_to_court",
+    "resolved": "resolved",
+}
+# Stages we report time-in-stage for, in workflow order
+STAGES = ["pending", "under_review", "sent_to_court"]
+
+# Histogram buckets grow by 2**(1/4) (~19%), so p90 is within that of exact
+BUCKET_BASE = 2 ** 0.25
+
+
+def duration_bucket(seconds):
+    return int(math.floor(math.log(max(seconds, 1), BUCKET_BASE)))
+
+
+def bucket_seconds(bucket):
+    # Geometric midpoint of the bucket
+    return BUCKET_BASE ** (bucket + 0.5)
+
+
+def event_scopes(police_id, court_id):
+    scopes = [("all", 0)]
+    if police_id is not None:
+        scopes.append(("police", police_id))
+    if court_id is not None:
+        scopes.append(("court", court_id))
+    return scopes
+
+
+def bump_rollups(db, event):
+    day = event.created_at.date()
+    counter = COUNTERS.get(event.to_status) if event.from_status != event.to_status else None
+    for scope, scope_id in event_scopes(event.police_id, event.court_id):
+        if counter:
+            stmt = insert(CaseDailyRollup).values(day=day, scope=scope, scope_id=scope_id, **{counter: 1})
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["day", "scope", "scope_id"],
+                set_={counter: func.coalesce(getattr(CaseDailyRollup, counter), 0) + 1},
+            ))
+        if event.stage_seconds is not None and event.from_status in STAGES:
+            stmt = insert(StageDurationRollup).values(
+                day=day, scope=scope, scope_id=scope_id, stage=event.from_status,
+                bucket=duration_bucket(event.stage_seconds), count=1, total_seconds=event.stage_seconds,
+            )
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["day", "scope", "scope_id", "stage", "bucket"],
+                set_={
+                    "count": StageDurationRollup.count + 1,
+                    "total_seconds": StageDurationRollup.total_seconds + stmt.excluded.total_seconds,
+                },
+            ))
+
+
+def transition(db, case, to_status, actor_id=None, actor_role=None, now=None):
+    """Moves a case (ORM object in a write session) to to_status, logging the
+    event and updating the rollups. A no-op if it's already there. For a newly
+    filed case call it after flush() with to_status="pending"."""
+    now = now or datetime.datetime.utcnow()
+    from_status = None if case.status_changed_at is None and to_status == "pending" else case.status
+    if from_status == to_status:
+        return None
+
+    entered = case.status_changed_at or case.created_at
+    event = CaseEvent(
+        case_id=case.id,
+        from_status=from_status,
+        to_status=to_status,
+        actor_id=actor_id,
+        actor_role=actor_role,
+        police_id=case.police_id,
+        court_id=case.court_id,
+        stage_seconds=(now - entered).total_seconds() if from_status and entered else None,
+        created_at=now,
+    )
+    db.add(event)
+    case.status = to_status
+    case.status_changed_at = now
+    bump_rollups(db, event)
+    return event
+
+
+# --- ANALYTICS ---
+
+def rollup_scope(scope, scope_id):
+    return [CaseDailyRollup.scope == scope, CaseDailyRollup.scope_id == scope_id]
+
+
+def daily_counts(db, scope, scope_id, start):
+    rows = db.query(
+        CaseDailyRollup.day, CaseDailyRollup.filed, CaseDailyRollup.reviewed,
+        CaseDailyRollup.sent_to_court, CaseDailyRollup.resolved
+    ).filter(*rollup_scope(scope, scope_id), CaseDailyRollup.day >= start).order_by(CaseDailyRollup.day).all()
+    return [
+        {"day": day, "filed": filed or 0, "reviewed": reviewed or 0, "sent_to_court": sent or 0, "resolved": resolved or 0}
+        for day, filed, reviewed, sent, resolved in rows
+    ]
+
+
+def stage_times(db, scope, scope_id, start):
+    rows = db.query(
+        StageDurationRollup.stage, StageDurationRollup.bucket,
+        func.sum(StageDurationRollup.count), func.sum(StageDurationRollup.total_seconds)
+    ).filter(
+        StageDurationRollup.scope == scope, StageDurationRollup.scope_id == scope_id, StageDurationRollup.day >= start
+    ).group_by(StageDurationRollup.stage, StageDurationRollup.bucket).order_by(StageDurationRollup.stage, StageDurationRollup.bucket).all()
+
+    histograms = {stage: [] for stage in STAGES}
+    for stage, bucket, count, total in rows:
+        histograms.setdefault(stage, []).append((bucket, count, total))
+
+    result = {}
+    for stage, buckets in histograms.items():
+        count = sum(c for _, c, _ in buckets)
+        if not count:
+            result[stage] = {"count": 0, "mean_seconds": None, "p90_seconds": None}
+            continue
+        target, seen, p90 = math.ceil(0.9 * count), 0, None
+        for bucket, c, _ in buckets:
+            seen += c
+            if seen >= target:
+                p90 = bucket_seconds(bucket)
+                break
+        result[stage] = {
+            "count": count,
+            "mean_seconds": sum(t for _, _, t in buckets) / count,
+            "p90_seconds": p90,
+        }
+    return result
+
+
+def backlog(db, scope, scope_id):
+    # Open cases per stage and since when the oldest has been waiting; reads
+    # current cases only (status index), not history
+    criteria = [Case.status.in_(STAGES)]
+    if scope == "police":
+        criteria.append(Case.police_id == scope_id)
+    elif scope == "court":
+        criteria.append(Case.court_id == scope_id)
+    rows = db.query(
+        Case.status, func.count(Case.id), func.min(func.coalesce(Case.status_changed_at, Case.created_at))
+    ).filter(*criteria).group_by(Case.status).all()
+    result = {stage: {"open": 0, "oldest_since": None} for stage in STAGES}
+    for status, count, oldest in rows:
+        result[status] = {"open": count, "oldest_since": oldest}
+    return result
+
+
+def analytics_version(db):
+    return db.query(func.max(CaseEvent.id)).scalar()
+
+
+# --- MAINTENANCE ---
+
+def backfill_events():
+    """Seeds events for cases from before the event log existed: "filed" at
+    created_at, plus one move to the current status. Their stage times are
+    unknown, so they only count towards the daily totals."""
+    def write(db):
+        cases = db.query(Case).filter(Case.id.not_in(select(CaseEvent.case_id))).all()
+        for case in cases:
+            filed_at = case.created_at or datetime.datetime.utcnow()
+            changed_at = case.updated_at or filed_at
+            db.add(CaseEvent(case_id=case.id, to_status="pending", actor_id=case.user_id, actor_role="user",
+                             police_id=case.police_id, court_id=case.court_id, created_at=filed_at))
+            if case.status and case.status != "pending":
+                db.add(CaseEvent(case_id=case.id, from_status="pending", to_status=case.status,
+                                 police_id=case.police_id, court_id=case.court_id, created_at=changed_at))
+            case.status_changed_at = case.status_changed_at or changed_at
+        return len(cases)
+
+    return write_batcher.run(write)
+
+
+def rebuild_rollups():
+    """Recomputes every rollup from the event log (rollups are derived data)."""
+    def write(db):
+        db.query(CaseDailyRollup).delete(synchronize_session=False)
+        db.query(StageDurationRollup).delete(synchronize_session=False)
+        events = db.query(CaseEvent).order_by(CaseEvent.id).yield_per(1000)
+        count = 0
+        for event in events:
+            bump_rollups(db, event)
+            count += 1
+        return count
+
+    return write_batcher.run(write)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Case event log maintenance")
+    parser.add_argument("--backfill", action="store_true", help="log cases filed before the event log existed")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the daily rollups from the event log")
+    args = parser.parse_args()
+    if args.backfill:
+        print(f"Backfilled {backfill_events()} cases")
+    if args.rebuild or args.backfill:
+        print(f"Replayed {rebuild_rollups()} events")
@@ -0,0 +1,51 @@
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+# Responses smaller than this aren't worth compressing
+COMPRESSION_MINIMUM_SIZE = 1024
+# Uploaded media and evidence bundles are already compressed
+UNCOMPRESSED_PATHS = ("/uploads",)
+UNCOMPRESSED_SUFFIXES = (".zip",)
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size, quality=4):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def apply_compression(self, body, *, more_body):
+        data = self.compressor.process(body)
+        return data + (self.compressor.flush() if more_body else self.compressor.finish())
+
+
+class CompressionMiddleware:
+    """Picks br (if the brotli package is installed) or gzip from
+    Accept-Encoding, reusing Starlette's responders for the size threshold
+    and streaming handling."""
+
+    def __init__(self, app, minimum_size=COMPRESSION_MINIMUM_SIZE, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(UNCOMPRESSED_PATHS) or scope["path"].endswith(UNCOMPRESSED_SUFFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        accept = Headers(scope=scope).get("accept-encoding", "")
+        if brotli is not None and "br" in accept:
+            responder = BrotliResponder(self.app, self.minimum_size, quality=self.brotli_quality)
+        elif "gzip" in accept:
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=self.gzip_level)
+        else:
+            responder = self.app
+        await responder(scope, receive, send)
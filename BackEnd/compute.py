@@ -0,0 +1,222 @@
+import heapq
+import importlib
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Shared process pool for CPU-bound media work (image decoding and resizing,
+# video renditions), so it runs on every core instead of contending with
+# request handling for the GIL. Tasks wait in a priority queue and are handed
+# to the pool only when a worker is free, so a request waiting on a result
+# overtakes queued background work; non-interactive tasks never occupy the
+# last free worker. A task can be cancelled any time before a worker picks
+# it up. Tasks and results are pickled: pass file
+# paths, not file contents.
+
+# At least 2, so one worker can be kept free for interactive tasks
+COMPUTE_WORKERS = max(2, int(os.getenv("COMPUTE_WORKERS", str(os.cpu_count() or 1))))
+# Imported by each worker at start so the first task doesn't pay for it
+# (missing optional ones are skipped)
+COMPUTE_WARM_MODULES = ("PIL.Image", "PIL.ImageOps", "numpy", "cv2")
+
+PRIORITY_INTERACTIVE = 0  # a request is waiting on the result
+PRIORITY_BATCH = 1        # case batch analysis
+PRIORITY_BACKGROUND = 2   # renditions and previews of new uploads
+
+
+def warm_up(modules=COMPUTE_WARM_MODULES):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    try:
+        from PIL import Image
+        Image.init()  # registers every format plugin up front
+    except ImportError:
+        pass
+
+
+def ready():
+    return os.getpid()
+
+
+class ComputeEngine:
+    def __init__(self, workers=COMPUTE_WORKERS):
+        self.workers = workers
+        # Non-interactive tasks never take the last worker, so a request
+        # waiting on a result doesn't sit behind a long video render
+        self.background_limit = max(1, workers - 1)
+        self._pending = []
+        self._order = itertools.count()
+        self._pool = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._running = 0
+        self._background_running = 0
+        self._busy_seconds = 0.0
+        self._stopping = False
+        self._started_at = time.monotonic()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0}
+
+    def start(self):
+        # Starts (and warms up) every worker now rather than on first use
+        self._ensure_thread()
+        for future in [self.submit(ready, priority=PRIORITY_INTERACTIVE) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        # Cancels queued tasks, waits for running ones and stops the workers.
+        # A later submit() starts a fresh pool.
+        with self._changed:
+            thread, pool = self._thread, self._pool
+            if thread is None or self._pid != os.getpid():
+                return
+            self._stopping = True
+            pending, self._pending = self._pending, []
+            self._changed.notify_all()
+        # Outside the lock: done callbacks may submit follow-up work
+        cancelled = sum(future.cancel() for _, _, future, _, _ in pending)
+        thread.join()
+        pool.shutdown(wait=True)
+        with self._lock:
+            self.stats["cancelled"] += cancelled
+            self._thread = self._pool = None
+            self._stopping = False
+
+    def submit(self, fn, *args, priority=PRIORITY_BACKGROUND):
+        """Queues fn(*args) for a worker process. Returns a Future;
+        future.cancel() succeeds until the task has been handed to a worker."""
+        self._ensure_thread()
+        future = Future()
+        with self._changed:
+            if self._stopping:
+                # Nothing will pick it up any more
+                future.cancel()
+                self.stats["cancelled"] += 1
+                return future
+            heapq.heappush(self._pending, (priority, next(self._order), future, fn, args))
+            self.stats["submitted"] += 1
+            self._changed.notify()
+        return future
+
+    def run(self, fn, *args, priority=PRIORITY_INTERACTIVE, timeout=None):
+        future = self.submit(fn, *args, priority=priority)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._started_at
+            return {
+                **self.stats,
+                "workers": self.workers,
+                "background_limit": self.background_limit,
+                "queued": len(self._pending),
+                "running": self._running,
+                "background_running": self._background_running,
+                # Share of worker time spent on tasks since start
+                "utilization": round(self._busy_seconds / (elapsed * self.workers), 4) if elapsed else 0.0,
+            }
+
+    def _new_pool(self):
+        # Not fork: the API process already runs writer / scheduler threads,
+        # and a forked child could inherit one of their locks held. Workers
+        # fork from a clean server process that has the warm modules loaded.
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(list(COMPUTE_WARM_MODULES))
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up, mp_context=context)
+
+    def _ensure_thread(self):
+        # Threads and pools don't survive fork, so each uvicorn worker starts its own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending = []
+            self._running = 0
+            self._background_running = 0
+            self._busy_seconds = 0.0
+            self._started_at = time.monotonic()
+            self._pool = self._new_pool()
+            self._thread = threading.Thread(target=self._dispatch, name="compute-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _replace_pool(self, broken):
+        # A worker died (OOM, segfault in a decoder); start a fresh pool
+        with self._lock:
+            if self._pool is not broken:
+                return
+            print("[ERROR] Compute pool broke, restarting it")
+            self._pool = self._new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _next_task(self):
+        # Highest priority task that may run now; waits until there is one.
+        # None once the engine is shutting down.
+        with self._changed:
+            while True:
+                if self._stopping:
+                    return None
+                if self._pending and self._running < self.workers:
+                    priority = self._pending[0][0]
+                    if priority == PRIORITY_INTERACTIVE or self._background_running < self.background_limit:
+                        priority, _, future, fn, args = heapq.heappop(self._pending)
+                        if not future.set_running_or_notify_cancel():
+                            self.stats["cancelled"] += 1
+                            continue
+                        self._running += 1
+                        if priority != PRIORITY_INTERACTIVE:
+                            self._background_running += 1
+                        return priority, future, fn, args, self._pool
+                self._changed.wait()
+
+    def _dispatch(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            priority, future, fn, args, pool = task
+            started = time.monotonic()
+            try:
+                task = pool.submit(fn, *args)
+            except BrokenProcessPool as e:
+                self._replace_pool(pool)
+                self._finished(future, priority, None, started, e)
+                continue
+            task.add_done_callback(
+                lambda task, future=future, priority=priority, started=started, pool=pool: self._done(future, priority, task, started, pool)
+            )
+
+    def _done(self, future, priority, task, started, pool):
+        error = task.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._replace_pool(pool)
+        self._finished(future, priority, None if error else task.result(), started, error)
+
+    def _finished(self, future, priority, result, started, error):
+        with self._changed:
+            self._running -= 1
+            if priority != PRIORITY_INTERACTIVE:
+                self._background_running -= 1
+            self._busy_seconds += time.monotonic() - started
+            self.stats["failed" if error is not None else "completed"] += 1
+            self._changed.notify()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+compute_engine = ComputeEngine()
@@ -1,10 +1,39 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 Database_URL = "sqlite:///test.db"
 
-engine = create_engine(Database_URL, connect_args = {"check_same_thread": False})
+# How long (seconds) a connection waits on SQLite's writer lock before giving up
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
+engine = create_engine(Database_URL, connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT})
+
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself (see "begin" hook below) so SAVEPOINT works
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers keep going while one worker holds the write lock
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}")
+    # Off by default in SQLite; needed for ON DELETE CASCADE / SET NULL
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def do_begin(conn):
+    # Writers pass sqlite_begin="IMMEDIATE" to take the write lock up front
+    # instead of failing on a read->write upgrade halfway through a transaction
+    mode = conn.get_execution_options().get("sqlite_begin")
+    conn.exec_driver_sql(f"BEGIN {mode}" if mode else "BEGIN")
+
+def configure_sqlite(target_engine):
+    event.listen(target_engine, "connect", set_sqlite_pragma)
+    event.listen(target_engine, "begin", do_begin)
+
+configure_sqlite(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -13,4 +42,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -0,0 +1,74 @@
+import hashlib
+
+from fastapi import Response
+from sqlalchemy import func, select, union
+
+from models import User, Case, Evidence, NewsPost, archived_cases, archived_notifications
+from serializers import FastJSONResponse
+
+# Weak ETags for polled dashboard/list endpoints. The tag is derived from a
+# cheap "version" of the rows behind a response (row count + latest
+# updated_at, or latest id for append-only tables) instead of hashing the
+# body, so an unchanged poll costs one aggregate query and returns 304.
+
+
+def make_etag(*parts):
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def people_version(*user_ids):
+    # Latest change to any of the users the rows name (filer, station, court),
+    # since the responses carry their names
+    return select(func.max(User.updated_at)).where(User.id.in_(union(*user_ids))).scalar_subquery()
+
+
+def case_version(db, *criteria):
+    people = people_version(
+        select(Case.user_id).where(*criteria),
+        select(Case.police_id).where(*criteria),
+        select(Case.court_id).where(*criteria),
+    )
+    return db.query(func.count(Case.id), func.max(Case.updated_at), people).filter(*criteria).one()
+
+
+def evidence_version(db, *criteria):
+    return db.query(func.count(Evidence.id), func.max(Evidence.updated_at)).join(Case, Case.id == Evidence.case_id).filter(*criteria).one()
+
+
+def news_version(db, *criteria):
+    # News posts are only ever created or deleted
+    people = people_version(select(NewsPost.police_id).where(*criteria))
+    return db.query(func.count(NewsPost.id), func.max(NewsPost.id), people).filter(*criteria).one()
+
+
+def user_version(db, *criteria):
+    return db.query(func.count(User.id), func.max(User.updated_at)).filter(*criteria).one()
+
+
+def archive_version(db):
+    # Archive tables only change when the archival job runs
+    return (
+        db.query(func.max(archived_cases.c.archived_at)).scalar(),
+        db.query(func.max(archived_notifications.c.archived_at)).scalar(),
+    )
+
+
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes don't matter
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def conditional_response(request, etag, build):
+    """304 if the client already has this version, otherwise call build()
+    for the content. no-cache makes browsers revalidate on every poll."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(build(), headers=headers)
@@ -0,0 +1,67 @@
+import os
+import queue
+import threading
+
+from storage import storage
+
+
+class FileCleanupQueue:
+    """
+    Background unlinking of upload files whose rows have been deleted, so a
+    request deleting a case with hundreds of evidence files doesn't wait on
+    the filesystem or object store. Paths are the "/uploads/..." values
+    stored in the DB; a path ending in "/" removes the whole directory
+    (rendition sets under uploads/media/).
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {"removed": 0, "missing": 0, "failed": 0}
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="file-cleanup", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, paths):
+        paths = [p for p in paths if p]
+        if not paths:
+            return
+        self._ensure_thread()
+        for path in paths:
+            self._queue.put(path)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def join(self):
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                if path.endswith("/"):
+                    storage.delete_tree(path)
+                else:
+                    storage.delete(path)
+                self.stats["removed"] += 1
+            except FileNotFoundError:
+                self.stats["missing"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"Error deleting file {path}: {e}")
+            finally:
+                self._queue.task_done()
+
+
+cleanup_queue = FileCleanupQueue()
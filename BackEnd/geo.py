@@ -0,0 +1,117 @@
+import argparse
+import json
+import math
+
+from sqlalchemy import text
+
+from database import engine
+from write_queue import write_batcher
+
+# Nearest police station / court lookup. Each kind has an SQLite R*Tree
+# (user id -> lat/lon point) kept in step with users.latitude / longitude,
+# so a lookup searches a box around the caller and only reads the stations
+# inside it. The box grows until it holds k results within its inscribed
+# circle, which guarantees nothing closer was left outside. Approval status
+# is checked against users at query time, so approving or rejecting a
+# station needs no index update. Longitudes don't wrap at the antimeridian.
+
+LOCATION_INDEXES = {"police": "police_locations", "court": "court_locations"}
+ROLE_KINDS = {"police": "police", "court": "court", "CourtOfficial": "court"}
+
+EARTH_RADIUS_KM = 6371.0
+# On the same sphere haversine_km uses; a larger value would make the search
+# box smaller than the circle it has to contain
+KM_PER_DEGREE_LAT = EARTH_RADIUS_KM * math.pi / 180
+NEAREST_START_KM = 25.0
+NEAREST_MAX_K = 50
+
+
+def ensure_location_indexes():
+    """Creates the R*Tree tables (create_all doesn't do virtual tables).
+    Returns True if any is empty, i.e. may need filling. Every uvicorn worker
+    runs this at import, so it must not fail when another worker got there
+    first; a rebuild is one write op, so two of them are harmless."""
+    with engine.begin() as conn:
+        for table in LOCATION_INDEXES.values():
+            conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING rtree(id, min_lat, max_lat, min_lon, max_lon)"))
+        return any(
+            conn.execute(text(f"SELECT 1 FROM {table} LIMIT 1")).first() is None
+            for table in LOCATION_INDEXES.values()
+        )
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def set_location(db, user):
+    # Call in a write op after changing a user's role or coordinates
+    for table in LOCATION_INDEXES.values():
+        db.execute(text(f"DELETE FROM {table} WHERE id = :id"), {"id": user.id})
+    kind = ROLE_KINDS.get(user.role)
+    if kind and user.latitude is not None and user.longitude is not None:
+        db.execute(
+            text(f"INSERT INTO {LOCATION_INDEXES[kind]} VALUES (:id, :lat, :lat, :lon, :lon)"),
+            {"id": user.id, "lat": user.latitude, "lon": user.longitude},
+        )
+
+
+def drop_locations(db, user_ids):
+    for table in LOCATION_INDEXES.values():
+        db.execute(text(f"DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(:ids))"), {"ids": json.dumps(list(user_ids))})
+
+
+def nearest(db, kind, lat, lon, k):
+    """Up to k approved stations (or courts) closest to lat/lon, nearest
+    first, each with distance_km."""
+    table = LOCATION_INDEXES[kind]
+    query = text(
+        f"SELECT u.id, u.name, u.email, u.phoneNo, u.role, u.status, u.latitude, u.longitude, u.jurisdiction "
+        f"FROM {table} r JOIN users u ON u.id = r.id "
+        f"WHERE r.max_lat >= :lat_lo AND r.min_lat <= :lat_hi AND r.max_lon >= :lon_lo AND r.min_lon <= :lon_hi "
+        f"AND u.status = 'approved'"
+    )
+    radius = NEAREST_START_KM
+    while True:
+        dlat = radius / KM_PER_DEGREE_LAT
+        # Widest at the box edge nearest the pole, so the circle fits inside
+        dlon = radius / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(min(90.0, abs(lat) + dlat))), 0.01))
+        rows = db.execute(query, {
+            "lat_lo": lat - dlat, "lat_hi": lat + dlat, "lon_lo": lon - dlon, "lon_hi": lon + dlon,
+        }).mappings().all()
+        found = sorted(
+            ({**row, "distance_km": haversine_km(lat, lon, row["latitude"], row["longitude"])} for row in rows),
+            key=lambda row: row["distance_km"],
+        )
+        whole_earth = radius >= math.pi * EARTH_RADIUS_KM
+        within = [row for row in found if row["distance_km"] <= radius]
+        if len(within) >= k or whole_earth:
+            return (found if whole_earth else within)[:k]
+        radius *= 4
+
+
+def rebuild_location_indexes():
+    def write(db):
+        for table in LOCATION_INDEXES.values():
+            db.execute(text(f"DELETE FROM {table}"))
+        count = 0
+        for kind, table in LOCATION_INDEXES.items():
+            roles = [role for role, role_kind in ROLE_KINDS.items() if role_kind == kind]
+            count += db.execute(text(
+                f"INSERT INTO {table} SELECT id, latitude, latitude, longitude, longitude FROM users "
+                f"WHERE role IN (SELECT value FROM json_each(:roles)) AND latitude IS NOT NULL AND longitude IS NOT NULL"
+            ), {"roles": json.dumps(roles)}).rowcount
+        return count
+
+    return write_batcher.run(write)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Police station / court location index")
+    parser.add_argument("--rebuild", action="store_true", help="refill the index from users.latitude / longitude")
+    args = parser.parse_args()
+    ensure_location_indexes()
+    if args.rebuild:
+        print(f"Indexed {rebuild_location_indexes()} locations")
@@ -0,0 +1,310 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import re
+import tempfile
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from admission import request_caller
+from database import SessionLocal
+from models import IdempotencyKey
+from write_queue import write_batcher
+
+# Idempotency-Key support for non-idempotent POSTs. Keys are scoped to the
+# caller. The first request with a key runs normally and its response is
+# stored; retries with the same key get that response replayed
+# (Idempotent-Replayed: true) without re-running the handler, and a retry
+# that arrives while the original is still running waits for it instead of
+# running in parallel. The body is spooled and hashed into the request
+# fingerprint before the key is claimed, so reusing a key for a different
+# request is refused; a replayed upload is never saved again. Only final
+# outcomes are stored: a response the client is expected to retry (429, 409,
+# 408, 5xx) releases the key. A claim is a lease the original keeps renewing
+# while it runs, so a key whose worker died is taken over by the next retry.
+
+IDEMPOTENCY_TTL = datetime.timedelta(hours=float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+# How long a duplicate waits on an in-flight original before giving up
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "120"))
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+# An in-progress claim not renewed for this long is up for takeover
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "30"))
+# Bodies bigger than this are spooled to a temp file
+IDEMPOTENCY_SPOOL_MEMORY = 1024 * 1024
+BODY_CHUNK_SIZE = 64 * 1024
+# Responses that mean "try again" rather than an outcome
+RETRYABLE_STATUSES = {408, 409, 425, 429}
+
+IDEMPOTENT_ROUTES = [
+    ("file_case", "POST", re.compile(r"^/user/file-case$")),
+    ("analyze", "POST", re.compile(r"^/evidence/\d+/analyze$")),
+]
+
+
+class BodyDigest:
+    """SHA-256 of a request body with the multipart boundary blanked out,
+    since clients usually pick a new boundary on every retry."""
+
+    def __init__(self, boundary=None):
+        self.digest = hashlib.sha256()
+        self.delimiter = b"--" + boundary.encode() if boundary else None
+        self.tail = b""
+
+    def update(self, chunk):
+        if not self.delimiter:
+            self.digest.update(chunk)
+            return
+        data = (self.tail + chunk).replace(self.delimiter, b"--")
+        # Hold back a possible partial delimiter until the next chunk
+        keep = len(self.delimiter) - 1
+        self.tail = data[-keep:] if len(data) > keep else data
+        self.digest.update(data[:len(data) - len(self.tail)])
+
+    def hexdigest(self):
+        self.digest.update(self.tail)
+        self.tail = b""
+        return self.digest.hexdigest()
+
+
+def multipart_boundary(content_type):
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    return match.group(1) if match else None
+
+
+def request_fingerprint(scope, headers, body_digest):
+    content_type = headers.get("content-type", "").split(";")[0]
+    parts = [scope["method"], scope["path"], scope.get("query_string", b"").decode(), content_type, body_digest]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def lease_expired(row, now):
+    return row.status == "in_progress" and (row.lease_expires_at is None or row.lease_expires_at < now)
+
+
+def claim_key(key, fingerprint, owner):
+    """Returns None if owner now holds the key, else the existing row as a dict."""
+    def write(db):
+        now = datetime.datetime.utcnow()
+        lease = now + datetime.timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+        row = db.query(IdempotencyKey).filter(IdempotencyKey.key == key).first()
+        if row and row.expires_at and row.expires_at < now:
+            db.delete(row)
+            db.flush()
+            row = None
+        if row and lease_expired(row, now):
+            # The original's worker died without an outcome: run it again
+            print(f"[DEBUG] Taking over idempotency key {key} from {row.owner}")
+            row.fingerprint, row.owner, row.lease_expires_at = fingerprint, owner, lease
+            row.expires_at = now + IDEMPOTENCY_TTL
+            return None
+        if row:
+            return {
+                "fingerprint": row.fingerprint,
+                "status": row.status,
+                "status_code": row.status_code,
+                "content_type": row.content_type,
+                "response_body": row.response_body,
+            }
+        db.add(IdempotencyKey(key=key, fingerprint=fingerprint, status="in_progress", owner=owner,
+                              lease_expires_at=lease, expires_at=now + IDEMPOTENCY_TTL))
+        # Piggyback cleanup of expired keys on new claims
+        db.query(IdempotencyKey).filter(IdempotencyKey.expires_at < now).delete(synchronize_session=False)
+        return None
+
+    return write_batcher.submit(write)
+
+
+def renew_lease(key, owner):
+    def write(db):
+        db.query(IdempotencyKey).filter(IdempotencyKey.key == key, IdempotencyKey.owner == owner).update({
+            "lease_expires_at": datetime.datetime.utcnow() + datetime.timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+        }, synchronize_session=False)
+
+    return write_batcher.submit(write)
+
+
+def complete_key(key, owner, status_code, content_type, body):
+    # Scoped to the owner: an original whose key was taken over leaves the
+    # new owner's row alone
+    def write(db):
+        row = db.query(IdempotencyKey).filter(IdempotencyKey.key == key, IdempotencyKey.owner == owner)
+        if status_code >= 500 or status_code in RETRYABLE_STATUSES:
+            # Not an outcome; let the client's retry run again
+            row.delete(synchronize_session=False)
+        else:
+            row.update({
+                "status": "completed",
+                "status_code": status_code,
+                "content_type": content_type,
+                "response_body": body,
+                "lease_expires_at": None,
+            }, synchronize_session=False)
+
+    return write_batcher.submit(write)
+
+
+def load_key(key):
+    db = SessionLocal()
+    try:
+        row = db.query(IdempotencyKey).filter(IdempotencyKey.key == key).first()
+        if not row:
+            return None
+        return {"status": row.status, "status_code": row.status_code,
+                "content_type": row.content_type, "response_body": row.response_body,
+                "abandoned": lease_expired(row, datetime.datetime.utcnow())}
+    finally:
+        db.close()
+
+
+async def send_json(send, status_code, payload, extra_headers=()):
+    body = json.dumps(payload).encode()
+    await send_stored(send, status_code, "application/json", body, extra_headers)
+
+
+async def send_stored(send, status_code, content_type, body, extra_headers=()):
+    headers = [(b"content-type", (content_type or "application/json").encode()),
+               (b"content-length", str(len(body)).encode())]
+    headers.extend(extra_headers)
+    await send({"type": "http.response.start", "status": status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def spool_body(receive, boundary):
+    # Reads the whole body into a (disk-backed past IDEMPOTENCY_SPOOL_MEMORY)
+    # temp file, hashing as it goes
+    spool = tempfile.SpooledTemporaryFile(max_size=IDEMPOTENCY_SPOOL_MEMORY)
+    digest = BodyDigest(boundary)
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunk = message.get("body", b"")
+        digest.update(chunk)
+        if chunk:
+            await run_in_threadpool(spool.write, chunk)
+        more_body = message.get("more_body", False)
+    await run_in_threadpool(spool.seek, 0)
+    return spool, digest.hexdigest()
+
+
+def replay_body(spool, receive):
+    # receive() for the app: the spooled body, then the real channel (for
+    # http.disconnect)
+    done = False
+
+    async def replay():
+        nonlocal done
+        if done:
+            return await receive()
+        chunk = await run_in_threadpool(spool.read, BODY_CHUNK_SIZE)
+        if len(chunk) < BODY_CHUNK_SIZE:
+            done = True
+        return {"type": "http.request", "body": chunk, "more_body": not done}
+
+    return replay
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+        # key -> Event, for duplicates arriving at this worker while the
+        # original is in flight here
+        self.in_flight = {}
+
+    def match(self, scope):
+        for name, method, pattern in IDEMPOTENT_ROUTES:
+            if scope["method"] == method and pattern.match(scope["path"]):
+                return name
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        header_key = headers.get("idempotency-key")
+        route = self.match(scope) if header_key else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = f"{route}:{request_caller(scope, headers)}:{header_key}"
+        spool, body_digest = await spool_body(receive, multipart_boundary(headers.get("content-type", "")))
+        try:
+            fingerprint = request_fingerprint(scope, headers, body_digest)
+            owner = uuid.uuid4().hex
+            existing = await asyncio.wrap_future(claim_key(key, fingerprint, owner))
+            if existing is None:
+                await self.run_original(key, owner, scope, replay_body(spool, receive), send)
+            else:
+                await self.answer_duplicate(key, fingerprint, existing, send)
+        finally:
+            await run_in_threadpool(spool.close)
+
+    async def answer_duplicate(self, key, fingerprint, existing, send):
+        if existing["fingerprint"] != fingerprint:
+            await send_json(send, 422, {"detail": "Idempotency-Key was already used for a different request"})
+            return
+        if existing["status"] == "in_progress":
+            existing = await self.wait_for(key)
+            if existing is None or existing["status"] != "completed":
+                # Original failed (row removed) or is still running
+                await send_json(send, 409, {"detail": "Original request with this Idempotency-Key is still in progress or failed, retry"},
+                                [(b"retry-after", b"1")])
+                return
+        await send_stored(send, existing["status_code"], existing["content_type"], existing["response_body"] or b"",
+                          [(b"idempotent-replayed", b"true")])
+
+    async def run_original(self, key, owner, scope, receive, send):
+        event = asyncio.Event()
+        self.in_flight[key] = (asyncio.get_running_loop(), event)
+        response = {"status": 500, "content_type": None, "body": bytearray()}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["content_type"] = Headers(raw=message["headers"]).get("content-type")
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+            await send(message)
+
+        async def keep_lease():
+            while True:
+                await asyncio.sleep(IDEMPOTENCY_LEASE_SECONDS / 3)
+                try:
+                    await asyncio.wrap_future(renew_lease(key, owner))
+                except Exception as e:
+                    print(f"[ERROR] Renewing idempotency lease for {key} failed: {e}")
+
+        renewer = asyncio.create_task(keep_lease())
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            renewer.cancel()
+            await asyncio.wrap_future(complete_key(key, owner, response["status"], response["content_type"], bytes(response["body"])))
+            event.set()
+            self.in_flight.pop(key, None)
+
+    async def wait_for(self, key):
+        loop, event = self.in_flight.get(key, (None, None))
+        if loop is asyncio.get_running_loop():
+            try:
+                await asyncio.wait_for(event.wait(), IDEMPOTENCY_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            return await run_in_threadpool(load_key, key)
+
+        # Original is running in another worker (or event loop): poll the
+        # shared table
+        deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            row = await run_in_threadpool(load_key, key)
+            # An abandoned claim is answered with "retry", and the retry takes it over
+            if row is None or row["status"] == "completed" or row["abandoned"] or asyncio.get_running_loop().time() > deadline:
+                return row
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
@@ -0,0 +1,277 @@
+import argparse
+import contextlib
+import datetime
+import hashlib
+import os
+import threading
+import time
+
+from sqlalchemy import or_, select
+
+from database import SessionLocal
+from models import Case, Evidence, CaseHashNode, archived_cases, archived_case_hash_nodes
+from storage import storage
+from write_queue import write_batcher
+
+# Chain of custody for evidence files. Each file's SHA-256 is taken while it
+# is being written at upload (or checked by the object store for direct
+# uploads), and every case keeps a Merkle tree over
+# (evidence id, sha256) leaves in case_hash_nodes. Adding or removing an item
+# only rewrites the O(log n) nodes on its path, and an inclusion proof is the
+# list of sibling hashes on that path, so proving one item never reads the
+# other files. A background verifier re-hashes files at a capped read rate
+# and flags any whose contents no longer match.
+
+INTEGRITY_VERIFY_BYTES_PER_SEC = int(float(os.getenv("INTEGRITY_VERIFY_MB_PER_SEC", "20")) * 1024 * 1024)
+# Off by default: every uvicorn worker that imports main would start its own
+# audit and re-read every file. Enable it in one process only, or run the CLI
+# from cron instead.
+INTEGRITY_VERIFY_INTERVAL_HOURS = float(os.getenv("INTEGRITY_VERIFY_INTERVAL_HOURS", "0"))
+INTEGRITY_VERIFY_PAGE = 100
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class IOBudget:
+    """Sleeps as needed to keep reads at or under bytes_per_sec on average."""
+
+    def __init__(self, bytes_per_sec):
+        self.bytes_per_sec = bytes_per_sec
+        self.started = time.monotonic()
+        self.spent = 0
+
+    def consume(self, nbytes):
+        self.spent += nbytes
+        ahead = self.spent / self.bytes_per_sec - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def hash_file(file_path, budget=None):
+    digest = hashlib.sha256()
+    with contextlib.closing(storage.open(file_path)) as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            if budget is not None:
+                budget.consume(len(chunk))
+    return digest.hexdigest()
+
+
+# Domain-separated so a leaf can never be passed off as an inner node
+def leaf_hash(evidence_id, sha256):
+    return hashlib.sha256(b"\x00" + f"{evidence_id}:{sha256}".encode()).hexdigest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(b"\x01" + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def level_sizes(size):
+    # Nodes per level. A node without a right sibling is carried up as is.
+    sizes = [size]
+    while sizes[-1] > 1:
+        sizes.append((sizes[-1] + 1) // 2)
+    return sizes
+
+
+def verify_proof(leaf, path, root):
+    current = leaf
+    for step in path:
+        current = node_hash(step["hash"], current) if step["side"] == "left" else node_hash(current, step["hash"])
+    return current == root
+
+
+class CaseTree:
+    """One case's hash tree, read and written through the given session.
+    Changes must run inside a write_batcher op so updates to a case are
+    serialized. An archived case's tree (nodes=archived_case_hash_nodes)
+    is read-only."""
+
+    def __init__(self, db, case, nodes=CaseHashNode.__table__):
+        self.db = db
+        self.case = case
+        self.nodes = nodes
+        self.size = case.evidence_leaves or 0
+        self._nodes = {}
+
+    def get(self, level, position):
+        key = (level, position)
+        if key not in self._nodes:
+            self._nodes[key] = self.db.execute(select(self.nodes.c.hash).where(
+                self.nodes.c.case_id == self.case.id,
+                self.nodes.c.level == level,
+                self.nodes.c.position == position,
+            )).scalar()
+        return self._nodes[key]
+
+    def set(self, level, position, value):
+        self.db.merge(CaseHashNode(case_id=self.case.id, level=level, position=position, hash=value))
+        self._nodes[(level, position)] = value
+
+    def root(self):
+        return self.get(len(level_sizes(self.size)) - 1, 0) if self.size else None
+
+    def append(self, evidence):
+        position = self.size
+        self.size += 1
+        evidence.tree_position = position
+        self.set(0, position, leaf_hash(evidence.id, evidence.content_hash))
+        self._update_path(position)
+        self._save()
+
+    def remove(self, evidence):
+        # The last leaf moves into the hole so the tree stays dense
+        position, last = evidence.tree_position, self.size - 1
+        if position != last:
+            moved = self.db.query(Evidence).filter(Evidence.case_id == self.case.id, Evidence.tree_position == last).one()
+            moved.tree_position = position
+            self.set(0, position, self.get(0, last))
+        evidence.tree_position = None
+
+        old_sizes = level_sizes(self.size)
+        self.size -= 1
+        new_sizes = level_sizes(self.size)
+        self.db.flush()
+        for level, old_size in enumerate(old_sizes):
+            keep = new_sizes[level] if level < len(new_sizes) else 0
+            if keep < old_size:
+                self.db.query(CaseHashNode).filter(
+                    CaseHashNode.case_id == self.case.id,
+                    CaseHashNode.level == level,
+                    CaseHashNode.position >= keep,
+                ).delete(synchronize_session="evaluate")
+                for stale in range(keep, old_size):
+                    self._nodes[(level, stale)] = None
+
+        if position != last:
+            self._update_path(position)
+        if self.size:
+            self._update_path(self.size - 1)
+        self._save()
+
+    def proof(self, position):
+        path = []
+        sizes = level_sizes(self.size)
+        for level in range(len(sizes) - 1):
+            sibling = position ^ 1
+            if sibling < sizes[level]:
+                path.append({"side": "left" if sibling < position else "right", "hash": self.get(level, sibling)})
+            position //= 2
+        return path
+
+    def _update_path(self, position):
+        sizes = level_sizes(self.size)
+        for level in range(len(sizes) - 1):
+            position //= 2
+            left = self.get(level, 2 * position)
+            right = self.get(level, 2 * position + 1) if 2 * position + 1 < sizes[level] else None
+            self.set(level + 1, position, node_hash(left, right) if right else left)
+
+    def _save(self):
+        self.case.evidence_leaves = self.size
+        self.case.evidence_root = self.root()
+        # Write sessions don't autoflush; later trees in the same op read these rows
+        self.db.flush()
+
+
+def add_to_tree(db, evidence):
+    case = db.query(Case).filter(Case.id == evidence.case_id).first()
+    if case and evidence.content_hash and evidence.tree_position is None:
+        CaseTree(db, case).append(evidence)
+
+
+def remove_from_tree(db, evidence):
+    case = db.query(Case).filter(Case.id == evidence.case_id).first()
+    if case and evidence.tree_position is not None:
+        CaseTree(db, case).remove(evidence)
+
+
+def inclusion_proof(db, evidence, archived=False):
+    # evidence: a live Evidence or an archived_evidence row
+    cases, nodes = (archived_cases, archived_case_hash_nodes) if archived else (Case.__table__, CaseHashNode.__table__)
+    case = db.execute(select(cases).where(cases.c.id == evidence.case_id)).first()
+    tree = CaseTree(db, case, nodes)
+    return {
+        "evidence_id": evidence.id,
+        "case_id": case.id,
+        "sha256": evidence.content_hash,
+        "leaf_hash": leaf_hash(evidence.id, evidence.content_hash),
+        "position": evidence.tree_position,
+        "tree_size": tree.size,
+        "root": case.evidence_root,
+        "path": tree.proof(evidence.tree_position),
+    }
+
+
+# --- VERIFIER ---
+
+def record_check(evidence_id, status, digest):
+    # Files hashed for the first time (uploaded before hashes were kept)
+    # get their hash recorded and join the case tree
+    def write(db):
+        evidence = db.query(Evidence).filter(Evidence.id == evidence_id).first()
+        if not evidence:
+            return
+        if status == "verified" and evidence.content_hash is None:
+            evidence.content_hash = digest
+        if status == "verified":
+            add_to_tree(db, evidence)
+        evidence.integrity_status = status
+        evidence.verified_at = datetime.datetime.utcnow()
+
+    write_batcher.run(write)
+
+
+def run_verification(bytes_per_sec=INTEGRITY_VERIFY_BYTES_PER_SEC, limit=None):
+    """Re-hashes evidence files, least recently verified first."""
+    budget = IOBudget(bytes_per_sec)
+    summary = {"verified": 0, "tampered": 0, "missing": 0, "bytes_read": 0}
+    started = datetime.datetime.utcnow()
+    checked = 0
+    while limit is None or checked < limit:
+        db = SessionLocal()
+        try:
+            page = db.query(Evidence.id, Evidence.file_path, Evidence.content_hash).filter(
+                or_(Evidence.verified_at == None, Evidence.verified_at < started)
+            ).order_by(Evidence.verified_at.is_not(None), Evidence.verified_at, Evidence.id).limit(INTEGRITY_VERIFY_PAGE).all()
+        finally:
+            db.close()
+        if not page:
+            break
+
+        for evidence_id, file_path, expected in page:
+            if limit is not None and checked >= limit:
+                break
+            checked += 1
+            if not storage.exists(file_path):
+                status, digest = "missing", None
+            else:
+                digest = hash_file(file_path, budget)
+                status = "verified" if expected is None or digest == expected else "tampered"
+            if status != "verified":
+                print(f"[INTEGRITY] Evidence {evidence_id} ({file_path}) is {status}")
+            record_check(evidence_id, status, digest)
+            summary[status] += 1
+    summary["bytes_read"] = budget.spent
+    return summary
+
+
+def start_integrity_verifier(interval_hours=INTEGRITY_VERIFY_INTERVAL_HOURS):
+    def loop():
+        while True:
+            time.sleep(interval_hours * 3600)
+            try:
+                print(f"[INTEGRITY] {run_verification()}")
+            except Exception as e:
+                print(f"[ERROR] Integrity verification failed: {e}")
+
+    thread = threading.Thread(target=loop, name="integrity-verifier", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-hash evidence files and flag any that no longer match their recorded SHA-256")
+    parser.add_argument("--mb-per-sec", type=float, default=INTEGRITY_VERIFY_BYTES_PER_SEC / (1024 * 1024))
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many files")
+    args = parser.parse_args()
+    print(run_verification(int(args.mb_per_sec * 1024 * 1024), args.limit))
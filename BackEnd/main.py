@@ -1,10 +1,11 @@
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form,BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form,BackgroundTasks, Query, Response, Request
 import datetime
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, RedirectResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, or_, and_, select
 from database import get_db, engine
-from models import User, Admin, Case, Evidence, Notification
+from models import User, Admin, Case, Evidence, Notification, AnalysisBatch, archived_cases, archived_evidence
 import models
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -16,11 +17,73 @@ import uuid
 from fastapi import BackgroundTasks
 from ai_utils import get_analyzer
 from database import SessionLocal
+from write_queue import write_batcher
+from file_cleanup import cleanup_queue
+from case_export import iter_case_register, EXPORT_FORMATS
+from evidence_zip import stream_evidence_zip, evidence_entry
+from serializers import FastJSONResponse, case_rows, notification_rows, news_rows, to_archive
+from etags import make_etag, conditional_response, case_version, evidence_version, news_version, user_version, archive_version
+from archive import run_archive, start_archive_scheduler, find_archived, ARCHIVE_INTERVAL_HOURS
+from compression import CompressionMiddleware
+from admission import AdmissionMiddleware, admission
+from idempotency import IdempotencyMiddleware
+from geo import ensure_location_indexes, rebuild_location_indexes, set_location, drop_locations, nearest, NEAREST_MAX_K
+from notifications import fan_out_queue, station_audience, case_parties, deliver_new, advance_cursor
+from case_events import transition, daily_counts, stage_times, backlog, analytics_version
+from compute import compute_engine
+from media import media_pipeline, unused_media_dirs
+from integrity import (
+    CaseTree, remove_from_tree, inclusion_proof,
+    start_integrity_verifier, INTEGRITY_VERIFY_INTERVAL_HOURS,
+)
+from storage import storage
+from uploads import UploadError, evidence_file_type, create_direct_case, receive_local_upload, complete_upload, complete_by_key
+from analysis import (
+    AnalysisRun, analysis_streams, complete_analysis, fail_analysis, stream_analysis_events,
+    claim_analysis, wait_for_analysis, ANALYSIS_DUPLICATE_WAIT_SECONDS,
+    start_case_batch, batch_scheduler, PRIORITY_COURT,
+)
 import json
-app = FastAPI()
+import asyncio
+from starlette.concurrency import run_in_threadpool
+import base64
+from contextlib import asynccontextmanager
+from urllib.parse import unquote_plus
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Startup work lives here rather than at import, so importing main (tests,
+    # benchmarks, scripts) doesn't touch the schema or spawn worker processes
+    models.Base.metadata.create_all(bind=engine)
+    if ensure_location_indexes():
+        rebuild_location_indexes()
+
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        start_archive_scheduler()
+
+    if INTEGRITY_VERIFY_INTERVAL_HOURS > 0:
+        start_integrity_verifier()
+
+    # Worker processes for CPU-bound media work, warmed up before serving
+    compute_engine.start()
+
+    # Previews for image evidence; proxy / poster / sprite renditions for video (needs ffmpeg)
+    media_pipeline.start()
+
+    yield
+
+    # The pipeline first, so it doesn't hand the pool new renders while it stops
+    media_pipeline.stop()
+    compute_engine.shutdown()
+
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # Create uploads directory
 UPLOAD_DIR = "uploads"
+# Shared secret for /storage/events (sent as "Authorization: Bearer ..."); unset disables it
+STORAGE_WEBHOOK_TOKEN = os.getenv("STORAGE_WEBHOOK_TOKEN", "")
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
@@ -48,22 +111,42 @@ class AdminCreateUserRequest(BaseModel):
     phone: str
     password: str
     role: str # police, court_management
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    jurisdiction: Optional[str] = None
+
+class LocationUpdate(BaseModel):
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    jurisdiction: Optional[str] = None
 
 class UserResponse(BaseModel):
     id: int
-    name: str
-    email: str
+    name: Optional[str] = None
+    email: Optional[str] = None
     phoneNo: Optional[str] = None
     role: str
     status: Optional[str] = "pending"
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    jurisdiction: Optional[str] = None
 
     class Config:
         orm_mode = True
 
+class NearbyResponse(UserResponse):
+    distance_km: float
+
 class EvidenceResponse(BaseModel):
     id: int
     file_path: str
     file_type: str
+    # Videos only, once media.py has rendered them
+    media_status: Optional[str] = None
+    proxy_path: Optional[str] = None
+    poster_path: Optional[str] = None
+    sprite_path: Optional[str] = None
+    sprite_interval: Optional[float] = None
 
     class Config:
         orm_mode = True
@@ -97,6 +180,34 @@ class NotificationResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class NotificationAck(BaseModel):
+    # The cursor the last /new poll returned, once its notifications are shown
+    cursor: int
+
+class CaseBulkDeleteRequest(BaseModel):
+    case_ids: List[int]
+
+class DirectUploadFile(BaseModel):
+    filename: str
+    content_type: str = "application/octet-stream"
+    size: int
+    sha256: str
+
+class DirectCaseRequest(BaseModel):
+    user_id: int
+    police_id: int
+    title: str
+    description: str
+    incident_date: str
+    files: List[DirectUploadFile]
+
+class UserBulkActionRequest(BaseModel):
+    user_ids: Optional[List[int]] = None
+    # Filter expression, same meaning as the /admin/users query parameters
+    status: Optional[str] = None
+    role: Optional[str] = None
+    q: Optional[str] = None
+
 class NewsPostCreate(BaseModel):
     title: str
     content: str
@@ -114,6 +225,13 @@ class NewsPostResponse(BaseModel):
     class Config:
         orm_mode = True
 
+# Replays responses for retried Idempotency-Key requests. Inside admission:
+# a 429 never reaches it, and bodies are only spooled for admitted requests
+app.add_middleware(IdempotencyMiddleware)
+
+# Rate limits / concurrency caps; added before CORS so 429s still get CORS headers
+app.add_middleware(AdmissionMiddleware)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -121,9 +239,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Retry-After", "Idempotent-Replayed"],
 )
 
-models.Base.metadata.create_all(bind=engine)
+app.add_middleware(CompressionMiddleware)
 
 @app.post("/register/")
 def register_user(user: UserCreate, db: Session = Depends(get_db)):
@@ -247,20 +366,27 @@ def proceed_to_court(case_id: int, court_id: int = Form(...), db: Session = Depe
     if not court_exists:
         raise HTTPException(status_code=400, detail="Invalid court selection")
     
-    case.status = "sent_to_court"
-    case.court_id = court_id
-    
-    # Create notification for user
-    court_user = db.query(User).filter(User.id == court_id).first()
-    notification = Notification(
-        user_id=case.user_id,
-        case_id=case.id,
-        message=f"Your case '{case.title}' has been processed and sent to {court_user.name} for legal review.",
-        type="court_transfer"
+    message = f"Your case '{case.title}' has been processed and sent to {court_exists.name} for legal review."
+
+    def write(db):
+        target = db.query(Case).filter(Case.id == case_id).first()
+        target.court_id = court_id
+        transition(db, target, "sent_to_court", actor_id=target.police_id, actor_role="police")
+        # Create notification for user
+        db.add(Notification(
+            user_id=case.user_id,
+            case_id=case_id,
+            message=message,
+            type="court_transfer"
+        ))
+
+    write_batcher.run(write)
+    # Station and court get their own copy; the filer already has the one above
+    fan_out_queue.enqueue(
+        case_parties(case_id).where(User.id != case.user_id),
+        f"Case '{case.title}' has been sent to {court_exists.name} for legal review.",
+        "court_transfer", case_id
     )
-    db.add(notification)
-    
-    db.commit()
     return {"message": "Case successfully sent to court"}
 
 @app.post("/police/cases/{case_id}/review")
@@ -270,63 +396,65 @@ def review_case(case_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Case not found")
     
     if case.status == "pending":
-        case.status = "under_review"
-        
-        # Create notification
         police_station = db.query(User).filter(User.id == case.police_id).first()
-        notification = Notification(
-            user_id=case.user_id,
-            case_id=case.id,
-            message=f"Police Station {police_station.name} has started reviewing your case: '{case.title}'.",
-            type="review"
-        )
-        db.add(notification)
-        db.commit()
-        return {"message": "Case marked as under review"}
+        message = f"Police Station {police_station.name} has started reviewing your case: '{case.title}'."
+
+        def write(db):
+            # Conditional update so two concurrent reviews only notify once
+            target = db.query(Case).filter(Case.id == case_id, Case.status == "pending").first()
+            updated = target is not None
+            if updated:
+                transition(db, target, "under_review", actor_id=target.police_id, actor_role="police")
+                # Create notification
+                db.add(Notification(
+                    user_id=case.user_id,
+                    case_id=case_id,
+                    message=message,
+                    type="review"
+                ))
+            return updated
+
+        if write_batcher.run(write):
+            return {"message": "Case marked as under review"}
     
     return {"message": "Case already under review or processed"}
 
 @app.get("/user/notifications/{user_id}", response_model=List[NotificationResponse])
-def get_user_notifications(user_id: int, db: Session = Depends(get_db)):
-    return db.query(Notification).filter(Notification.user_id == user_id).order_by(Notification.created_at.desc()).all()
+def get_user_notifications(user_id: int, include_archived: bool = False, db: Session = Depends(get_db)):
+    return FastJSONResponse(notification_rows(db, Notification.user_id == user_id, include_archived=include_archived))
+
+@app.get("/user/notifications/{user_id}/new")
+def get_new_notifications(user_id: int, after: Optional[int] = Query(None, ge=0), limit: int = Query(100, ge=1, le=500)):
+    # Polling feed: everything past `after`, or past the last acknowledged
+    # cursor. Doesn't move the cursor; the client acks what it has shown.
+    return FastJSONResponse(deliver_new(user_id, after, limit))
+
+@app.post("/user/notifications/{user_id}/ack")
+def ack_notifications(user_id: int, data: NotificationAck):
+    return {"cursor": advance_cursor(user_id, data.cursor)}
 
 @app.put("/notifications/{notification_id}/read")
 def mark_notification_read(notification_id: int, db: Session = Depends(get_db)):
-    notification = db.query(Notification).filter(Notification.id == notification_id).first()
-    if not notification:
+    updated = write_batcher.run(
+        lambda db: db.query(Notification).filter(Notification.id == notification_id).update({"is_read": True})
+    )
+    if not updated:
         raise HTTPException(status_code=404, detail="Notification not found")
-    notification.is_read = True
-    db.commit()
     return {"message": "Notification marked as read"}
 
 @app.get("/police/cases/{police_id}", response_model=List[CaseResponse])
-def get_police_cases(police_id: int, db: Session = Depends(get_db)):
-    cases = db.query(Case).filter(Case.police_id == police_id).all()
-    # Add user name, police name, and court name for each case
-    for case in cases:
-        if case.user_id:
-            user = db.query(User).filter(User.id == case.user_id).first()
-            if user:
-                case.user_name = user.name
-        
-        if case.police_id:
-            police_station = db.query(User).filter(User.id == case.police_id).first()
-            if police_station:
-                case.police_name = police_station.name
-        else:
-            case.police_name = "Not Assigned"
-
-        if case.court_id:
-            court = db.query(User).filter(User.id == case.court_id).first()
-            if court:
-                case.court_name = court.name
-        else:
-            case.court_name = "Not Assigned"
-            
-    return cases
+def get_police_cases(police_id: int, request: Request, include_archived: bool = False, db: Session = Depends(get_db)):
+    scope = Case.police_id == police_id
+    etag = make_etag("police-cases", police_id, case_version(db, scope), evidence_version(db, scope), include_archived and archive_version(db))
+    return conditional_response(request, etag, lambda: case_rows(db, scope, include_archived=include_archived))
 
 @app.get("/police/stats/{police_id}")
-def get_police_stats(police_id: int, db: Session = Depends(get_db)):
+def get_police_stats(police_id: int, request: Request, db: Session = Depends(get_db)):
+    scope = Case.police_id == police_id
+    etag = make_etag("police-stats", police_id, case_version(db, scope), evidence_version(db, scope))
+    return conditional_response(request, etag, lambda: police_stats(db, police_id))
+
+def police_stats(db, police_id):
     total_cases = db.query(Case).filter(Case.police_id == police_id).count()
     sent_to_court = db.query(Case).filter(Case.police_id == police_id, Case.status == "sent_to_court").count()
     pending_review = db.query(Case).filter(Case.police_id == police_id, Case.status == "pending").count()
@@ -342,57 +470,34 @@ def get_police_stats(police_id: int, db: Session = Depends(get_db)):
     }
 
 @app.get("/court/cases/{court_id}", response_model=List[CaseResponse])
-def get_court_cases(court_id: int, db: Session = Depends(get_db)):
-    cases = db.query(Case).filter(Case.court_id == court_id).all()
-    # Add user name, police name, and court name for each case
-    for case in cases:
-        if case.user_id:
-            user = db.query(User).filter(User.id == case.user_id).first()
-            if user:
-                case.user_name = user.name
-        
-        if case.police_id:
-            police_station = db.query(User).filter(User.id == case.police_id).first()
-            if police_station:
-                case.police_name = police_station.name
-        else:
-            case.police_name = "Not Assigned"
-
-        if case.court_id:
-            court = db.query(User).filter(User.id == case.court_id).first()
-            if court:
-                case.court_name = court.name
-        else:
-            case.court_name = "Not Assigned"
-            
-    return cases
+def get_court_cases(court_id: int, request: Request, include_archived: bool = False, db: Session = Depends(get_db)):
+    scope = Case.court_id == court_id
+    etag = make_etag("court-cases", court_id, case_version(db, scope), evidence_version(db, scope), include_archived and archive_version(db))
+    return conditional_response(request, etag, lambda: case_rows(db, scope, include_archived=include_archived))
 
 @app.get("/user/cases/{user_id}", response_model=List[CaseResponse])
-def get_user_cases(user_id: int, db: Session = Depends(get_db)):
-    cases = db.query(Case).filter(Case.user_id == user_id).all()
-    # Add police name and court name for each case
-    for case in cases:
-        if case.police_id:
-            police_station = db.query(User).filter(User.id == case.police_id).first()
-            if police_station:
-                case.police_name = police_station.name
-        else:
-            case.police_name = "Not Assigned"
-
-        if case.court_id:
-            court = db.query(User).filter(User.id == case.court_id).first()
-            if court:
-                case.court_name = court.name
-        else:
-            case.court_name = "Not Assigned"
-    return cases
+def get_user_cases(user_id: int, request: Request, include_archived: bool = False, db: Session = Depends(get_db)):
+    scope = Case.user_id == user_id
+    etag = make_etag("user-cases", user_id, case_version(db, scope), evidence_version(db, scope), include_archived and archive_version(db))
+    return conditional_response(request, etag, lambda: case_rows(db, scope, include_archived=include_archived))
 
 @app.get("/user/stats/{user_id}")
-def get_user_stats(user_id: int, db: Session = Depends(get_db)):
-    total_cases = db.query(Case).filter(Case.user_id == user_id).count()
-    pending_cases = db.query(Case).filter(Case.user_id == user_id, Case.status == "pending").count()
+def get_user_stats(user_id: int, request: Request, db: Session = Depends(get_db)):
+    etag = make_etag("user-stats", user_id, case_version(db, Case.user_id == user_id), archive_version(db))
+    return conditional_response(request, etag, lambda: user_stats(db, user_id))
+
+def count_cases(db, *criteria):
+    # Live and archived cases alike; criteria are written against Case
+    live = db.query(func.count(Case.id)).filter(*criteria).scalar()
+    archived = db.query(func.count()).select_from(archived_cases).filter(*to_archive(criteria, Case.__table__, archived_cases)).scalar()
+    return live + archived
+
+def user_stats(db, user_id):
+    # Archived cases are old, finished ones, but they're still the filer's
+    total_cases = count_cases(db, Case.user_id == user_id)
+    pending_cases = count_cases(db, Case.user_id == user_id, Case.status == "pending")
     # 'Approved' or 'Resolved' cases
-    approved_cases = db.query(Case).filter(Case.user_id == user_id, Case.status.in_(["approved", "resolved"])).count()
+    approved_cases = count_cases(db, Case.user_id == user_id, Case.status.in_(["approved", "resolved"]))
     
     return {
         "total_cases": total_cases,
@@ -400,34 +505,48 @@ def get_user_stats(user_id: int, db: Session = Depends(get_db)):
         "approved_cases": approved_cases
     }
 
+def delete_cases(case_ids):
+    # Set-based delete; evidence and notifications go with it via ON DELETE CASCADE.
+    # Files (and renditions nothing else uses) are unlinked afterwards by the cleanup thread.
+    def write(db):
+        files = db.query(Evidence.file_path, Evidence.content_hash).filter(Evidence.case_id.in_(case_ids)).all()
+        deleted = db.query(Case).filter(Case.id.in_(case_ids)).delete(synchronize_session=False)
+        paths = [path for path, _ in files] + unused_media_dirs(db, [content_hash for _, content_hash in files])
+        return deleted, paths
+
+    deleted, paths = write_batcher.run(write)
+    cleanup_queue.enqueue(paths)
+    return deleted
+
 @app.delete("/user/cases/{case_id}")
 def delete_case(case_id: int, db: Session = Depends(get_db)):
-    case = db.query(Case).filter(Case.id == case_id).first()
-    if not case:
+    if not delete_cases([case_id]):
         raise HTTPException(status_code=404, detail="Case not found")
-    
-    # Delete associated evidence files
-    evidence_list = db.query(Evidence).filter(Evidence.case_id == case_id).all()
-    for evidence in evidence_list:
-        if evidence.file_path:
-            # path is like "/uploads/filename.ext"
-            file_path = evidence.file_path.lstrip('/')
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    print(f"Error deleting file {file_path}: {e}")
-        
-        db.delete(evidence)
-    
-    db.delete(case)
-    db.commit()
     return {"message": "Case and associated evidence deleted successfully"}
 
+@app.post("/admin/cases/bulk-delete")
+def bulk_delete_cases(data: CaseBulkDeleteRequest, db: Session = Depends(get_db)):
+    deleted = delete_cases(data.case_ids) if data.case_ids else 0
+    return {"message": f"{deleted} cases deleted", "deleted": deleted}
+
 @app.get("/police-stations", response_model=List[UserResponse])
 def get_police_stations(db: Session = Depends(get_db)):
     return db.query(User).filter(User.role == "police", User.status == "approved").all()
 
+def check_coordinates(lat, lon):
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(status_code=400, detail="lat must be within [-90, 90] and lon within [-180, 180]")
+
+@app.get("/police-stations/nearest", response_model=List[NearbyResponse])
+def get_nearest_police_stations(lat: float, lon: float, k: int = Query(5, ge=1, le=NEAREST_MAX_K), db: Session = Depends(get_db)):
+    check_coordinates(lat, lon)
+    return FastJSONResponse(nearest(db, "police", lat, lon, k))
+
+@app.get("/courts/nearest", response_model=List[NearbyResponse])
+def get_nearest_courts(lat: float, lon: float, k: int = Query(5, ge=1, le=NEAREST_MAX_K), db: Session = Depends(get_db)):
+    check_coordinates(lat, lon)
+    return FastJSONResponse(nearest(db, "court", lat, lon, k))
+
 @app.post("/user/file-case")
 async def file_case(
     user_id: int = Form(...),
@@ -438,41 +557,115 @@ async def file_case(
     files: List[UploadFile] = File(...),
     db: Session = Depends(get_db)
 ):
-    # Create Case
-    new_case = Case(
-        user_id=user_id,
-        police_id=police_id,
-        title=title,
-        description=description,
-        incident_date=incident_date
-    )
-    db.add(new_case)
-    db.commit()
-    db.refresh(new_case)
-
     # Save Files
+    saved_files = []
     for file in files:
         file_ext = os.path.splitext(file.filename)[1]
-        file_name = f"{uuid.uuid4()}{file_ext}"
-        file_path = os.path.join(UPLOAD_DIR, file_name)
+        file_path = f"/uploads/{uuid.uuid4()}{file_ext}"
         
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Hashing and the write (or S3 upload) release the GIL; keep them off the event loop
+        sha256 = await run_in_threadpool(storage.save, file.file, file_path)
         
         # Determine file type
-        file_type = "image" if file_ext.lower() in [".jpg", ".jpeg", ".png", ".gif"] else "video"
-        
-        new_evidence = Evidence(
-            case_id=new_case.id,
-            file_path=f"/uploads/{file_name}",
-            file_type=file_type
+        file_type = evidence_file_type(file.filename)
+        saved_files.append((file_path, file_type, sha256))
+
+    # Case and evidence rows go in as one batched write
+    def write(db):
+        new_case = Case(
+            user_id=user_id,
+            police_id=police_id,
+            title=title,
+            description=description,
+            incident_date=incident_date
         )
-        db.add(new_evidence)
-    
-    db.commit()
-    return {"message": "Case filed successfully", "case_id": new_case.id}
+        db.add(new_case)
+        db.flush()
+        transition(db, new_case, "pending", actor_id=user_id, actor_role="user")
+        tree = CaseTree(db, new_case)
+        for path, file_type, sha256 in saved_files:
+            evidence = Evidence(case_id=new_case.id, file_path=path, file_type=file_type, content_hash=sha256)
+            db.add(evidence)
+            db.flush()
+            tree.append(evidence)
+        return new_case.id
+
+    case_id = await asyncio.wrap_future(write_batcher.submit(write))
+    # Previews for images, renditions for video
+    media_pipeline.wake()
+    return {"message": "Case filed successfully", "case_id": case_id}
+
 
 
+# --- DIRECT UPLOADS ---
+# Bytes go straight to storage on presigned URLs; the API only hands out the
+# URLs and registers the evidence once an upload completes.
+
+def upload_error(e):
+    return HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.post("/user/file-case/direct")
+def file_case_direct(data: DirectCaseRequest):
+    try:
+        case_id, uploads = create_direct_case(
+            data.user_id, data.police_id, data.title, data.description, data.incident_date,
+            [f.dict() for f in data.files]
+        )
+    except UploadError as e:
+        raise upload_error(e)
+    return {"message": "Case filed successfully", "case_id": case_id, "uploads": uploads}
+
+@app.put("/storage/uploads/{upload_id}")
+async def receive_upload(upload_id: str, request: Request):
+    # Presigned-URL target for the local backend only
+    if not storage.is_local:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    try:
+        await receive_local_upload(upload_id, request.stream())
+    except UploadError as e:
+        raise upload_error(e)
+    return {"status": "uploaded"}
+
+@app.post("/storage/uploads/{upload_id}/complete")
+def complete_direct_upload(upload_id: str):
+    try:
+        evidence_id = complete_upload(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    return {"status": "completed", "evidence_id": evidence_id}
+
+@app.post("/storage/events")
+def storage_events(payload: dict, request: Request):
+    # S3-style bucket notifications (MinIO webhook target, or an SNS/Lambda
+    # relay) for ObjectCreated events, so uploads complete even if the
+    # client never calls /complete
+    if not STORAGE_WEBHOOK_TOKEN or request.headers.get("authorization") != f"Bearer {STORAGE_WEBHOOK_TOKEN}":
+        raise HTTPException(status_code=403, detail="Forbidden")
+    completed = []
+    for record in payload.get("Records", []):
+        key = unquote_plus(record.get("s3", {}).get("object", {}).get("key", ""))
+        try:
+            evidence_id = complete_by_key(key)
+        except UploadError as e:
+            print(f"[DEBUG] Storage event for {key} not completed: {e.detail}")
+            continue
+        if evidence_id is not None:
+            completed.append(evidence_id)
+    return {"completed": completed}
+
+@app.get("/evidence/{evidence_id}/download")
+def download_evidence(evidence_id: int, rendition: Optional[str] = None, db: Session = Depends(get_db)):
+    # Redirects to the file (or a video rendition) in storage; presigned
+    # for object stores
+    evidence = db.query(Evidence).filter(Evidence.id == evidence_id).first()
+    if not evidence:
+        raise HTTPException(status_code=404, detail="Evidence not found")
+    renditions = {None: evidence.file_path, "proxy": evidence.proxy_path, "poster": evidence.poster_path, "sprite": evidence.sprite_path}
+    if rendition not in renditions:
+        raise HTTPException(status_code=400, detail="rendition must be proxy, poster or sprite")
+    if not renditions[rendition]:
+        raise HTTPException(status_code=404, detail="Rendition not available")
+    return RedirectResponse(storage.download_url(renditions[rendition]), status_code=307)
 
 @app.post("/evidence/{evidence_id}/analyze")
 def analyze_evidence(evidence_id: int, db: Session = Depends(get_db)):
@@ -480,74 +673,201 @@ def analyze_evidence(evidence_id: int, db: Session = Depends(get_db)):
     if not evidence:
         raise HTTPException(status_code=404, detail="Evidence not found")
 
-    file_path = evidence.file_path.lstrip("/")
+    if not claim_analysis(evidence_id):
+        # Already analyzed, or a stream / batch is running the model for it
+        status, report = wait_for_analysis(evidence_id, ANALYSIS_DUPLICATE_WAIT_SECONDS)
+        if status == "completed" and report:
+            return {"analysis_status": "completed", "report": report}
+        if status == "processing":
+            raise HTTPException(status_code=409, detail="Analysis already in progress", headers={"Retry-After": "5"})
+        raise HTTPException(status_code=500, detail="AI analysis failed")
 
-    
     try:
         analyzer = get_analyzer()
-        gemini_result = analyzer.analyze(file_path)        # result is a dict: {'verdict': '...', 'confidence': ..., ...}
-        
+        with storage.local_copy(evidence.file_path) as file_path:
+            gemini_result = analyzer.analyze(file_path)
+
         if not gemini_result:
             raise Exception("Empty response from Gemini")
-
-            evidence.analysis_status = "completed"
-            evidence.is_authentic = None  # optional
-            evidence.confidence_score = None  # optional
-            evidence.analysis_report = gemini_result
-            verdict = parsed.get("verdict","AI_GENERATED")
-            confidence = parsed.get("confidence",0.0)
-        
-            
-        
     except Exception as e:
         print(f"[ERROR] Logic failed during analysis result parsing: {e}")
-        evidence.analysis_status = "failed"
-        db.commit()
+        fail_analysis(evidence_id)
         raise HTTPException(status_code=500, detail="AI analysis failed")
-       
 
-   
-    
     # --- AUTO-RESOLVE CASE & NOTIFY USER ---
-    case = db.query(Case).filter(Case.id == evidence.case_id).first()
-    if case:
-        case.status = "resolved"
-        
-        # Create notification
-        # verdict_text = "Authentic/Real" if evidence.analysis_status == "completed" else "Potential Deepfake/AI-Generated"
-        notification_message = (
-            f"Evidence analysis completed for case '{case.title}'. "
-        )
-        
-        notification = Notification(
-            user_id=case.user_id,
-            case_id=case.id,
-            message=notification_message,
-            type="analysis_complete"
-        )
-        db.add(notification)
-
-    db.commit()
+    complete_analysis(evidence_id, gemini_result)
     return {
         "analysis_status": "completed",
         "report": gemini_result
     }
-    
+
+@app.get("/evidence/{evidence_id}/analyze/stream")
+def stream_evidence_analysis(evidence_id: int, db: Session = Depends(get_db)):
+    # Server-Sent Events: "chunk" events with the report text as the model
+    # writes it, then "done" (or "error"). Opening the stream while an
+    # analysis is already running attaches to it rather than starting another.
+    evidence = db.query(Evidence).filter(Evidence.id == evidence_id).first()
+    if not evidence:
+        raise HTTPException(status_code=404, detail="Evidence not found")
+
+    if evidence.analysis_status == "completed" and evidence.analysis_report:
+        run = AnalysisRun.completed(evidence_id, evidence.analysis_report)
+    else:
+        run = analysis_streams.attach(evidence_id, evidence.file_path)
+
+    return StreamingResponse(
+        stream_analysis_events(run),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/cases/{case_id}/analyze", status_code=202)
+def analyze_case(case_id: int):
+    # Queues every not-yet-analyzed item of the case; the case is resolved
+    # and the filer notified once, when the last item is done. Repeating the
+    # call while a batch is running returns that batch.
+    started = start_case_batch(case_id)
+    if started is None:
+        raise HTTPException(status_code=404, detail="Case not found")
+    batch_id, priority, items, created = started
+    if created:
+        batch_scheduler.submit(batch_id, priority, items)
+    return {"batch_id": batch_id, "queued": len(items), "created": created}
+
+@app.get("/cases/{case_id}/analyze/{batch_id}")
+def get_analysis_batch(case_id: int, batch_id: int, db: Session = Depends(get_db)):
+    batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id, AnalysisBatch.case_id == case_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Analysis batch not found")
+    evidence = db.query(Evidence.id, Evidence.file_type, Evidence.analysis_status, Evidence.is_authentic).filter(
+        Evidence.case_id == case_id
+    ).order_by(Evidence.id).all()
+    return {
+        "batch_id": batch.id,
+        "case_id": batch.case_id,
+        "status": batch.status,
+        "priority": "court" if batch.priority == PRIORITY_COURT else "police",
+        "total": batch.total,
+        "completed": batch.completed,
+        "failed": batch.failed,
+        "pending": batch.total - batch.completed - batch.failed,
+        "verdict": batch.verdict,
+        "created_at": batch.created_at,
+        "finished_at": batch.finished_at,
+        "evidence": [
+            {"id": id, "file_type": file_type, "analysis_status": status, "is_authentic": is_authentic}
+            for id, file_type, status, is_authentic in evidence
+        ],
+    }
+
 @app.get("/evidence/{evidence_id}")
 def get_evidence_detail(evidence_id: int, db: Session = Depends(get_db)):
     evidence = db.query(Evidence).filter(Evidence.id == evidence_id).first()
+    archived = evidence is None
+    if archived:
+        evidence = find_archived(db, archived_evidence, evidence_id)
     if not evidence:
         raise HTTPException(status_code=404, detail="Evidence not found")
     return {
         "id": evidence.id,
+        "archived": archived,
         "file_path": evidence.file_path,
         "file_type": evidence.file_type,
         "analysis_status": evidence.analysis_status,
-        "analysis_report": evidence.analysis_report
+        "analysis_report": evidence.analysis_report,
+        "media_status": evidence.media_status,
+        "proxy_path": evidence.proxy_path,
+        "poster_path": evidence.poster_path,
+        "sprite_path": evidence.sprite_path,
+        "sprite_interval": evidence.sprite_interval,
+        "sha256": evidence.content_hash,
+        "integrity_status": evidence.integrity_status,
+        "verified_at": evidence.verified_at
     }
 
+@app.delete("/evidence/{evidence_id}")
+def delete_evidence(evidence_id: int):
+    # Takes the item out of its case's hash tree in the same transaction
+    def write(db):
+        evidence = db.query(Evidence).filter(Evidence.id == evidence_id).first()
+        if not evidence:
+            return None
+        remove_from_tree(db, evidence)
+        path, content_hash = evidence.file_path, evidence.content_hash
+        db.delete(evidence)
+        db.flush()
+        return [path] + unused_media_dirs(db, [content_hash])
+
+    paths = write_batcher.run(write)
+    if paths is None:
+        raise HTTPException(status_code=404, detail="Evidence not found")
+    cleanup_queue.enqueue(paths)
+    return {"message": "Evidence deleted successfully"}
+
+@app.get("/evidence/{evidence_id}/proof")
+def get_evidence_proof(evidence_id: int, db: Session = Depends(get_db)):
+    # Inclusion proof against the case root: hash the file, then
+    # leaf = sha256(0x00 || "<id>:<sha256>") and fold in each path step with
+    # node = sha256(0x01 || left || right) to get back to the root
+    evidence = db.query(Evidence).filter(Evidence.id == evidence_id).first()
+    archived = evidence is None
+    if archived:
+        evidence = find_archived(db, archived_evidence, evidence_id)
+    if not evidence:
+        raise HTTPException(status_code=404, detail="Evidence not found")
+    if evidence.tree_position is None:
+        raise HTTPException(status_code=409, detail="Evidence has no recorded hash yet")
+    return inclusion_proof(db, evidence, archived=archived)
+
+def find_case(db, case_id):
+    # (case, its evidence table): the live case, else its archived copy
+    case = db.query(Case).filter(Case.id == case_id).first()
+    if case:
+        return case, Evidence.__table__
+    return find_archived(db, archived_cases, case_id), archived_evidence
+
+@app.get("/cases/{case_id}/manifest")
+def get_case_manifest(case_id: int, db: Session = Depends(get_db)):
+    case, evidence_table = find_case(db, case_id)
+    if not case:
+        raise HTTPException(status_code=404, detail="Case not found")
+    columns = evidence_table.c
+    evidence = db.execute(
+        select(columns.id, columns.tree_position, columns.content_hash, columns.integrity_status, columns.verified_at)
+        .where(columns.case_id == case_id).order_by(columns.tree_position, columns.id)
+    ).all()
+    return {
+        "case_id": case.id,
+        "root": case.evidence_root,
+        "tree_size": case.evidence_leaves or 0,
+        "evidence": [
+            {"id": id, "position": position, "sha256": sha256, "integrity_status": status, "verified_at": verified_at}
+            for id, position, sha256, status, verified_at in evidence
+        ],
+    }
+
+@app.get("/cases/{case_id}/evidence.zip")
+def download_case_evidence(case_id: int, db: Session = Depends(get_db)):
+    case, evidence_table = find_case(db, case_id)
+    if not case:
+        raise HTTPException(status_code=404, detail="Case not found")
+
+    # Snapshot what the archive needs so the stream doesn't hold a DB session
+    case_info = {"id": case.id, "title": case.title, "status": case.status}
+    rows = db.execute(select(evidence_table).where(evidence_table.c.case_id == case_id).order_by(evidence_table.c.id))
+    evidence_list = [evidence_entry(evidence, getattr(evidence, "cold_path", None)) for evidence in rows]
+    return StreamingResponse(
+        stream_evidence_zip(case_info, evidence_list),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="case_{case_id}_evidence.zip"'}
+    )
+
 @app.get("/admin/stats")
-def get_admin_stats(db: Session = Depends(get_db)):
+def get_admin_stats(request: Request, db: Session = Depends(get_db)):
+    etag = make_etag("admin-stats", user_version(db))
+    return conditional_response(request, etag, lambda: admin_stats(db))
+
+def admin_stats(db):
     total_users = db.query(User).filter(User.role == "user").count()
     pending_users = db.query(User).filter(User.status == "pending", User.role == "user").count()
     approved_users = db.query(User).filter(User.status == "approved", User.role == "user").count()
@@ -562,14 +882,96 @@ def get_admin_stats(db: Session = Depends(get_db)):
         "court_count": court_count
     }
 
-@app.get("/admin/users", response_model=List[UserResponse])
-def get_users(status: Optional[str] = None, role: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(User)
+ANALYTICS_SCOPES = ["all", "police", "court"]
+
+@app.get("/admin/analytics/cases")
+def get_case_analytics(request: Request, scope: str = "all", scope_id: int = 0, days: int = Query(30, ge=1, le=366), db: Session = Depends(get_db)):
+    # Served from the daily rollups, so the cost depends on `days`, not on
+    # how many cases there are
+    if scope not in ANALYTICS_SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope must be one of {ANALYTICS_SCOPES}")
+    if scope == "all":
+        scope_id = 0
+    start = datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)
+    # The backlog only reads open cases (status index) and also covers
+    # deleted / archived cases, which leave no event behind
+    open_cases = backlog(db, scope, scope_id)
+    etag = make_etag("case-analytics", scope, scope_id, start, analytics_version(db), open_cases)
+    return conditional_response(request, etag, lambda: {
+        "scope": scope,
+        "scope_id": scope_id,
+        "since": start,
+        "daily": daily_counts(db, scope, scope_id, start),
+        "stage_times": stage_times(db, scope, scope_id, start),
+        "backlog": open_cases,
+    })
+
+# NULL compares as unknown, so a cursor on a NULL name would end the listing;
+# the sort keys read NULL as '' (same expressions as the ix_users_*_sort indexes)
+USER_SORT_KEYS = {
+    "name": func.coalesce(User.name, "").collate("NOCASE"),
+    "email": func.coalesce(User.email, "").collate("NOCASE"),
+    "id": User.id,
+}
+
+def filter_users(query, status=None, role=None, q=None):
     if status:
         query = query.filter(User.status == status)
     if role:
         query = query.filter(User.role == role)
-    return query.all()
+    if q:
+        # Prefix match so the NOCASE indexes on name / email can be used
+        prefix = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        query = query.filter(or_(User.name.like(prefix, escape="\\"), User.email.like(prefix, escape="\\")))
+    return query
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/admin/users", response_model=List[UserResponse])
+def get_users(
+    response: Response,
+    status: Optional[str] = None,
+    role: Optional[str] = None,
+    q: Optional[str] = None,
+    sort: str = "id",
+    order: str = "asc",
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    # Keyset pagination: the next page starts after the (sort value, id) of the
+    # last row, passed back by the client from the X-Next-Cursor header
+    if sort not in USER_SORT_KEYS or order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Invalid sort")
+    key = USER_SORT_KEYS[sort]
+    descending = order == "desc"
+
+    query = filter_users(db.query(User), status, role, q)
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        if descending:
+            query = query.filter(or_(key < last_value, and_(key == last_value, User.id < last_id)))
+        else:
+            query = query.filter(or_(key > last_value, and_(key == last_value, User.id > last_id)))
+    if descending:
+        query = query.order_by(key.desc(), User.id.desc())
+    else:
+        query = query.order_by(key, User.id)
+
+    users = query.limit(limit + 1).all()
+    if len(users) > limit:
+        users = users[:limit]
+        last = users[-1]
+        last_value = getattr(last, sort)
+        response.headers["X-Next-Cursor"] = encode_cursor([last_value if last_value is not None else "", last.id])
+    return users
 
 @app.put("/admin/users/{user_id}/approve")
 def approve_user(user_id: int, db: Session = Depends(get_db)):
@@ -581,6 +983,27 @@ def approve_user(user_id: int, db: Session = Depends(get_db)):
     db.commit()
     return {"message": "User approved successfully"}
 
+@app.put("/admin/users/{user_id}/location")
+def set_user_location(user_id: int, data: LocationUpdate):
+    if (data.latitude is None) != (data.longitude is None):
+        raise HTTPException(status_code=400, detail="Set latitude and longitude together")
+    if data.latitude is not None:
+        check_coordinates(data.latitude, data.longitude)
+
+    def write(db):
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            return False
+        user.latitude = data.latitude
+        user.longitude = data.longitude
+        user.jurisdiction = data.jurisdiction
+        set_location(db, user)
+        return True
+
+    if not write_batcher.run(write):
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": "Location updated"}
+
 @app.put("/admin/users/{user_id}/reject")
 def reject_user(user_id: int, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id).first()
@@ -591,16 +1014,78 @@ def reject_user(user_id: int, db: Session = Depends(get_db)):
     db.commit()
     return {"message": "User rejected"}
 
+def bulk_user_query(db, data):
+    # Either an explicit ID list or a filter; refuse an empty request rather
+    # than touching the whole table
+    if not data.user_ids and not (data.status or data.role or data.q):
+        raise HTTPException(status_code=400, detail="Provide user_ids or a filter")
+    query = filter_users(db.query(User), data.status, data.role, data.q)
+    if data.user_ids:
+        query = query.filter(User.id.in_(data.user_ids))
+    return query
+
+def set_users_status(data, new_status):
+    def write(db):
+        query = bulk_user_query(db, data).filter(User.status != new_status)
+        return query.update({"status": new_status}, synchronize_session=False)
+    return write_batcher.run(write)
+
+@app.post("/admin/users/bulk/approve")
+def bulk_approve_users(data: UserBulkActionRequest, db: Session = Depends(get_db)):
+    affected = set_users_status(data, "approved")
+    return {"message": f"{affected} users approved", "affected": affected}
+
+@app.post("/admin/users/bulk/reject")
+def bulk_reject_users(data: UserBulkActionRequest, db: Session = Depends(get_db)):
+    affected = set_users_status(data, "rejected")
+    return {"message": f"{affected} users rejected", "affected": affected}
+
+def delete_users(data):
+    # Cases, evidence, notifications and news posts cascade from the user row;
+    # cases they were assigned to as police/court just lose the assignment
+    def write(db):
+        user_ids = bulk_user_query(db, data).with_entities(User.id)
+        user_cases = db.query(Case.id).filter(Case.user_id.in_(user_ids))
+        files = db.query(Evidence.file_path, Evidence.content_hash).filter(Evidence.case_id.in_(user_cases)).all()
+        paths = [path for path, _ in files]
+        paths += [path for (path,) in db.query(models.NewsPost.image_path).filter(models.NewsPost.police_id.in_(user_ids))]
+        drop_locations(db, [id for (id,) in user_ids])
+        deleted = db.query(User).filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        paths += unused_media_dirs(db, [content_hash for _, content_hash in files])
+        return deleted, paths
+
+    deleted, paths = write_batcher.run(write)
+    cleanup_queue.enqueue(paths)
+    return deleted
+
+@app.post("/admin/users/bulk/delete")
+def bulk_delete_users(data: UserBulkActionRequest, db: Session = Depends(get_db)):
+    affected = delete_users(data)
+    return {"message": f"{affected} users deleted", "affected": affected}
+
 @app.delete("/admin/users/{user_id}")
 def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    if not delete_users(UserBulkActionRequest(user_ids=[user_id])):
         raise HTTPException(status_code=404, detail="User not found")
-    
-    db.delete(user)
-    db.commit()
     return {"message": "User deleted successfully"}
 
+@app.post("/admin/archive/run")
+def run_archive_now(days: Optional[int] = None, db: Session = Depends(get_db)):
+    summary = run_archive(days) if days is not None else run_archive()
+    return {"message": "Archive run complete", **summary}
+
+@app.get("/admin/admission")
+def get_admission_metrics():
+    return admission.snapshot()
+
+@app.get("/admin/compute")
+def get_compute_metrics():
+    return compute_engine.snapshot()
+
+@app.get("/admin/notifications/fan-out")
+def get_fan_out_metrics():
+    return fan_out_queue.snapshot()
+
 @app.post("/admin/create-user")
 def admin_create_user(user: AdminCreateUserRequest, db: Session = Depends(get_db)):
     # Check existing
@@ -614,14 +1099,24 @@ def admin_create_user(user: AdminCreateUserRequest, db: Session = Depends(get_db
         phoneNo=str(user.phone),
         password=user.password,
         role=user.role,
-        status="approved" # Admin created users are auto-approved
+        status="approved", # Admin created users are auto-approved
+        latitude=user.latitude,
+        longitude=user.longitude,
+        jurisdiction=user.jurisdiction
     )
     db.add(new_user)
+    db.flush()
+    set_location(db, new_user)
     db.commit()
     return {"message": f"{user.role} created successfully"}
 
 @app.get("/court/{court_id}/stats")
-def get_court_stats(court_id: int, db: Session = Depends(get_db)):
+def get_court_stats(court_id: int, request: Request, db: Session = Depends(get_db)):
+    scope = Case.court_id == court_id
+    etag = make_etag("court-stats", court_id, case_version(db, scope), evidence_version(db, scope))
+    return conditional_response(request, etag, lambda: court_stats(db, court_id))
+
+def court_stats(db, court_id):
     # 1. Total Assigned Cases
     assigned_count = db.query(Case).filter(Case.court_id == court_id).count()
     
@@ -652,6 +1147,65 @@ def get_court_stats(court_id: int, db: Session = Depends(get_db)):
         "flagged_items": flagged_count
     }
 
+def export_response(format, court_id=None, police_id=None, name="cases"):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    stream, media_type = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        stream(iter_case_register(court_id=court_id, police_id=police_id)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'}
+    )
+
+@app.get("/court/{court_id}/cases/export")
+def export_court_cases(court_id: int, format: str = "csv"):
+    return export_response(format, court_id=court_id, name=f"court_{court_id}_cases")
+
+@app.get("/police/{police_id}/cases/export")
+def export_police_cases(police_id: int, format: str = "csv"):
+    return export_response(format, police_id=police_id, name=f"police_{police_id}_cases")
+
+DASHBOARD_SECTIONS = ["stats", "cases", "unread_count", "notifications"]
+DASHBOARD_PAGE_SIZE = 20
+DASHBOARD_RECENT_NOTIFICATIONS = 5
+
+@app.get("/dashboard/{role}/{id}")
+def get_dashboard(
+    role: str,
+    id: int,
+    fields: Optional[str] = None,
+    cases_limit: int = Query(DASHBOARD_PAGE_SIZE, ge=1, le=200),
+    db: Session = Depends(get_db)
+):
+    # Everything a dashboard page shows in one round trip. All sections are
+    # read inside the same transaction, i.e. from one consistent WAL snapshot.
+    dashboards = {
+        "user": (Case.user_id, user_stats),
+        "police": (Case.police_id, police_stats),
+        "court": (Case.court_id, court_stats),
+    }
+    if role not in dashboards:
+        raise HTTPException(status_code=404, detail="Unknown dashboard")
+    case_column, stats = dashboards[role]
+
+    sections = DASHBOARD_SECTIONS
+    if fields:
+        sections = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = set(sections) - set(DASHBOARD_SECTIONS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    result = {}
+    if "stats" in sections:
+        result["stats"] = stats(db, id)
+    if "cases" in sections:
+        result["cases"] = case_rows(db, case_column == id, limit=cases_limit, newest_first=True)
+    if "unread_count" in sections:
+        result["unread_count"] = db.query(Notification).filter(Notification.user_id == id, Notification.is_read == False).count()
+    if "notifications" in sections:
+        result["notifications"] = notification_rows(db, Notification.user_id == id, limit=DASHBOARD_RECENT_NOTIFICATIONS)
+    return FastJSONResponse(result)
+
 @app.get("/")
 def home():
     return {"message": "Backend is running - News Feature Active"}
@@ -691,25 +1245,19 @@ async def create_news_post(
     db.add(new_post)
     db.commit()
     db.refresh(new_post)
+    fan_out_queue.enqueue(station_audience(police_id), f"{police.name} posted an update: {title}", "news", source_id=new_post.id)
     
     new_post.police_name = police.name
     return new_post
 
 @app.get("/news", response_model=List[NewsPostResponse])
-def get_all_news(db: Session = Depends(get_db)):
-    posts = db.query(models.NewsPost).order_by(models.NewsPost.created_at.desc()).all()
-    for post in posts:
-        police = db.query(User).filter(User.id == post.police_id).first()
-        post.police_name = police.name if police else "Unknown Station"
-    return posts
+def get_all_news(request: Request, db: Session = Depends(get_db)):
+    return conditional_response(request, make_etag("news", news_version(db)), lambda: news_rows(db))
 
 @app.get("/police/news/{police_id}", response_model=List[NewsPostResponse])
-def get_police_news(police_id: int, db: Session = Depends(get_db)):
-    posts = db.query(models.NewsPost).filter(models.NewsPost.police_id == police_id).order_by(models.NewsPost.created_at.desc()).all()
-    police = db.query(User).filter(User.id == police_id).first()
-    for post in posts:
-        post.police_name = police.name if police else "Unknown Station"
-    return posts
+def get_police_news(police_id: int, request: Request, db: Session = Depends(get_db)):
+    scope = models.NewsPost.police_id == police_id
+    return conditional_response(request, make_etag("police-news", police_id, news_version(db, scope)), lambda: news_rows(db, scope))
 
 @app.delete("/police/news/{post_id}")
 def delete_news_post(post_id: int, db: Session = Depends(get_db)):
@@ -0,0 +1,346 @@
+import datetime
+import hashlib
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import CancelledError
+
+from PIL import Image, ImageOps
+from sqlalchemy import func, or_, and_
+
+from compute import compute_engine, PRIORITY_BACKGROUND
+from models import Evidence, archived_evidence
+from storage import storage
+from write_queue import write_batcher
+
+# Playback renditions for video evidence: a low-bitrate H.264/AAC proxy with
+# faststart, a poster frame and a sprite sheet of timeline thumbnails; image
+# evidence gets a downscaled preview as its poster. The evidence table is the
+# backlog: a dispatcher thread claims pending rows one at a time and hands
+# them to the shared compute pool at background priority, never more than
+# MEDIA_QUEUE_MAX jobs at once, so a burst of uploads can't pile up work in
+# memory. Outputs are stored under uploads/media/<sha256 of the source>/ in
+# the storage backend, so re-uploads of the same file reuse the existing
+# renditions.
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+MEDIA_DIR = os.path.join("uploads", "media")
+# Jobs handed to the pool (running + waiting) at any time
+MEDIA_QUEUE_MAX = int(os.getenv("MEDIA_QUEUE_MAX", "4"))
+# A "processing" row older than this is assumed to be from a crashed worker
+MEDIA_STALE_SECONDS = int(os.getenv("MEDIA_STALE_SECONDS", "3600"))
+# How often the dispatcher looks for pending rows when nothing woke it
+MEDIA_POLL_SECONDS = 30
+
+PROXY_MAX_HEIGHT = 720
+PROXY_CRF = 28
+PROXY_MAXRATE = "1500k"
+SPRITE_TILES = 100
+SPRITE_COLUMNS = 10
+SPRITE_TILE_WIDTH = 160
+IMAGE_PREVIEW_MAX_SIDE = 720
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+RENDITIONS = ("proxy.mp4", "poster.jpg", "sprite.jpg")
+
+
+def probe_duration(source):
+    output = subprocess.run(
+        [FFPROBE_BIN, "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1:nk=1", source],
+        check=True, capture_output=True, text=True
+    ).stdout.strip()
+    try:
+        return float(output)
+    except ValueError:  # some streams don't report a duration
+        return 0.0
+
+
+def ffmpeg(*args):
+    subprocess.run([FFMPEG_BIN, "-y", "-v", "error", *args], check=True, capture_output=True)
+
+
+def render_media(file_path, file_type="video", content_hash=None, media_dir=MEDIA_DIR):
+    """Runs in the compute pool. Renders proxy.mp4, poster.jpg and
+    sprite.jpg for a video evidence file (just poster.jpg for an image), or
+    reuses them if a file with the same content was rendered before. Returns
+    the output paths and timing info for the sprite."""
+    with storage.local_copy(file_path) as source:
+        if file_type == "image":
+            return _render_image(source, content_hash, media_dir)
+        return _render_media(source, content_hash, media_dir)
+
+
+def _render_image(source, content_hash, media_dir):
+    content_hash = content_hash or file_sha256(source)
+    out_dir = os.path.join(media_dir, content_hash)
+    result = {
+        "content_hash": content_hash,
+        "proxy_path": None,
+        "poster_path": os.path.join(out_dir, "poster.jpg"),
+        "sprite_path": None,
+        "sprite_interval": None,
+    }
+    if storage.exists(media_url(result["poster_path"])):
+        return result
+
+    os.makedirs(media_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=media_dir, prefix=".tmp-")
+    try:
+        with Image.open(source) as image:
+            preview = ImageOps.exif_transpose(image).convert("RGB")
+        preview.thumbnail((IMAGE_PREVIEW_MAX_SIDE, IMAGE_PREVIEW_MAX_SIDE))
+        preview.save(os.path.join(work_dir, "poster.jpg"), "JPEG", quality=85)
+        publish_renditions(work_dir, out_dir, ["poster.jpg"])
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    return result
+
+
+def publish_renditions(work_dir, out_dir, names):
+    if storage.is_local:
+        try:
+            os.rename(work_dir, out_dir)
+        except OSError:
+            # Another worker rendered the same content first
+            shutil.rmtree(work_dir, ignore_errors=True)
+    else:
+        for name in names:
+            with open(os.path.join(work_dir, name), "rb") as f:
+                storage.save(f, media_url(os.path.join(out_dir, name)))
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _render_media(source, content_hash, media_dir):
+    # Hash recorded at upload if there is one, so the file isn't read twice
+    content_hash = content_hash or file_sha256(source)
+    out_dir = os.path.join(media_dir, content_hash)
+    duration = probe_duration(source)
+    # One tile every `interval` seconds, at most SPRITE_TILES of them
+    interval = max(1.0, duration / SPRITE_TILES) if duration else 1.0
+    tiles = max(1, min(SPRITE_TILES, math.ceil(duration / interval))) if duration else 1
+    result = {
+        "content_hash": content_hash,
+        "proxy_path": os.path.join(out_dir, "proxy.mp4"),
+        "poster_path": os.path.join(out_dir, "poster.jpg"),
+        "sprite_path": os.path.join(out_dir, "sprite.jpg"),
+        "duration": duration,
+        "sprite_interval": interval,
+    }
+    # The sprite is written last, so its presence means a complete set
+    if storage.exists(media_url(result["sprite_path"])):
+        return result
+
+    # Render into a temp dir next to the cache and rename it into place, so
+    # a half-written rendition is never picked up as cached
+    os.makedirs(media_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=media_dir, prefix=".tmp-")
+    try:
+        ffmpeg(
+            "-i", source,
+            "-vf", f"scale=-2:'min({PROXY_MAX_HEIGHT},ih)'",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", str(PROXY_CRF),
+            "-maxrate", PROXY_MAXRATE, "-bufsize", "3000k", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "96k",
+            "-movflags", "+faststart",
+            os.path.join(work_dir, "proxy.mp4")
+        )
+        ffmpeg(
+            "-ss", str(min(1.0, duration / 10)), "-i", source,
+            "-frames:v", "1", "-vf", f"scale=-2:'min({PROXY_MAX_HEIGHT},ih)'", "-q:v", "3",
+            os.path.join(work_dir, "poster.jpg")
+        )
+        rows = math.ceil(tiles / SPRITE_COLUMNS)
+        ffmpeg(
+            "-i", source,
+            "-vf", f"fps=1/{interval},scale={SPRITE_TILE_WIDTH}:-2,tile={min(tiles, SPRITE_COLUMNS)}x{rows}",
+            "-frames:v", "1", "-q:v", "5",
+            os.path.join(work_dir, "sprite.jpg")
+        )
+        publish_renditions(work_dir, out_dir, RENDITIONS)
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    return result
+
+
+def claim_next_media(file_types):
+    def write(db):
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=MEDIA_STALE_SECONDS)
+        evidence = db.query(Evidence).filter(
+            Evidence.file_type.in_(file_types),
+            or_(
+                Evidence.media_status == None,
+                Evidence.media_status == "pending",
+                and_(Evidence.media_status == "processing", Evidence.updated_at < stale),
+            )
+        ).order_by(Evidence.id).first()
+        if not evidence:
+            return None
+        evidence.media_status = "processing"
+        return evidence.id, evidence.file_path, evidence.file_type, evidence.content_hash
+
+    return write_batcher.run(write)
+
+
+def media_url(path):
+    return "/" + path.replace(os.sep, "/") if path else None
+
+
+def unused_hashes(db, content_hashes, archiving=()):
+    # Those of the hashes no evidence row refers to any more: no live row,
+    # and no archived row that still lists renditions. archiving: ids of
+    # cases being archived in the same op, whose archived copies don't count.
+    # Call in the write op that removed the rows, after removing them.
+    hashes = {h for h in content_hashes if h}
+    if not hashes:
+        return []
+    in_use = {h for (h,) in db.query(Evidence.content_hash).filter(Evidence.content_hash.in_(hashes)).distinct()}
+    archived = archived_evidence.c
+    in_use |= {h for (h,) in db.query(archived.content_hash).filter(
+        archived.content_hash.in_(hashes - in_use),
+        or_(archived.proxy_path != None, archived.poster_path != None, archived.sprite_path != None),
+        archived.case_id.notin_(archiving),
+    ).distinct()}
+    return sorted(hashes - in_use)
+
+
+def media_dirs(content_hashes):
+    # Rendition directories, in the "/uploads/media/<hash>/" form cleanup_queue takes
+    return [media_url(os.path.join(MEDIA_DIR, h)) + "/" for h in content_hashes]
+
+
+def unused_media_dirs(db, content_hashes):
+    return media_dirs(unused_hashes(db, content_hashes))
+
+
+def store_renditions(evidence_id, result):
+    def write(db):
+        db.query(Evidence).filter(Evidence.id == evidence_id).update({
+            "media_status": "ready",
+            # Never overwrite the upload-time hash (integrity.py relies on it)
+            "content_hash": func.coalesce(Evidence.content_hash, result["content_hash"]),
+            "proxy_path": media_url(result["proxy_path"]),
+            "poster_path": media_url(result["poster_path"]),
+            "sprite_path": media_url(result["sprite_path"]),
+            "sprite_interval": result["sprite_interval"],
+        }, synchronize_session=False)
+
+    return write_batcher.submit(write)
+
+
+def requeue_renditions(evidence_id):
+    # For a render cancelled by shutdown: the next start picks it up again
+    def write(db):
+        db.query(Evidence).filter(Evidence.id == evidence_id).update({"media_status": "pending"}, synchronize_session=False)
+
+    return write_batcher.submit(write)
+
+
+def fail_renditions(evidence_id):
+    def write(db):
+        db.query(Evidence).filter(Evidence.id == evidence_id).update({"media_status": "failed"}, synchronize_session=False)
+
+    return write_batcher.submit(write)
+
+
+class MediaPipeline:
+    def __init__(self, max_queued=MEDIA_QUEUE_MAX):
+        self.max_queued = max_queued
+        self.file_types = ["image"]
+        self._thread = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max_queued)
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {"rendered": 0, "failed": 0}
+
+    def start(self):
+        if shutil.which(FFMPEG_BIN) is None or shutil.which(FFPROBE_BIN) is None:
+            print(f"[MEDIA] {FFMPEG_BIN}/{FFPROBE_BIN} not found, video renditions disabled")
+            self.file_types = ["image"]
+        else:
+            self.file_types = ["image", "video"]
+        self._stopping.clear()
+        self._ensure_thread()
+        return "video" in self.file_types
+
+    def stop(self):
+        # Stops claiming rows. Renders already handed to the pool finish, or
+        # are requeued when compute_engine.shutdown() cancels them.
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._wake.set()
+        thread.join()
+
+    def wake(self):
+        # Called after new evidence is filed
+        if self._thread is not None:
+            self._ensure_thread()
+            self._wake.set()
+
+    def _ensure_thread(self):
+        # Threads don't survive fork, so each uvicorn worker starts its own
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._slots = threading.BoundedSemaphore(self.max_queued)
+            self._thread = threading.Thread(target=self._dispatch, name="media-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            # Timed, so a full queue doesn't hold up stop()
+            if not self._slots.acquire(timeout=1):
+                continue
+            if self._stopping.is_set():
+                self._slots.release()
+                return
+            try:
+                claimed = claim_next_media(self.file_types)
+            except Exception as e:
+                print(f"[ERROR] Failed to claim evidence for rendering: {e}")
+                claimed = None
+            if claimed is None:
+                self._slots.release()
+                self._wake.wait(MEDIA_POLL_SECONDS)
+                self._wake.clear()
+                continue
+
+            evidence_id, file_path, file_type, content_hash = claimed
+            future = compute_engine.submit(render_media, file_path, file_type, content_hash, priority=PRIORITY_BACKGROUND)
+            future.add_done_callback(lambda f, evidence_id=evidence_id: self._finished(evidence_id, f))
+
+    def _finished(self, evidence_id, future):
+        try:
+            result = future.result()
+            store_renditions(evidence_id, result)
+            self.stats["rendered"] += 1
+        except CancelledError:
+            requeue_renditions(evidence_id)
+        except Exception as e:
+            print(f"[ERROR] Rendering media for evidence {evidence_id} failed: {e}")
+            fail_renditions(evidence_id)
+            self.stats["failed"] += 1
+        finally:
+            self._slots.release()
+
+
+media_pipeline = MediaPipeline()
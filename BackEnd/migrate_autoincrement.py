@@ -0,0 +1,77 @@
+import sqlite3
+import os
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.dialects import sqlite
+import models
+from database import engine
+
+# Without AUTOINCREMENT SQLite hands out max(id) + 1, so deleting the newest
+# row (or archiving it) lets the next insert reuse its id: an archived row
+# and a live row end up with the same id, and a notification can get an id
+# below a delivery cursor that already passed it. Tables that gained
+# sqlite_autoincrement are rebuilt the same way as migrate_cascade.py, and
+# their sqlite_sequence entry starts above every id already handed out,
+# archived ones included. Safe to re-run.
+TABLES = ["cases", "evidence", "notifications"]
+
+def migrate():
+    db_path = 'test.db'
+    if not os.path.exists(db_path):
+        print(f"{db_path} not found.")
+        return
+
+    conn = sqlite3.connect(db_path)
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA foreign_keys=OFF")
+    cursor.execute("BEGIN")
+    try:
+        for name in TABLES:
+            row = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+            if row is None:
+                continue
+            if "AUTOINCREMENT" not in row[0].upper():
+                table = models.Base.metadata.tables[name]
+                existing = [r[1] for r in cursor.execute(f"PRAGMA table_info({name})")]
+                ddl = str(CreateTable(table).compile(dialect=sqlite.dialect()))
+                ddl = ddl.replace(f"CREATE TABLE {name} ", f"CREATE TABLE new_{name} ", 1)
+                columns = ", ".join(f'"{c.name}"' for c in table.columns if c.name in existing)
+
+                cursor.execute(f"DROP TABLE IF EXISTS new_{name}")
+                cursor.execute(ddl)
+                cursor.execute(f"INSERT INTO new_{name} ({columns}) SELECT {columns} FROM {name}")
+                cursor.execute(f"DROP TABLE {name}")
+                cursor.execute(f"ALTER TABLE new_{name} RENAME TO {name}")
+                print(f"Rebuilt {name} with AUTOINCREMENT.")
+
+            # Continue after the highest id ever used, live or archived
+            highest = cursor.execute(f"SELECT MAX(id) FROM {name}").fetchone()[0] or 0
+            archived = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"archived_{name}",)).fetchone()
+            if archived:
+                highest = max(highest, cursor.execute(f"SELECT MAX(id) FROM archived_{name}").fetchone()[0] or 0)
+            if name == "notifications":
+                # ... and above every delivery cursor, which may point past deleted rows
+                cursors = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notification_cursors'").fetchone()
+                if cursors:
+                    highest = max(highest, cursor.execute("SELECT MAX(last_delivered_id) FROM notification_cursors").fetchone()[0] or 0)
+            sequence = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (name,)).fetchone()
+            highest = max(highest, sequence[0] if sequence else 0)
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (name,))
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, highest))
+
+        cursor.execute("COMMIT")
+        print("Successfully switched tables to AUTOINCREMENT ids.")
+    except sqlite3.Error as e:
+        cursor.execute("ROLLBACK")
+        print(f"Error: {e}")
+    finally:
+        cursor.execute("PRAGMA foreign_keys=ON")
+        conn.close()
+
+    # Recreate the indexes dropped with the old tables
+    for name in TABLES:
+        for index in models.Base.metadata.tables[name].indexes:
+            index.create(bind=engine, checkfirst=True)
+
+if __name__ == "__main__":
+    migrate()
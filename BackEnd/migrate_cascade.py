@@ -0,0 +1,66 @@
+import sqlite3
+import os
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.dialects import sqlite
+import models
+from database import engine
+
+# SQLite can't ALTER a foreign key, so tables that gained ON DELETE CASCADE /
+# SET NULL are rebuilt (create new -> copy -> drop old -> rename), following
+# https://www.sqlite.org/lang_altertable.html#otheralter. Orphaned rows left
+# behind by the old delete endpoints (e.g. notifications of deleted cases)
+# are dropped during the copy.
+TABLES = ["cases", "evidence", "notifications", "news_posts"]
+
+def migrate():
+    db_path = 'test.db'
+    if not os.path.exists(db_path):
+        print(f"{db_path} not found.")
+        return
+
+    conn = sqlite3.connect(db_path)
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA foreign_keys=OFF")
+    cursor.execute("BEGIN")
+    try:
+        for name in TABLES:
+            table = models.Base.metadata.tables[name]
+            existing = [row[1] for row in cursor.execute(f"PRAGMA table_info({name})")]
+            if not existing:
+                continue
+            ddl = str(CreateTable(table).compile(dialect=sqlite.dialect()))
+            ddl = ddl.replace(f"CREATE TABLE {name} ", f"CREATE TABLE new_{name} ", 1)
+            columns = ", ".join(f'"{c.name}"' for c in table.columns if c.name in existing)
+
+            cursor.execute(f"DROP TABLE IF EXISTS new_{name}")
+            cursor.execute(ddl)
+            cursor.execute(f"INSERT INTO new_{name} ({columns}) SELECT {columns} FROM {name}")
+            cursor.execute(f"DROP TABLE {name}")
+            cursor.execute(f"ALTER TABLE new_{name} RENAME TO {name}")
+
+        # Remove rows pointing at parents that no longer exist
+        # (repeat, since removing an orphaned case orphans its evidence)
+        removed = 0
+        orphans = cursor.execute("PRAGMA foreign_key_check").fetchall()
+        while orphans:
+            for table_name, rowid, parent, _ in orphans:
+                cursor.execute(f"DELETE FROM {table_name} WHERE rowid = ?", (rowid,))
+            removed += len(orphans)
+            orphans = cursor.execute("PRAGMA foreign_key_check").fetchall()
+        print(f"Removed {removed} orphaned rows.")
+
+        cursor.execute("COMMIT")
+        print("Successfully rebuilt tables with ON DELETE CASCADE foreign keys.")
+    except sqlite3.Error as e:
+        cursor.execute("ROLLBACK")
+        print(f"Error: {e}")
+    finally:
+        cursor.execute("PRAGMA foreign_keys=ON")
+        conn.close()
+
+    # Recreate any indexes dropped with the old tables
+    models.Base.metadata.create_all(bind=engine)
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,36 @@
+import sqlite3
+import os
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.dialects import sqlite
+import models
+
+# Adds columns that exist in models.py but not yet in test.db
+# (ALTER TABLE ... ADD COLUMN). Python-side defaults don't apply to old rows,
+# so new columns start out NULL there. Safe to re-run.
+def migrate():
+    db_path = 'test.db'
+    if not os.path.exists(db_path):
+        print(f"{db_path} not found.")
+        return
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    try:
+        for table in models.Base.metadata.sorted_tables:
+            existing = [row[1] for row in cursor.execute(f"PRAGMA table_info({table.name})")]
+            if not existing:
+                continue
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = str(CreateColumn(column).compile(dialect=sqlite.dialect()))
+                cursor.execute(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                print(f"Successfully added {column.name} column to {table.name} table.")
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        print(f"Error: {e}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,15 @@
+from database import engine
+import models
+
+# create_all() skips tables that already exist, and their indexes with them,
+# so indexes added to models.py later have to be created explicitly on
+# existing databases. Safe to re-run.
+def migrate():
+    models.Base.metadata.create_all(bind=engine)
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+            print(f"Index {index.name} on {table.name} ready.")
+
+if __name__ == "__main__":
+    migrate()
@@ -1,34 +1,86 @@
+import contextlib
 import os
+import tempfile
 from dotenv import load_dotenv
 import google.generativeai as genai
-from PIL import Image
+from PIL import Image, ImageOps
+
+from compute import compute_engine, PRIORITY_INTERACTIVE
 
 load_dotenv()
 
 genai.configure(api_key = os.getenv("GEMINI_API_KEY"))
 
 
+ANALYSIS_PROMPT = """
+Analyze this image carefully.
+
+1. Check if Google SynthID watermark is present.
+2. Determine whether the image appears REAL or AI-GENERATED.
+3. Explain your reasoning clearly in professional paragraph format.
+4. Mention any visual inconsistencies (lighting, edges, shadows, blending).
+5. Conclude with a final verdict.
+
+Provide a detailed explanation. End the report with exactly one line, on its
+own, that is either "VERDICT: REAL" or "VERDICT: AI_GENERATED", and nothing
+after it.
+"""
+
+# Larger images are downscaled before upload (the model doesn't need more)
+ANALYSIS_MAX_SIDE = int(os.getenv("ANALYSIS_MAX_SIDE", "3072"))
+ANALYSIS_PREPARE_TIMEOUT = 120
+# Formats the model accepts as they are
+MODEL_IMAGE_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+def prepare_image(source, work_dir, max_side=ANALYSIS_MAX_SIDE):
+    """Runs in the compute pool. Decodes the image and returns (path, mime
+    type) of what to send: the file itself if the model can take it as is,
+    else an upright, downscaled PNG written to work_dir."""
+    with Image.open(source) as image:
+        upright = image.getexif().get(0x0112, 1) == 1
+        if image.format in MODEL_IMAGE_TYPES and upright and max(image.size) <= max_side:
+            image.load()  # fails here, not at the model, if the file is corrupt
+            return source, MODEL_IMAGE_TYPES[image.format]
+        prepared = ImageOps.exif_transpose(image)
+        prepared.thumbnail((max_side, max_side))
+        if prepared.mode not in ("RGB", "RGBA", "L"):
+            prepared = prepared.convert("RGBA" if "A" in prepared.getbands() else "RGB")
+        path = os.path.join(work_dir, "prepared.png")
+        prepared.save(path, "PNG")
+        return path, "image/png"
+
+
+@contextlib.contextmanager
+def prepared_image(image_path, priority=PRIORITY_INTERACTIVE):
+    # Decoding and resizing happen in a worker process; this one only reads
+    # the finished file
+    with tempfile.TemporaryDirectory() as work_dir:
+        path, mime_type = compute_engine.run(
+            prepare_image, image_path, work_dir, priority=priority, timeout=ANALYSIS_PREPARE_TIMEOUT
+        )
+        with open(path, "rb") as f:
+            yield {"mime_type": mime_type, "data": f.read()}
+
+
 class GeminiImageAnalyzer:
     def __init__(self):
         self.model = genai.GenerativeModel("gemini-2.5-flash")
-    def analyze(self, image_path: str):
+    def analyze(self, image_path: str, priority=PRIORITY_INTERACTIVE):
         try:
-            image = Image.open(image_path)
-            
-            prompt = """
-            Analyze this image carefully.
-
-            1. Check if Google SynthID watermark is present.
-            2. Determine whether the image appears REAL or AI-GENERATED.
-            3. Explain your reasoning clearly in professional paragraph format.
-            4. Mention any visual inconsistencies (lighting, edges, shadows, blending).
-            5. Conclude with a final verdict.
-
-            Provide a detailed explanation.
-            """
-            response = self.model.generate_content([prompt, image])
+            with prepared_image(image_path, priority) as image:
+                response = self.model.generate_content([ANALYSIS_PROMPT, image])
             return response.text
         
         except Exception as e:
             print(f"Error analyzing image: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    def analyze_stream(self, image_path: str):
+        # Yields the report text chunk by chunk as the model generates it.
+        # Errors propagate so the caller can mark the analysis failed.
+        with prepared_image(image_path) as image:
+            response = self.model.generate_content([ANALYSIS_PROMPT, image], stream=True)
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import text, Column, Integer, String, DateTime, Date, ForeignKey, Text, Boolean, Index, Table, LargeBinary, Float, func
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -13,10 +13,25 @@ class User(Base):
     password = Column(String)
     role = Column(String, default="user")
     status = Column(String, default="pending")  # pending / approved
+    # Police stations and courts only; indexed for nearest lookups by geo.py
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    jurisdiction = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     # Relationships
-    cases = relationship("Case", back_populates="user", primaryjoin="User.id == Case.user_id")
-    notifications = relationship("Notification", back_populates="user")
+    cases = relationship("Case", back_populates="user", primaryjoin="User.id == Case.user_id", passive_deletes=True)
+    notifications = relationship("Notification", back_populates="user", passive_deletes=True)
+
+    __table_args__ = (
+        # Admin directory: case-insensitive prefix search on name / email
+        Index("ix_users_name_nocase", name.collate("NOCASE"), id),
+        Index("ix_users_email_nocase", email.collate("NOCASE"), id),
+        # ... and the keyset sort, which reads NULL as '' so NULL rows can be paged past
+        Index("ix_users_name_sort", func.coalesce(name, "").collate("NOCASE"), id),
+        Index("ix_users_email_sort", func.coalesce(email, "").collate("NOCASE"), id),
+        Index("ix_users_role_status", "role", "status"),
+    )
 
 class Admin(Base):
     __tablename__ = "admins"
@@ -31,57 +46,117 @@ class Case(Base):
     __tablename__ = "cases"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    police_id = Column(Integer, ForeignKey("users.id"), nullable=True)
-    court_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    police_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
+    court_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
     title = Column(String)
     description = Column(Text)
     incident_date = Column(String)
     status = Column(String, default="pending")
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    # When status last changed, for time-in-stage (case_events.py)
+    status_changed_at = Column(DateTime, nullable=True)
+    # Merkle tree over the case's evidence hashes (integrity.py)
+    evidence_root = Column(String, nullable=True)
+    evidence_leaves = Column(Integer, default=0)
 
     # Relationships
     user = relationship("User", foreign_keys=[user_id], back_populates="cases")
     police = relationship("User", foreign_keys=[police_id])
     court = relationship("User", foreign_keys=[court_id])
-    evidence = relationship("Evidence", back_populates="case")
+    evidence = relationship("Evidence", back_populates="case", passive_deletes=True)
+
+    __table_args__ = (
+        # Archival sweep: terminal-status cases by age
+        Index("ix_cases_status_updated_at", "status", "updated_at"),
+        # Ids are never reused, so archived_cases rows (which keep their id)
+        # can't collide with a case filed later
+        {"sqlite_autoincrement": True},
+    )
 
 
 class Evidence(Base):
     __tablename__ = "evidence"
 
     id = Column(Integer, primary_key=True)
-    case_id = Column(Integer, ForeignKey("cases.id"))
+    case_id = Column(Integer, ForeignKey("cases.id", ondelete="CASCADE"), index=True)
     file_path = Column(String)
     file_type = Column(String) # image / video
     uploaded_at = Column(DateTime, default=datetime.datetime.utcnow)
     analysis_status = Column(String, default="not_started") # not_started, processing, completed, failed
     is_authentic = Column(Boolean, nullable=True)
     confidence_score = Column(Integer, nullable=True)
+    analysis_report = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    # Video playback renditions (media.py)
+    media_status = Column(String, nullable=True) # pending, processing, ready, failed (videos only)
+    content_hash = Column(String, nullable=True) # sha256 of the uploaded file
+    proxy_path = Column(String, nullable=True)
+    poster_path = Column(String, nullable=True)
+    sprite_path = Column(String, nullable=True)
+    sprite_interval = Column(Float, nullable=True) # seconds of video per sprite tile
+
+    # Chain of custody (integrity.py)
+    tree_position = Column(Integer, nullable=True) # leaf index in the case's hash tree
+    integrity_status = Column(String, nullable=True) # verified, tampered, missing
+    verified_at = Column(DateTime, nullable=True)
 
     # Relationship
     case = relationship("Case", back_populates="evidence")
 
+    __table_args__ = (
+        # Media dispatcher: next video waiting for renditions
+        Index("ix_evidence_type_media_status", "file_type", "media_status"),
+        # Integrity verifier: least recently verified first
+        Index("ix_evidence_verified_at", "verified_at"),
+        # Whether any row still uses a rendition set (media.unused_media_dirs)
+        Index("ix_evidence_content_hash", "content_hash"),
+        # Ids are never reused (see Case)
+        {"sqlite_autoincrement": True},
+    )
+
 class Notification(Base):
     __tablename__ = "notifications"
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    case_id = Column(Integer, ForeignKey("cases.id"), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    case_id = Column(Integer, ForeignKey("cases.id", ondelete="CASCADE"), nullable=True)
     message = Column(Text)
     type = Column(String) # "review" / "court_transfer"
     is_read = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Set by fan-out; an unread notification with the same key isn't repeated
+    dedup_key = Column(String, nullable=True)
 
     # Relationships
     user = relationship("User", back_populates="notifications")
     case = relationship("Case")
 
+    __table_args__ = (
+        # Delivery cursors read "user_id = ? AND id > ?" as a range scan
+        Index("ix_notifications_user_id_id", "user_id", "id"),
+        Index("ux_notifications_unread_dedup", "user_id", "dedup_key", unique=True,
+              sqlite_where=text("is_read = 0 AND dedup_key IS NOT NULL")),
+        # Delivery cursors assume ids only go up; a reused id would sit
+        # behind someone's cursor and never be delivered
+        {"sqlite_autoincrement": True},
+    )
+
+class NotificationCursor(Base):
+    __tablename__ = "notification_cursors"
+
+    # Highest notification id already delivered to the user
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_delivered_id = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
 class NewsPost(Base) :
     __tablename__ = "news_posts"
 
     id = Column(Integer, primary_key=True)
-    police_id = Column(Integer, ForeignKey("users.id"))
+    police_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     title = Column(String)
     content = Column(Text)
     image_path = Column(String, nullable=True)
@@ -90,3 +165,124 @@ class NewsPost(Base) :
     # Relationship
     police = relationship("User")
 
+class CaseHashNode(Base):
+    __tablename__ = "case_hash_nodes"
+
+    # Level 0 holds the leaves; the single node on the top level is the root
+    case_id = Column(Integer, ForeignKey("cases.id", ondelete="CASCADE"), primary_key=True)
+    level = Column(Integer, primary_key=True)
+    position = Column(Integer, primary_key=True)
+    hash = Column(String)
+
+class AnalysisBatch(Base):
+    __tablename__ = "analysis_batches"
+
+    id = Column(Integer, primary_key=True)
+    case_id = Column(Integer, ForeignKey("cases.id", ondelete="CASCADE"), index=True)
+    status = Column(String, default="running") # running / completed / partial / failed
+    priority = Column(Integer, default=1) # lower runs first
+    total = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    verdict = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class PendingUpload(Base):
+    __tablename__ = "pending_uploads"
+
+    # Direct-to-storage upload slot; becomes an Evidence row once completed
+    id = Column(String, primary_key=True) # random token, also the upload URL capability
+    case_id = Column(Integer, ForeignKey("cases.id", ondelete="CASCADE"), index=True)
+    file_path = Column(String)
+    file_type = Column(String)
+    content_type = Column(String)
+    size = Column(Integer)
+    sha256 = Column(String)
+    status = Column(String, default="pending") # pending / uploaded / completed / failed
+    evidence_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class CaseEvent(Base):
+    __tablename__ = "case_events"
+
+    # Append-only status history. No foreign keys: the log outlives deleted
+    # and archived cases.
+    id = Column(Integer, primary_key=True)
+    case_id = Column(Integer, index=True)
+    from_status = Column(String, nullable=True) # None when the case is filed
+    to_status = Column(String)
+    actor_id = Column(Integer, nullable=True)
+    actor_role = Column(String, nullable=True) # user / police / court / system
+    police_id = Column(Integer, nullable=True) # station and court at the time of the event
+    court_id = Column(Integer, nullable=True)
+    stage_seconds = Column(Float, nullable=True) # time spent in from_status
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class CaseDailyRollup(Base):
+    __tablename__ = "case_daily_rollups"
+
+    # scope: "police" / "court" with the user id, or "all" with 0
+    day = Column(Date, primary_key=True)
+    scope = Column(String, primary_key=True)
+    scope_id = Column(Integer, primary_key=True)
+    filed = Column(Integer, default=0)
+    reviewed = Column(Integer, default=0)
+    sent_to_court = Column(Integer, default=0)
+    resolved = Column(Integer, default=0)
+
+class StageDurationRollup(Base):
+    __tablename__ = "stage_duration_rollups"
+
+    # Log-scale histogram of time spent in each stage, for mean and p90
+    day = Column(Date, primary_key=True)
+    scope = Column(String, primary_key=True)
+    scope_id = Column(Integer, primary_key=True)
+    stage = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, default=0)
+    total_seconds = Column(Float, default=0)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True) # "<route>:<caller>:<Idempotency-Key header>"
+    fingerprint = Column(String)
+    status = Column(String, default="in_progress") # in_progress / completed
+    status_code = Column(Integer, nullable=True)
+    content_type = Column(String, nullable=True)
+    response_body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+    # in_progress rows: the claiming request, and until when its claim holds
+    # unless renewed (a worker that died stops renewing)
+    owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
+# --- ARCHIVE (cold) TABLES ---
+# Same columns as the hot table (no foreign keys, so archived rows outlive
+# their parents) plus archived_at. Filled by archive.py. Rows keep their hot
+# id, which stays unique because the hot tables never reuse ids.
+
+def archive_table(table, *extra_columns):
+    columns = [Column(c.name, c.type, primary_key=c.primary_key, index=c.index) for c in table.columns]
+    return Table(
+        f"archived_{table.name}", Base.metadata,
+        *columns,
+        Column("archived_at", DateTime, index=True),
+        *extra_columns
+    )
+
+archived_cases = archive_table(Case.__table__)
+# cold_path: where the file went if it was moved to cold storage. Archived
+# rows can hold on to renditions too (media.unused_hashes), hence the index.
+archived_evidence = archive_table(
+    Evidence.__table__,
+    Column("cold_path", String, nullable=True),
+    Index("ix_archived_evidence_content_hash", "content_hash"),
+)
+archived_notifications = archive_table(Notification.__table__)
+# So inclusion proofs still work for archived evidence
+archived_case_hash_nodes = archive_table(CaseHashNode.__table__)
@@ -0,0 +1,208 @@
+import datetime
+import hashlib
+import os
+import queue
+import threading
+
+from sqlalchemy import select, union, literal, insert, func, Integer, String, Text, Boolean, DateTime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import SessionLocal
+from models import User, Case, Notification, NotificationCursor
+from write_queue import write_batcher
+
+# Broadcast notifications. An audience is a SELECT of user ids; fan-out copies
+# the message to it with INSERT ... SELECT, a chunk of users per write so a
+# station-wide alert never holds the writer for long, from a background
+# thread so the request that triggered it doesn't wait. Each copy carries a
+# dedup key, and a partial unique index on unread (user_id, dedup_key) makes
+# a repeated broadcast a no-op for anyone who hasn't read the first one.
+# Clients poll for new notifications past a cursor (last id seen), an index
+# range scan on (user_id, id): they page with the cursor each poll returns
+# and acknowledge it once the notifications are shown, which moves the
+# user's stored cursor. A poll that never arrives leaves the stored cursor
+# where it was, so nothing is lost. Notification ids are AUTOINCREMENT, so a
+# new one always lands past every cursor.
+
+NOTIFY_CHUNK_SIZE = int(os.getenv("NOTIFY_CHUNK_SIZE", "500"))
+NOTIFY_DELIVER_LIMIT = 100
+
+notifications_table = Notification.__table__
+NOTIFICATION_COLUMNS = ["user_id", "case_id", "message", "type", "is_read", "created_at", "dedup_key"]
+
+
+def dedup_key(type, case_id, message, source_id=None):
+    # source_id: the row the broadcast is about (e.g. a news post), so two
+    # posts that happen to read the same aren't collapsed into one
+    return hashlib.sha1(f"{type}|{case_id}|{source_id}|{message}".encode()).hexdigest()
+
+
+# --- AUDIENCES (selects of a single user_id column) ---
+
+def station_audience(police_id):
+    # Approved users who have filed a case with the station
+    return (
+        select(Case.user_id.label("user_id"))
+        .join(User, User.id == Case.user_id)
+        .where(Case.police_id == police_id, User.status == "approved")
+        .distinct()
+    )
+
+
+def case_parties(case_id):
+    # Filer, station and court (if assigned) of a case
+    parties = union(
+        select(Case.user_id).where(Case.id == case_id),
+        select(Case.police_id).where(Case.id == case_id),
+        select(Case.court_id).where(Case.id == case_id),
+    ).subquery()
+    return select(User.id.label("user_id")).where(User.id.in_(select(parties.c[0])))
+
+
+# --- FAN-OUT ---
+
+def insert_chunk(audience, after, message, type, case_id, key, chunk_size=NOTIFY_CHUNK_SIZE):
+    """Inserts the next chunk of the audience (user ids above `after`).
+    Returns (rows inserted, last user id of the chunk or None when done)."""
+    def write(db):
+        users = audience.subquery()
+        upper = db.execute(
+            select(users.c.user_id).where(users.c.user_id > after)
+            .order_by(users.c.user_id).offset(chunk_size - 1).limit(1)
+        ).scalar()
+        criteria = [users.c.user_id > after]
+        if upper is not None:
+            criteria.append(users.c.user_id <= upper)
+        rows = select(
+            users.c.user_id,
+            literal(case_id, Integer),
+            literal(message, Text),
+            literal(type, String),
+            literal(False, Boolean),
+            literal(datetime.datetime.utcnow(), DateTime),
+            literal(key, String),
+        ).where(*criteria)
+        # OR IGNORE: skips users who still have this message unread
+        result = db.execute(insert(notifications_table).prefix_with("OR IGNORE").from_select(NOTIFICATION_COLUMNS, rows))
+        return result.rowcount, upper
+
+    return write_batcher.run(write)
+
+
+def fan_out(audience, message, type, case_id=None, source_id=None, chunk_size=NOTIFY_CHUNK_SIZE):
+    """Delivers message to every user in audience, chunk by chunk. Returns
+    the number of notifications created."""
+    key = dedup_key(type, case_id, message, source_id)
+    created, after = 0, 0
+    while after is not None:
+        inserted, after = insert_chunk(audience, after, message, type, case_id, key, chunk_size)
+        created += inserted
+    return created
+
+
+class FanOutQueue:
+    """Runs fan-outs on a background thread, one at a time, in order."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {"jobs": 0, "created": 0, "failed": 0}
+
+    def _ensure_thread(self):
+        # Threads don't survive fork, so each uvicorn worker starts its own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="notification-fan-out", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, audience, message, type, case_id=None, source_id=None):
+        self._ensure_thread()
+        self._queue.put((audience, message, type, case_id, source_id))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def join(self):
+        self._queue.join()
+
+    def snapshot(self):
+        return {**self.stats, "pending": self.pending()}
+
+    def _run(self):
+        while True:
+            audience, message, type, case_id, source_id = self._queue.get()
+            try:
+                self.stats["created"] += fan_out(audience, message, type, case_id, source_id)
+                self.stats["jobs"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"[ERROR] Notification fan-out ({type}) failed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+fan_out_queue = FanOutQueue()
+
+
+# --- DELIVERY ---
+
+def advance_cursor(user_id, last_id):
+    """Acknowledges delivery up to last_id. Returns the stored cursor."""
+    def write(db):
+        # Only as far as a notification the user actually has, so a bogus
+        # cursor can't hide ones that don't exist yet
+        last = db.query(func.max(Notification.id)).filter(Notification.user_id == user_id, Notification.id <= last_id).scalar()
+        if last is None:
+            return db.query(NotificationCursor.last_delivered_id).filter(NotificationCursor.user_id == user_id).scalar() or 0
+        stmt = sqlite_insert(NotificationCursor).values(
+            user_id=user_id, last_delivered_id=last, updated_at=datetime.datetime.utcnow()
+        )
+        # Never moves backwards if two acks race
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={
+                "last_delivered_id": func.max(NotificationCursor.last_delivered_id, stmt.excluded.last_delivered_id),
+                "updated_at": stmt.excluded.updated_at,
+            },
+        ))
+        return db.query(NotificationCursor.last_delivered_id).filter(NotificationCursor.user_id == user_id).scalar()
+
+    return write_batcher.run(write)
+
+
+def deliver_new(user_id, after=None, limit=NOTIFY_DELIVER_LIMIT):
+    """Notifications past `after` (default: the user's acknowledged cursor),
+    oldest first. Read-only: pass the returned cursor as `after` for the next
+    page, and to advance_cursor once they've been shown. `more` says whether
+    another poll would return more right away."""
+    db = SessionLocal()
+    try:
+        cursor = after
+        if cursor is None:
+            cursor = db.query(NotificationCursor.last_delivered_id).filter(NotificationCursor.user_id == user_id).scalar() or 0
+        query = (
+            select(notifications_table.c.id, notifications_table.c.message, notifications_table.c.type,
+                   notifications_table.c.is_read, notifications_table.c.created_at, notifications_table.c.case_id)
+            .where(notifications_table.c.user_id == user_id, notifications_table.c.id > cursor)
+            .order_by(notifications_table.c.id)
+            .limit(limit + 1)
+        )
+        rows = [
+            {"id": id, "message": message, "type": type, "is_read": is_read, "created_at": created_at, "case_id": case_id}
+            for id, message, type, is_read, created_at, case_id in db.execute(query)
+        ]
+    finally:
+        db.close()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        cursor = rows[-1]["id"]
+    return {"notifications": rows, "cursor": cursor, "more": more}
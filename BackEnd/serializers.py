@@ -0,0 +1,168 @@
+import datetime
+import json
+from collections import defaultdict
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, Column
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.visitors import replacement_traverse
+
+from models import User, Case, Evidence, Notification, NewsPost, archived_cases, archived_evidence, archived_notifications
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
+
+# List endpoints select plain columns and build response dicts directly in
+# the shape of the Pydantic response models in main.py, instead of loading
+# ORM objects, tacking extra attributes on and validating them one by one.
+
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    # App-wide default response class; handlers can also return it directly
+    # with prebuilt dicts to skip response_model validation entirely
+    def render(self, content):
+        return dumps(content)
+
+
+def to_archive(criteria, source, target):
+    # Rewrites filters written against a hot table (Case.police_id == 5) to
+    # the same-named columns of its archive table
+    def replace(element):
+        if isinstance(element, Column) and element.table is source:
+            return target.c[element.name]
+    return [replacement_traverse(criterion, {}, replace) for criterion in criteria]
+
+
+def _case_rows(db, cases, evidence_table, criteria, limit, newest_first):
+    filer = aliased(User)
+    police = aliased(User)
+    court = aliased(User)
+
+    case_query = (
+        select(
+            cases.c.id, cases.c.user_id, cases.c.police_id, cases.c.title, cases.c.description,
+            cases.c.incident_date, cases.c.status, cases.c.created_at, cases.c.court_id,
+            filer.name, police.name, court.name,
+        )
+        .outerjoin(filer, filer.id == cases.c.user_id)
+        .outerjoin(police, police.id == cases.c.police_id)
+        .outerjoin(court, court.id == cases.c.court_id)
+        .where(*criteria)
+        .order_by(cases.c.id.desc() if newest_first else cases.c.id)
+        .limit(limit)
+    )
+    rows = db.execute(case_query).all()
+
+    evidence = defaultdict(list)
+    evidence_query = (
+        select(evidence_table.c.case_id, evidence_table.c.id, evidence_table.c.file_path, evidence_table.c.file_type,
+               evidence_table.c.media_status, evidence_table.c.proxy_path, evidence_table.c.poster_path,
+               evidence_table.c.sprite_path, evidence_table.c.sprite_interval)
+        .order_by(evidence_table.c.id)
+    )
+    if limit is None:
+        evidence_query = evidence_query.join(cases, cases.c.id == evidence_table.c.case_id).where(*criteria)
+    else:
+        evidence_query = evidence_query.where(evidence_table.c.case_id.in_([row[0] for row in rows]))
+    for (case_id, evidence_id, file_path, file_type, media_status, proxy_path, poster_path,
+         sprite_path, sprite_interval) in db.execute(evidence_query):
+        evidence[case_id].append({
+            "id": evidence_id,
+            "file_path": file_path,
+            "file_type": file_type,
+            "media_status": media_status,
+            "proxy_path": proxy_path,
+            "poster_path": poster_path,
+            "sprite_path": sprite_path,
+            "sprite_interval": sprite_interval,
+        })
+
+    return [
+        {
+            "id": case_id,
+            "user_id": user_id,
+            "police_id": police_id,
+            "title": title,
+            "description": description,
+            "incident_date": incident_date,
+            "status": status,
+            "created_at": created_at,
+            "police_name": police_name or "Not Assigned",
+            "court_id": court_id,
+            "court_name": court_name or "Not Assigned",
+            "user_name": user_name or "Unknown",
+            "evidence": evidence.get(case_id, []),
+        }
+        for (case_id, user_id, police_id, title, description, incident_date, status,
+             created_at, court_id, user_name, police_name, court_name) in rows
+    ]
+
+
+def case_rows(db, *criteria, limit=None, newest_first=False, include_archived=False):
+    rows = _case_rows(db, Case.__table__, Evidence.__table__, criteria, limit, newest_first)
+    if include_archived:
+        archived = to_archive(criteria, Case.__table__, archived_cases)
+        rows += _case_rows(db, archived_cases, archived_evidence, archived, limit, newest_first)
+        rows.sort(key=lambda row: row["id"], reverse=newest_first)
+        rows = rows[:limit]
+    return rows
+
+
+def _notification_rows(db, notifications, criteria, limit):
+    query = (
+        select(notifications.c.id, notifications.c.message, notifications.c.type, notifications.c.is_read,
+               notifications.c.created_at, notifications.c.case_id)
+        .where(*criteria)
+        .order_by(notifications.c.created_at.desc())
+        .limit(limit)
+    )
+    return [
+        {"id": id, "message": message, "type": type, "is_read": is_read, "created_at": created_at, "case_id": case_id}
+        for id, message, type, is_read, created_at, case_id in db.execute(query)
+    ]
+
+
+def notification_rows(db, *criteria, limit=None, include_archived=False):
+    rows = _notification_rows(db, Notification.__table__, criteria, limit)
+    if include_archived:
+        archived = to_archive(criteria, Notification.__table__, archived_notifications)
+        rows += _notification_rows(db, archived_notifications, archived, limit)
+        rows.sort(key=lambda row: row["created_at"], reverse=True)
+        rows = rows[:limit]
+    return rows
+
+
+def news_rows(db, *criteria):
+    query = (
+        select(NewsPost.id, NewsPost.police_id, NewsPost.title, NewsPost.content,
+               NewsPost.image_path, NewsPost.created_at, User.name)
+        .outerjoin(User, User.id == NewsPost.police_id)
+        .where(*criteria)
+        .order_by(NewsPost.created_at.desc())
+    )
+    return [
+        {
+            "id": id,
+            "police_id": police_id,
+            "title": title,
+            "content": content,
+            "image_path": image_path,
+            "created_at": created_at,
+            "police_name": police_name or "Unknown Station",
+        }
+        for id, police_id, title, content, image_path, created_at, police_name in db.execute(query)
+    ]
@@ -0,0 +1,217 @@
+import base64
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # optional, only needed for STORAGE_BACKEND=s3
+    boto3 = None
+
+# Where evidence bytes live. Evidence.file_path keeps its "/uploads/<name>"
+# form with either backend: locally that's the file under the backend
+# directory (served by the /uploads mount), on S3 it's the object key
+# "uploads/<name>". Clients move bytes straight to and from the store with
+# presigned URLs, so API workers only ever handle metadata.
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local / s3
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+# Set for MinIO / moto / other S3-compatible stores
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+PRESIGN_EXPIRES_SECONDS = int(os.getenv("PRESIGN_EXPIRES_SECONDS", "900"))
+CHUNK_SIZE = 1024 * 1024
+
+
+def storage_key(file_path):
+    # "/uploads/x.jpg" -> "uploads/x.jpg"
+    return file_path.lstrip("/")
+
+
+class HashingReader:
+    """File-like wrapper that hashes whatever is read through it."""
+
+    def __init__(self, source):
+        self.source = source
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.source.read(size)
+        self.digest.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class LocalStorage:
+    is_local = True
+
+    def __init__(self, root="."):
+        self.root = root
+
+    def path(self, file_path):
+        return os.path.join(self.root, storage_key(file_path))
+
+    def save(self, source, file_path):
+        """Writes source to file_path. Returns the SHA-256, taken while writing."""
+        digest = hashlib.sha256()
+        with open(self.path(file_path), "wb") as buffer:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                buffer.write(chunk)
+        return digest.hexdigest()
+
+    def open(self, file_path):
+        return open(self.path(file_path), "rb")
+
+    def exists(self, file_path):
+        return os.path.exists(self.path(file_path))
+
+    def size(self, file_path):
+        return os.path.getsize(self.path(file_path))
+
+    def delete(self, file_path):
+        os.remove(self.path(file_path))
+
+    def delete_tree(self, dir_path):
+        if not os.path.isdir(self.path(dir_path)):
+            raise FileNotFoundError(dir_path)
+        shutil.rmtree(self.path(dir_path))
+
+    @contextlib.contextmanager
+    def local_copy(self, file_path):
+        yield self.path(file_path)
+
+    def download_url(self, file_path):
+        return file_path
+
+    def presign_upload(self, upload_id, file_path, content_type, sha256):
+        # No separate store to hand the client to: it streams the body to the
+        # API, which writes it to disk chunk by chunk and checks the hash
+        return {"method": "PUT", "url": f"/storage/uploads/{upload_id}", "headers": {"Content-Type": content_type}}
+
+    def uploaded_checksum(self, file_path):
+        # The PUT handler already compared the hash before keeping the file
+        return None
+
+
+class S3Storage:
+    is_local = False
+
+    def __init__(self, bucket=S3_BUCKET, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs the boto3 package")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs S3_BUCKET")
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self._client = None
+        self._pid = None
+
+    @property
+    def client(self):
+        # boto3 clients aren't fork-safe; media pool processes make their own
+        if self._client is None or self._pid != os.getpid():
+            self._client = boto3.client(
+                "s3", endpoint_url=self.endpoint_url, region_name=self.region,
+                config=BotoConfig(signature_version="s3v4")
+            )
+            self._pid = os.getpid()
+        return self._client
+
+    def save(self, source, file_path):
+        reader = HashingReader(source)
+        self.client.upload_fileobj(reader, self.bucket, storage_key(file_path))
+        return reader.hexdigest()
+
+    def open(self, file_path):
+        return self.client.get_object(Bucket=self.bucket, Key=storage_key(file_path))["Body"]
+
+    def _head(self, file_path, **kwargs):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=storage_key(file_path), **kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, file_path):
+        return self._head(file_path) is not None
+
+    def size(self, file_path):
+        return self._head(file_path)["ContentLength"]
+
+    def delete(self, file_path):
+        self.client.delete_object(Bucket=self.bucket, Key=storage_key(file_path))
+
+    def delete_tree(self, dir_path):
+        # Every object under the prefix, up to 1000 per request
+        prefix = storage_key(dir_path).rstrip("/") + "/"
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            keys = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys, "Quiet": True})
+
+    @contextlib.contextmanager
+    def local_copy(self, file_path):
+        # For tools that need a real file (PIL, ffmpeg): a temp download
+        # that's removed afterwards
+        suffix = os.path.splitext(file_path)[1]
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            self.client.download_fileobj(self.bucket, storage_key(file_path), f)
+        try:
+            yield f.name
+        finally:
+            os.remove(f.name)
+
+    def download_url(self, file_path):
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": storage_key(file_path)},
+            ExpiresIn=PRESIGN_EXPIRES_SECONDS
+        )
+
+    def presign_upload(self, upload_id, file_path, content_type, sha256):
+        # The checksum is part of the signature, so the store itself rejects
+        # a body that doesn't match the hash the client declared
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": storage_key(file_path),
+                "ContentType": content_type,
+                "ChecksumSHA256": checksum,
+            },
+            ExpiresIn=PRESIGN_EXPIRES_SECONDS
+        )
+        return {
+            "method": "PUT",
+            "url": url,
+            "headers": {"Content-Type": content_type, "x-amz-checksum-sha256": checksum},
+        }
+
+    def uploaded_checksum(self, file_path):
+        """SHA-256 (hex) the store recorded for the object, if it keeps one."""
+        head = self._head(file_path, ChecksumMode="ENABLED")
+        checksum = head and head.get("ChecksumSHA256")
+        # Multipart uploads report "<checksum of checksums>-<parts>"
+        if not checksum or "-" in checksum:
+            return None
+        return base64.b64decode(checksum).hex()
+
+
+def make_storage(backend=STORAGE_BACKEND):
+    if backend == "s3":
+        return S3Storage()
+    if backend == "local":
+        return LocalStorage()
+    raise RuntimeError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+storage = make_storage()
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app keeps its database at ./test.db and files under ./uploads, so the
+# suite runs in a scratch directory; this has to happen before anything opens
+# a connection.
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+os.chdir(WORK_DIR)
+os.makedirs("uploads", exist_ok=True)
+os.environ.setdefault("COMPUTE_WORKERS", "2")
+os.environ.setdefault("INTEGRITY_VERIFY_INTERVAL_HOURS", "0")
+os.environ.setdefault("ARCHIVE_INTERVAL_HOURS", "0")
+sys.path.insert(0, BACKEND_DIR)
+
+import models  # noqa: E402
+from database import engine  # noqa: E402
+from geo import ensure_location_indexes  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def tables():
+    models.Base.metadata.create_all(bind=engine)
+    ensure_location_indexes()
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    import main
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def db():
+    from database import SessionLocal
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
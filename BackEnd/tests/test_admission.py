@@ -0,0 +1,132 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from admission import AdmissionController, AdmissionMiddleware, MemoryBucketStore, SQLiteBucketStore, Rule
+
+
+def test_bucket_allows_a_burst_then_refills():
+    store = MemoryBucketStore()
+    assert [store.take("k", 1.0, 3, now=100.0) for _ in range(3)] == [0, 0, 0]
+    assert store.take("k", 1.0, 3, now=100.0) == pytest.approx(1.0)
+    assert store.take("k", 1.0, 3, now=100.5) == pytest.approx(0.5)
+    assert store.take("k", 1.0, 3, now=101.0) == 0
+
+
+def test_sqlite_buckets_are_shared_between_stores(tmp_path):
+    # Two workers opening the same file see one bucket
+    path = str(tmp_path / "buckets.db")
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take("k", 1.0, 2, now=100.0) == 0
+    assert second.take("k", 1.0, 2, now=100.0) == 0
+    assert first.take("k", 1.0, 2, now=100.0) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("make_store", [MemoryBucketStore, lambda: SQLiteBucketStore(":memory:")])
+def test_empty_bucket_spends_no_token_from_the_other(make_store):
+    store = make_store()
+    caller, route = ("r:alice", 1.0, 2), ("r:*", 1.0, 1)
+    assert store.take_all([caller, route], now=100.0) is None
+    # The route is empty: alice's second token must still be there after
+    assert store.take_all([caller, route], now=100.0) == (1, pytest.approx(1.0))
+    assert store.take_all([caller, ("other:*", 1.0, 1)], now=100.0) is None
+    assert store.take_all([caller, ("other:*", 1.0, 1)], now=100.0)[0] == 0
+
+
+def test_route_bucket_limits_all_callers_together():
+    rule = Rule("r", "POST", r"^/r$", per_caller=(1, 10), per_route=(0.001, 2))
+    controller = AdmissionController(rules=[rule], store=MemoryBucketStore())
+    assert controller.admit(rule, "alice")[0]
+    assert controller.admit(rule, "bob")[0]
+    admitted, retry_after, reason = controller.admit(rule, "carol")
+    assert (admitted, reason) == (False, "rate_limited_route")
+    assert retry_after >= 1
+    # Turned away by the route, carol still has her own burst
+    assert controller.store.take("r:carol", *rule.per_caller) == 0
+    assert controller.store.take("r:alice", *rule.per_caller) == 0
+
+
+def test_concurrency_cap_frees_up_on_release():
+    rule = Rule("r", "POST", r"^/r$", per_caller=(100, 100), per_route=(100, 100), concurrency=1)
+    controller = AdmissionController(rules=[rule], store=MemoryBucketStore())
+    assert controller.admit(rule, "alice")[0]
+    assert controller.admit(rule, "bob")[2] == "concurrency"
+    controller.release(rule)
+    assert controller.admit(rule, "bob")[0]
+    assert controller.snapshot()["routes"]["r"]["concurrency"] == 1
+
+
+def app_with(rule, handler, store=None):
+    controller = AdmissionController(rules=[rule], store=store or MemoryBucketStore())
+    app = Starlette(routes=[Route("/limited", handler, methods=["POST"]), Route("/open", handler, methods=["POST"])])
+    app.add_middleware(AdmissionMiddleware, controller=controller)
+    return TestClient(app), controller
+
+
+def from_address(client, address):
+    return TestClient(client.app, client=(address, 50000))
+
+
+async def ok(request):
+    return JSONResponse({"ok": True})
+
+
+@pytest.mark.parametrize("store", [None, "sqlite"])
+def test_middleware_answers_429_with_retry_after(tmp_path, store):
+    store = SQLiteBucketStore(str(tmp_path / "buckets.db")) if store else None
+    client, _ = app_with(Rule("limited", "POST", r"^/limited$", per_caller=(1 / 60, 2), per_route=(100, 100)), ok, store)
+    alice = from_address(client, "10.0.0.1")
+
+    assert [alice.post("/limited").status_code for _ in range(2)] == [200, 200]
+    rejected = alice.post("/limited")
+
+    assert rejected.status_code == 429
+    assert rejected.json()["reason"] == "rate_limited_caller"
+    assert 1 <= int(rejected.headers["Retry-After"]) <= 60
+    # Other callers and other routes are unaffected
+    assert from_address(client, "10.0.0.2").post("/limited").status_code == 200
+    assert alice.post("/open").status_code == 200
+
+
+def test_caller_cant_pick_a_fresh_identity_with_a_header():
+    client, _ = app_with(Rule("limited", "POST", r"^/limited$", per_caller=(1 / 60, 1), per_route=(100, 100)), ok)
+    assert client.post("/limited", headers={"X-User-Id": "a"}).status_code == 200
+    assert client.post("/limited", headers={"X-User-Id": "b"}).status_code == 429
+
+
+def test_rejected_request_never_reaches_the_handler():
+    calls = []
+
+    async def counting(request):
+        calls.append(await request.body())
+        return JSONResponse({"ok": True})
+
+    client, controller = app_with(Rule("limited", "POST", r"^/limited$", per_caller=(1 / 60, 1), per_route=(100, 100)), counting)
+    client.post("/limited", content=b"first")
+    assert client.post("/limited", content=b"second").status_code == 429
+    assert calls == [b"first"]
+    assert controller.snapshot()["routes"]["limited"]["in_flight"] == 0
+
+
+def test_slot_is_released_when_the_handler_fails():
+    async def failing(request):
+        raise RuntimeError("boom")
+
+    client, controller = app_with(Rule("limited", "POST", r"^/limited$", per_caller=(100, 100), per_route=(100, 100), concurrency=1), failing)
+    client = TestClient(client.app, raise_server_exceptions=False)
+    assert client.post("/limited").status_code == 500
+    assert controller.snapshot()["routes"]["limited"]["in_flight"] == 0
+
+
+def test_upload_bytes_cap(monkeypatch):
+    monkeypatch.setattr("admission.UPLOAD_MAX_BYTES_IN_FLIGHT", 100)
+    rule = Rule("upload", "PUT", r"^/u$", per_caller=(100, 100), per_route=(100, 100), upload=True)
+    controller = AdmissionController(rules=[rule], store=MemoryBucketStore())
+    # A single oversized upload still goes through when nothing else is running
+    assert controller.admit(rule, "alice", upload_bytes=150)[0]
+    assert controller.admit(rule, "bob", upload_bytes=10)[2] == "upload_bytes"
+    controller.release(rule, upload_bytes=150)
+    assert controller.admit(rule, "bob", upload_bytes=60)[0]
+    assert controller.admit(rule, "carol", upload_bytes=60)[2] == "upload_bytes"
@@ -0,0 +1,163 @@
+import time
+
+import pytest
+
+import analysis
+from analysis import complete_analysis, report_verdict, start_case_batch
+from database import SessionLocal
+from models import AnalysisBatch, Case, Evidence, Notification
+from write_queue import write_batcher
+
+
+def make_evidence(status="pending"):
+    def write(db):
+        case = Case(title="analysis", status=status)
+        db.add(case)
+        db.flush()
+        evidence = Evidence(case_id=case.id, file_path="/uploads/a.jpg", file_type="image", analysis_status="processing")
+        db.add(evidence)
+        db.flush()
+        return case.id, evidence.id
+
+    return write_batcher.run(write)
+
+
+@pytest.mark.parametrize("report, verdict", [
+    ("The lighting is consistent.\n\nVERDICT: REAL", True),
+    ("Edges are smeared around the hands.\nVERDICT: AI_GENERATED\n", False),
+    ("Looks fine.\n\n**Verdict: Real**", True),
+    ("verdict: ai-generated", False),
+])
+def test_reads_the_verdict_line(report, verdict):
+    assert report_verdict(report) is verdict
+
+
+@pytest.mark.parametrize("report", [
+    # Negated phrasing in prose must never be read as "AI-generated"
+    "Final Verdict: REAL. There is no indication that this image is fake.",
+    "The photo appears to be authentic; no signs of being AI-generated.",
+    "Real (no deepfake artifacts detected)",
+    "This image is REAL.\n\nThe verdict is supported by consistent shadows.",
+    # A verdict line that isn't the last line doesn't count either
+    "VERDICT: AI_GENERATED\n\nOn reflection the shadows are consistent.",
+    "",
+    None,
+])
+def test_anything_else_is_undecided(report):
+    assert report_verdict(report) is None
+
+
+def test_undecided_report_leaves_the_case_open(db):
+    case_id, evidence_id = make_evidence()
+    complete_analysis(evidence_id, "This image is REAL.\n\nThe verdict is supported by the metadata.")
+
+    evidence = db.query(Evidence).filter(Evidence.id == evidence_id).one()
+    assert (evidence.analysis_status, evidence.is_authentic) == ("completed", None)
+    assert db.query(Case.status).filter(Case.id == case_id).scalar() == "pending"
+
+
+def test_decided_report_resolves_the_case(db):
+    case_id, evidence_id = make_evidence()
+    complete_analysis(evidence_id, "No artifacts found.\nVERDICT: REAL")
+
+    assert db.query(Evidence.is_authentic).filter(Evidence.id == evidence_id).scalar() is True
+    assert db.query(Case.status).filter(Case.id == case_id).scalar() == "resolved"
+
+
+class FakeAnalyzer:
+    # Report per file name; an exception instance is raised instead
+    def __init__(self, reports):
+        self.reports = reports
+
+    def analyze(self, path, priority=None):
+        report = self.reports[path.rsplit("/", 1)[-1]]
+        if isinstance(report, Exception):
+            raise report
+        return report
+
+
+def make_case(files, analysis_status="not_started"):
+    def write(db):
+        case = Case(title="batch", status="pending")
+        db.add(case)
+        db.flush()
+        for name in files:
+            db.add(Evidence(case_id=case.id, file_path=f"/uploads/{name}", file_type="image", analysis_status=analysis_status))
+        return case.id
+
+    return write_batcher.run(write)
+
+
+def run_batch(monkeypatch, case_id, reports):
+    monkeypatch.setattr(analysis, "get_analyzer", lambda: FakeAnalyzer(reports))
+    batch_id, priority, items, _ = start_case_batch(case_id)
+    analysis.BatchScheduler(workers=1).submit(batch_id, priority, items)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        db = SessionLocal()
+        try:
+            batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id).one()
+            if batch.status != "running":
+                return batch
+        finally:
+            db.close()
+        time.sleep(0.05)
+    raise AssertionError("batch never finished")
+
+
+def statuses(db, case_id):
+    db.rollback()
+    case_status = db.query(Case.status).filter(Case.id == case_id).scalar()
+    items = db.query(Evidence.analysis_status).filter(Evidence.case_id == case_id).order_by(Evidence.id).all()
+    return case_status, [status for status, in items]
+
+
+def test_batch_with_every_verdict_resolves_the_case(db, monkeypatch):
+    case_id = make_case(["b1.jpg", "b2.jpg"])
+    batch = run_batch(monkeypatch, case_id, {"b1.jpg": "ok\nVERDICT: REAL", "b2.jpg": "ok\nVERDICT: AI_GENERATED"})
+
+    assert (batch.status, batch.completed, batch.failed, batch.verdict) == ("completed", 2, 0, "flagged")
+    assert statuses(db, case_id) == ("resolved", ["completed", "completed"])
+
+
+def test_partial_failure_leaves_the_case_open(db, monkeypatch):
+    case_id = make_case(["p1.jpg", "p2.jpg", "p3.jpg"])
+    batch = run_batch(monkeypatch, case_id, {"p1.jpg": "ok\nVERDICT: REAL", "p2.jpg": RuntimeError("model down"), "p3.jpg": ""})
+
+    assert (batch.status, batch.completed, batch.failed) == ("partial", 1, 2)
+    assert batch.verdict == "partially_analyzed"
+    assert statuses(db, case_id) == ("pending", ["completed", "failed", "failed"])
+    # The filer is still told how far it got
+    message = db.query(Notification.message).filter(Notification.case_id == case_id).scalar()
+    assert "partly completed" in message and "1 of 3" in message
+
+
+def test_undecided_report_keeps_the_batch_case_open(db, monkeypatch):
+    case_id = make_case(["u1.jpg"])
+    batch = run_batch(monkeypatch, case_id, {"u1.jpg": "The image is real."})
+
+    assert batch.status == "completed"
+    assert statuses(db, case_id) == ("pending", ["completed"])
+
+
+def test_every_item_failing_fails_the_batch(db, monkeypatch):
+    case_id = make_case(["f1.jpg"])
+    batch = run_batch(monkeypatch, case_id, {"f1.jpg": RuntimeError("model down")})
+
+    assert (batch.status, batch.failed) == ("failed", 1)
+    assert statuses(db, case_id) == ("pending", ["failed"])
+
+
+def test_error_waiting_on_another_workers_item_doesnt_fail_it(db, monkeypatch):
+    # Someone else holds the claim: this worker must not mark it failed
+    case_id = make_case(["w1.jpg"], analysis_status="processing")
+    _, _, items, _ = start_case_batch(case_id)
+
+    def wait(evidence_id, timeout=None):
+        raise RuntimeError("poll failed")
+
+    monkeypatch.setattr(analysis, "wait_for_analysis", wait)
+    assert not analysis.claim_analysis(items[0][0])
+    with pytest.raises(RuntimeError):
+        analysis.analyze_item(*items[0])
+    assert statuses(db, case_id) == ("pending", ["processing"])
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import analysis
+from analysis import AnalysisStreams
+from models import Case, Evidence
+from write_queue import write_batcher
+
+
+class FakeStreamer:
+    # Streams the given chunks; holds after the first until released
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.release = threading.Event()
+        self.calls = 0
+
+    def analyze_stream(self, path):
+        self.calls += 1
+        for i, chunk in enumerate(self.chunks):
+            if i == 1:
+                self.release.wait(10)
+            yield chunk
+        if self.error:
+            raise self.error
+
+
+@pytest.fixture
+def streamer(monkeypatch):
+    def install(chunks, error=None, release=True):
+        fake = FakeStreamer(chunks, error)
+        if release:
+            fake.release.set()
+        monkeypatch.setattr(analysis, "get_analyzer", lambda: fake)
+        return fake
+    return install
+
+
+def make_evidence(analysis_status="not_started", report=None):
+    def write(db):
+        case = Case(title="stream", status="pending")
+        db.add(case)
+        db.flush()
+        evidence = Evidence(case_id=case.id, file_path="/uploads/s.jpg", file_type="image",
+                            analysis_status=analysis_status, analysis_report=report)
+        db.add(evidence)
+        db.flush()
+        return evidence.id
+
+    return write_batcher.run(write)
+
+
+def events(body):
+    # (event, data) pairs from a text/event-stream body
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        parsed.append((fields["event"], json.loads(fields["data"])))
+    return parsed
+
+
+def collect(*runs):
+    async def read(run):
+        return [chunk async for chunk in run.follow()]
+
+    async def read_all():
+        return await asyncio.gather(*(read(run) for run in runs))
+
+    return asyncio.run(read_all())
+
+
+def test_stream_sends_chunks_then_done(client, db, streamer):
+    streamer(["Shadows line up.\n", "VERDICT: REAL"])
+    evidence_id = make_evidence()
+
+    response = client.get(f"/evidence/{evidence_id}/analyze/stream")
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert events(response.text) == [
+        ("chunk", {"text": "Shadows line up.\n"}),
+        ("chunk", {"text": "VERDICT: REAL"}),
+        ("done", {"analysis_status": "completed"}),
+    ]
+    db.rollback()
+    evidence = db.query(Evidence).filter(Evidence.id == evidence_id).one()
+    assert (evidence.analysis_status, evidence.analysis_report, evidence.is_authentic) == (
+        "completed", "Shadows line up.\nVERDICT: REAL", True)
+
+
+def test_completed_evidence_replays_the_stored_report(client, streamer):
+    fake = streamer(["never used"])
+    evidence_id = make_evidence("completed", "Stored report\nVERDICT: REAL")
+
+    response = client.get(f"/evidence/{evidence_id}/analyze/stream")
+
+    assert events(response.text) == [("chunk", {"text": "Stored report\nVERDICT: REAL"}), ("done", {"analysis_status": "completed"})]
+    assert fake.calls == 0
+
+
+def test_model_error_ends_with_an_error_event(client, db, streamer):
+    streamer(["Partial text"], error=RuntimeError("quota exceeded"))
+    evidence_id = make_evidence()
+
+    response = client.get(f"/evidence/{evidence_id}/analyze/stream")
+
+    assert events(response.text) == [("chunk", {"text": "Partial text"}), ("error", {"detail": "AI analysis failed"})]
+    db.rollback()
+    assert db.query(Evidence.analysis_status).filter(Evidence.id == evidence_id).scalar() == "failed"
+
+
+def test_unknown_evidence_is_404(client):
+    assert client.get("/evidence/999999999/analyze/stream").status_code == 404
+
+
+def test_viewers_share_one_run(streamer):
+    fake = streamer(["one ", "two ", "VERDICT: AI_GENERATED"], release=False)
+    evidence_id = make_evidence()
+    streams = AnalysisStreams()
+
+    first = streams.attach(evidence_id, "/uploads/s.jpg")
+    deadline = time.monotonic() + 10
+    while not first.chunks and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Joins mid-run: gets the chunk already sent, then the rest
+    second = streams.attach(evidence_id, "/uploads/s.jpg")
+    assert second is first
+
+    fake.release.set()
+    assert collect(first, second) == [["one ", "two ", "VERDICT: AI_GENERATED"]] * 2
+    assert fake.calls == 1
+
+
+def test_evidence_claimed_elsewhere_streams_that_result(db, streamer, monkeypatch):
+    # Another worker holds the claim: this stream waits for its report
+    fake = streamer(["never used"])
+    evidence_id = make_evidence("processing")
+    monkeypatch.setattr(analysis, "ANALYSIS_POLL_INTERVAL", 0.01)
+
+    run = AnalysisStreams().attach(evidence_id, "/uploads/s.jpg")
+    analysis.complete_analysis(evidence_id, "Done elsewhere\nVERDICT: REAL")
+
+    assert collect(run) == [["Done elsewhere\nVERDICT: REAL"]]
+    assert (run.error, fake.calls) == (None, 0)
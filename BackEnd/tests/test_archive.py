@@ -0,0 +1,125 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+import uuid
+import zipfile
+
+from sqlalchemy import select, update
+
+import archive
+from archive import run_archive
+from integrity import add_to_tree, verify_proof
+from media import media_dirs, unused_media_dirs
+from models import Case, CaseHashNode, Evidence, User, archived_case_hash_nodes
+from write_queue import write_batcher
+
+OLD = datetime.datetime.utcnow() - datetime.timedelta(days=400)
+
+
+def make_case(count=3, status="resolved", content_hash=None):
+    # An old, finished case whose files exist under uploads/
+    tag = uuid.uuid4().hex[:8]
+    files = {f"/uploads/archive-{tag}-{i}.jpg": f"{tag} evidence {i}".encode() for i in range(count)}
+    for path, data in files.items():
+        with open(path.lstrip("/"), "wb") as f:
+            f.write(data)
+
+    def write(db):
+        user = User(name=f"filer {tag}", email=f"archive-{tag}@example.com", role="user", status="approved")
+        db.add(user)
+        db.flush()
+        case = Case(title=f"archive {tag}", status=status, user_id=user.id)
+        db.add(case)
+        db.flush()
+        ids = []
+        for path, data in files.items():
+            evidence = Evidence(case_id=case.id, file_path=path, file_type="image",
+                                content_hash=content_hash or hashlib.sha256(data).hexdigest(),
+                                poster_path=f"/uploads/media/{content_hash}/poster.jpg" if content_hash else None)
+            db.add(evidence)
+            db.flush()
+            add_to_tree(db, evidence)
+            ids.append(evidence.id)
+        # Explicit values win over the onupdate timestamp
+        db.execute(update(Case.__table__).where(Case.id == case.id).values(created_at=OLD, updated_at=OLD))
+        return user.id, case.id, ids
+
+    return (*write_batcher.run(write), files)
+
+
+def test_archived_case_keeps_its_manifest_and_proofs(client, db):
+    _, case_id, ids, _ = make_case()
+    before = client.get(f"/cases/{case_id}/manifest").json()
+
+    run_archive(max_age_days=30)
+
+    db.rollback()
+    assert db.query(Case).filter(Case.id == case_id).first() is None
+    assert db.query(CaseHashNode).filter(CaseHashNode.case_id == case_id).count() == 0
+    assert db.execute(select(archived_case_hash_nodes).where(archived_case_hash_nodes.c.case_id == case_id)).all()
+
+    manifest = client.get(f"/cases/{case_id}/manifest")
+    assert manifest.status_code == 200
+    assert manifest.json() == before
+    for evidence_id in ids:
+        proof = client.get(f"/evidence/{evidence_id}/proof").json()
+        assert proof["root"] == before["root"]
+        assert verify_proof(proof["leaf_hash"], proof["path"], proof["root"])
+
+
+def test_archived_evidence_detail_and_zip(client):
+    _, case_id, ids, files = make_case(2)
+    run_archive(max_age_days=30)
+
+    detail = client.get(f"/evidence/{ids[0]}")
+    assert detail.status_code == 200
+    assert detail.json()["archived"] is True
+
+    bundle = zipfile.ZipFile(io.BytesIO(client.get(f"/cases/{case_id}/evidence.zip").content))
+    manifest = json.loads(bundle.read("manifest.json"))
+    assert [entry.get("missing") for entry in manifest["files"]] == [None, None]
+    assert sorted(bundle.read(entry["archive_name"]) for entry in manifest["files"]) == sorted(files.values())
+
+
+def test_zip_reads_files_moved_to_cold_storage(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_COLD_DIR", str(tmp_path / "cold"))
+    _, case_id, ids, files = make_case(2)
+    run_archive(max_age_days=30, cold_storage=True)
+    assert not any(os.path.exists(path.lstrip("/")) for path in files)
+
+    bundle = zipfile.ZipFile(io.BytesIO(client.get(f"/cases/{case_id}/evidence.zip").content))
+    manifest = json.loads(bundle.read("manifest.json"))
+    for entry in manifest["files"]:
+        data = bundle.read(entry["archive_name"])
+        assert data in files.values()
+        assert (entry["size"], entry["sha256"]) == (len(data), hashlib.sha256(data).hexdigest())
+        assert "cold_path" not in entry
+
+
+def test_user_stats_count_archived_cases(client):
+    user_id, _, _, _ = make_case(1)
+    before = client.get(f"/user/stats/{user_id}").json()
+    run_archive(max_age_days=30)
+
+    assert client.get(f"/user/stats/{user_id}").json() == before == {"total_cases": 1, "pending_cases": 0, "approved_cases": 1}
+
+
+def test_renditions_an_archived_row_uses_are_kept(db):
+    # Archived while a live case still used the renditions, so the archived
+    # row keeps its paths; deleting the live copy mustn't remove them
+    shared = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+    make_case(1, content_hash=shared)
+    _, _, live_ids, _ = make_case(1, status="pending", content_hash=shared)
+    run_archive(max_age_days=30)
+
+    def delete_live(w):
+        w.query(Evidence).filter(Evidence.id == live_ids[0]).delete()
+        return unused_media_dirs(w, [shared])
+
+    assert write_batcher.run(delete_live) == []
+
+    # Renditions nobody lists any more do go
+    gone = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+    assert write_batcher.run(lambda w: unused_media_dirs(w, [gone])) == media_dirs([gone])
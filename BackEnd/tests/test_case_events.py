@@ -0,0 +1,147 @@
+import datetime
+import uuid
+
+import pytest
+
+from case_events import backfill_events, backlog, daily_counts, rebuild_rollups, stage_times, transition
+from models import Case, CaseEvent, User
+from write_queue import write_batcher
+
+TODAY = datetime.datetime.utcnow().date()
+MIDNIGHT = datetime.datetime.combine(TODAY, datetime.time())
+ZERO = {"filed": 0, "reviewed": 0, "sent_to_court": 0, "resolved": 0}
+
+
+@pytest.fixture
+def stations():
+    # A police station and a court of their own, so their rollups start empty
+    def write(db):
+        tag = uuid.uuid4().hex[:8]
+        police = User(name=f"police {tag}", email=f"police-{tag}@example.com", role="police", status="approved")
+        court = User(name=f"court {tag}", email=f"court-{tag}@example.com", role="court", status="approved")
+        db.add_all([police, court])
+        db.flush()
+        return police.id, court.id
+
+    return write_batcher.run(write)
+
+
+def walk(police_id, court_id, steps):
+    # steps: (status, seconds after midnight); the court is assigned when the
+    # case is sent to it. Returns the case id.
+    def write(db):
+        case = Case(title="events", status="pending", police_id=police_id, created_at=MIDNIGHT)
+        db.add(case)
+        db.flush()
+        for status, seconds in steps:
+            if status == "sent_to_court":
+                case.court_id = court_id
+            transition(db, case, status, now=MIDNIGHT + datetime.timedelta(seconds=seconds))
+        return case.id
+
+    return write_batcher.run(write)
+
+
+def counts(db, scope, scope_id):
+    db.rollback()
+    return {day["day"]: {k: v for k, v in day.items() if k != "day"} for day in daily_counts(db, scope, scope_id, TODAY)}
+
+
+def test_each_move_is_counted_once_per_scope(db, stations):
+    police_id, court_id = stations
+    before = counts(db, "all", 0).get(TODAY, ZERO)
+
+    case_id = walk(police_id, court_id, [("pending", 0), ("under_review", 60), ("under_review", 90),
+                                         ("sent_to_court", 120), ("resolved", 180)])
+
+    # Re-entering the current status logs nothing
+    db.rollback()
+    assert db.query(CaseEvent.to_status).filter(CaseEvent.case_id == case_id).order_by(CaseEvent.id).all() == [
+        ("pending",), ("under_review",), ("sent_to_court",), ("resolved",)]
+    assert counts(db, "police", police_id) == {TODAY: {"filed": 1, "reviewed": 1, "sent_to_court": 1, "resolved": 1}}
+    # The court only sees the case from the moment it was assigned
+    assert counts(db, "court", court_id) == {TODAY: {"filed": 0, "reviewed": 0, "sent_to_court": 1, "resolved": 1}}
+    assert counts(db, "all", 0)[TODAY] == {k: v + 1 for k, v in before.items()}
+
+
+def test_stage_times_mean_and_p90(db, stations):
+    police_id, court_id = stations
+    waits = [100 * i for i in range(1, 11)]  # seconds spent pending
+    for wait in waits:
+        walk(police_id, court_id, [("pending", 0), ("under_review", wait)])
+
+    db.rollback()
+    times = stage_times(db, "police", police_id, TODAY)
+    assert times["pending"]["count"] == 10
+    assert times["pending"]["mean_seconds"] == pytest.approx(sum(waits) / 10)
+    # Read off a histogram bucket: within one bucket width (~19%) of exact
+    assert times["pending"]["p90_seconds"] == pytest.approx(900, rel=0.2)
+    assert times["under_review"] == {"count": 0, "mean_seconds": None, "p90_seconds": None}
+
+
+def test_backlog_counts_open_cases_per_stage(db, stations):
+    police_id, court_id = stations
+    walk(police_id, court_id, [("pending", 0)])
+    walk(police_id, court_id, [("pending", 0), ("under_review", 30)])
+    walk(police_id, court_id, [("pending", 0), ("under_review", 30), ("resolved", 60)])
+
+    db.rollback()
+    open_cases = backlog(db, "police", police_id)
+    assert {stage: row["open"] for stage, row in open_cases.items()} == {"pending": 1, "under_review": 1, "sent_to_court": 0}
+    assert open_cases["under_review"]["oldest_since"] == MIDNIGHT + datetime.timedelta(seconds=30)
+
+
+def test_rebuild_matches_the_incremental_rollups(db, stations):
+    police_id, court_id = stations
+    walk(police_id, court_id, [("pending", 0), ("under_review", 45), ("sent_to_court", 400)])
+    walk(police_id, court_id, [("pending", 0), ("resolved", 2000)])
+    before = counts(db, "police", police_id), counts(db, "court", court_id), stage_times(db, "police", police_id, TODAY)
+
+    rebuild_rollups()
+
+    after = counts(db, "police", police_id), counts(db, "court", court_id), stage_times(db, "police", police_id, TODAY)
+    assert after == before
+
+
+def test_backfill_logs_cases_from_before_the_event_log(db, stations):
+    police_id, _ = stations
+
+    def write(w):
+        case = Case(title="legacy", status="resolved", police_id=police_id, created_at=MIDNIGHT, updated_at=MIDNIGHT)
+        w.add(case)
+        w.flush()
+        return case.id
+
+    case_id = write_batcher.run(write)
+    backfill_events()
+    rebuild_rollups()
+
+    db.rollback()
+    assert db.query(CaseEvent.from_status, CaseEvent.to_status).filter(CaseEvent.case_id == case_id).order_by(CaseEvent.id).all() == [
+        (None, "pending"), ("pending", "resolved")]
+    assert counts(db, "police", police_id) == {TODAY: {"filed": 1, "reviewed": 0, "sent_to_court": 0, "resolved": 1}}
+    # No stage time is made up for it
+    assert stage_times(db, "police", police_id, TODAY)["pending"]["count"] == 0
+    # Running it again adds nothing
+    assert backfill_events() == 0
+
+
+def test_endpoint_serves_the_rollups_with_an_etag(client, stations):
+    police_id, court_id = stations
+    walk(police_id, court_id, [("pending", 0), ("under_review", 30)])
+    params = {"scope": "police", "scope_id": police_id, "days": 7}
+
+    first = client.get("/admin/analytics/cases", params=params)
+    assert first.status_code == 200
+    body = first.json()
+    assert body["daily"] == [{"day": TODAY.isoformat(), "filed": 1, "reviewed": 1, "sent_to_court": 0, "resolved": 0}]
+    assert body["backlog"]["under_review"]["open"] == 1
+    assert client.get("/admin/analytics/cases", params=params, headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    # A new event changes the tag
+    walk(police_id, court_id, [("pending", 0)])
+    assert client.get("/admin/analytics/cases", params=params, headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
+
+
+def test_endpoint_rejects_an_unknown_scope(client):
+    assert client.get("/admin/analytics/cases", params={"scope": "district"}).status_code == 400
@@ -0,0 +1,102 @@
+import math
+import uuid
+
+import pytest
+
+from geo import EARTH_RADIUS_KM, haversine_km, nearest, set_location
+from models import User
+from write_queue import write_batcher
+
+
+def destination(lat, lon, bearing, km):
+    # Point km away along a great circle, on the sphere haversine_km uses
+    lat1, lon1, theta, delta = math.radians(lat), math.radians(lon), math.radians(bearing), km / EARTH_RADIUS_KM
+    lat2 = math.asin(math.sin(lat1) * math.cos(delta) + math.cos(lat1) * math.sin(delta) * math.cos(theta))
+    lon2 = lon1 + math.atan2(math.sin(theta) * math.sin(delta) * math.cos(lat1), math.cos(delta) - math.sin(lat1) * math.sin(lat2))
+    return math.degrees(lat2), math.degrees(lon2)
+
+
+def add_stations(origin, placements, role="police", status="approved"):
+    # placements: (bearing, km); returns the new user ids in the same order
+    def write(db):
+        ids = []
+        for bearing, km in placements:
+            lat, lon = destination(*origin, bearing, km)
+            user = User(name=f"station {km}", email=f"geo-{uuid.uuid4().hex[:8]}@example.com", role=role,
+                        status=status, latitude=lat, longitude=lon)
+            db.add(user)
+            db.flush()
+            set_location(db, user)
+            ids.append(user.id)
+        return ids
+
+    return write_batcher.run(write)
+
+
+# Each test gets its own patch of ocean, thousands of km from the others
+ORIGINS = iter([(-45.0, -160.0), (-45.0, -130.0), (-45.0, -100.0), (-45.0, -70.0), (60.0, -30.0), (10.0, -150.0)])
+
+
+@pytest.fixture
+def origin():
+    return next(ORIGINS)
+
+
+def test_nearest_k_in_distance_order(db, origin):
+    ids = add_stations(origin, [(300, 90), (10, 5), (200, 40), (120, 12), (45, 300)])
+
+    found = nearest(db, "police", *origin, 4)
+
+    assert [row["id"] for row in found] == [ids[1], ids[3], ids[2], ids[0]]
+    assert [round(row["distance_km"]) for row in found] == [5, 12, 40, 90]
+    distances = [row["distance_km"] for row in found]
+    assert distances == sorted(distances)
+
+
+def test_matches_a_brute_force_scan(db, origin):
+    placements = [(bearing, km) for bearing, km in zip(range(0, 360, 23), [3, 70, 18, 250, 41, 9, 130, 33, 500, 27, 61, 15, 88, 210, 6, 47])]
+    ids = add_stations(origin, placements)
+    expected = sorted(zip(ids, placements), key=lambda item: item[1][1])
+
+    for k in (1, 3, 7, 12):
+        found = nearest(db, "police", *origin, k)
+        assert [row["id"] for row in found] == [station_id for station_id, _ in expected[:k]]
+        for row in found:
+            assert row["distance_km"] == pytest.approx(haversine_km(*origin, row["latitude"], row["longitude"]))
+
+
+def test_closest_station_just_inside_the_first_radius_is_found(db, origin):
+    # Due north at 24.99 km needs a search box at least 24.99 km tall; a
+    # second station at 45 degrees, farther away, sits well inside the box
+    north, diagonal = add_stations(origin, [(0, 24.99), (45, 24.995)])
+
+    assert [row["id"] for row in nearest(db, "police", *origin, 1)] == [north]
+
+
+def test_only_approved_stations_of_the_kind(db, origin):
+    pending = add_stations(origin, [(90, 1)], status="pending")[0]
+    court = add_stations(origin, [(90, 2)], role="court")[0]
+    approved = add_stations(origin, [(90, 20)])[0]
+
+    assert [row["id"] for row in nearest(db, "police", *origin, 1)] == [approved]
+    assert [row["id"] for row in nearest(db, "court", *origin, 1)] == [court]
+    assert pending not in [row["id"] for row in nearest(db, "police", *origin, 2)]
+
+
+def test_moving_a_station_updates_the_index(db, origin):
+    near, far = add_stations(origin, [(0, 10), (180, 30)])
+
+    def move(w):
+        user = w.query(User).filter(User.id == near).one()
+        user.latitude, user.longitude = destination(*origin, 0, 200)
+        set_location(w, user)
+
+    write_batcher.run(move)
+    assert [row["id"] for row in nearest(db, "police", *origin, 2)] == [far, near]
+
+
+def test_endpoint_returns_the_same_order(client, origin):
+    ids = add_stations(origin, [(270, 60), (90, 15), (0, 35)])
+    response = client.get("/police-stations/nearest", params={"lat": origin[0], "lon": origin[1], "k": 3})
+    assert response.status_code == 200
+    assert [row["id"] for row in response.json()] == [ids[1], ids[2], ids[0]]
@@ -0,0 +1,205 @@
+import asyncio
+import datetime
+import json
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import idempotency
+from idempotency import BodyDigest, IdempotencyMiddleware, complete_key, load_key
+from models import IdempotencyKey
+from write_queue import write_batcher
+
+
+@pytest.fixture
+def app():
+    # Stands in for POST /user/file-case: answers with the status asked for
+    # in the body and counts how often it really ran
+    calls = []
+
+    async def file_case(request):
+        body = await request.body()
+        calls.append(body)
+        if request.headers.get("content-type", "").startswith("multipart/"):
+            return JSONResponse({"run": len(calls)}, status_code=201)
+        payload = json.loads(body)
+        if payload.get("sleep"):
+            await asyncio.sleep(payload["sleep"])
+            # Still running well past one lease: the claim must have been renewed
+            assert not load_key(payload["key"])["abandoned"]
+        return JSONResponse({"run": len(calls)}, status_code=payload.get("status", 201))
+
+    app = Starlette(routes=[Route("/user/file-case", file_case, methods=["POST"])])
+    app.add_middleware(IdempotencyMiddleware)
+    client = TestClient(app)
+    client.calls = calls
+    return client
+
+
+def key():
+    return uuid.uuid4().hex
+
+
+def post(client, idempotency_key, payload=None, caller=None):
+    # caller: another client address than the default test client's
+    if caller:
+        client = TestClient(client.app, client=(caller, 50000))
+    return client.post("/user/file-case", json=payload or {}, headers={"Idempotency-Key": idempotency_key})
+
+
+def test_retry_replays_the_stored_response(app):
+    k = key()
+    first = post(app, k, {"title": "a"})
+    second = post(app, k, {"title": "a"})
+
+    assert first.status_code == second.status_code == 201
+    assert second.json() == first.json() == {"run": 1}
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert len(app.calls) == 1
+
+
+def test_requests_without_a_key_always_run(app):
+    app.post("/user/file-case", json={})
+    app.post("/user/file-case", json={})
+    assert len(app.calls) == 2
+
+
+def test_same_key_with_a_different_body_is_refused(app):
+    k = key()
+    post(app, k, {"title": "a"})
+    reused = post(app, k, {"title": "b"})
+
+    assert reused.status_code == 422
+    assert len(app.calls) == 1
+
+
+def test_keys_are_scoped_to_the_caller(app):
+    k = key()
+    post(app, k, caller="10.0.0.1")
+    other = post(app, k, caller="10.0.0.2")
+
+    assert other.json() == {"run": 2}
+    assert "Idempotent-Replayed" not in other.headers
+
+
+@pytest.mark.parametrize("status", [408, 409, 429, 500, 503])
+def test_retryable_responses_are_not_stored(app, status):
+    k = key()
+    assert post(app, k, {"status": status}).status_code == status
+    retry = post(app, k, {"status": status})
+
+    assert retry.status_code == status
+    assert "Idempotent-Replayed" not in retry.headers
+    assert len(app.calls) == 2
+
+
+@pytest.mark.parametrize("status", [200, 400, 404])
+def test_final_outcomes_are_stored(app, status):
+    k = key()
+    post(app, k, {"status": status})
+    retry = post(app, k, {"status": status})
+
+    assert retry.status_code == status
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert len(app.calls) == 1
+
+
+def test_multipart_retry_with_a_new_boundary_is_a_duplicate(app):
+    k = key()
+    headers = {"Idempotency-Key": k}
+    files = {"file": ("photo.jpg", b"\xff\xd8" + b"x" * 200_000, "image/jpeg")}
+    first = app.post("/user/file-case", data={"title": "t"}, files=files, headers=headers)
+    second = app.post("/user/file-case", data={"title": "t"}, files=files, headers=headers)
+
+    assert first.request.headers["content-type"] != second.request.headers["content-type"]
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert len(app.calls) == 1
+
+
+def test_handler_gets_the_whole_spooled_body(app):
+    # Bigger than the in-memory spool and several replay chunks
+    payload = {"blob": "y" * (3 * 1024 * 1024)}
+    post(app, key(), payload)
+    assert json.loads(app.calls[0]) == payload
+
+
+def test_body_digest_ignores_the_boundary_across_chunk_splits():
+    def digest(body, boundary, size):
+        d = BodyDigest(boundary)
+        for i in range(0, len(body), size):
+            d.update(body[i:i + size])
+        return d.hexdigest()
+
+    body = b"--%s\r\nContent-Disposition: form-data; name=\"title\"\r\n\r\nt\r\n--%s--\r\n"
+    one, two = body % (b"aaaa1111", b"aaaa1111"), body % (b"bbbb2222", b"bbbb2222")
+    assert {digest(one, "aaaa1111", n) for n in (1, 3, 7, 1000)} == {digest(two, "bbbb2222", 5)}
+    assert digest(one, "aaaa1111", 4) != digest(one.replace(b"\r\nt\r\n", b"\r\nu\r\n"), "aaaa1111", 4)
+
+
+def stale_claim(k, lease_seconds, body=b"{}"):
+    # An in_progress row as a worker leaves it, for a JSON body (post()
+    # with no payload sends "{}"); lease_seconds < 0: it stopped renewing
+    # that long ago
+    digest = BodyDigest()
+    digest.update(body)
+    scope = {"method": "POST", "path": "/user/file-case", "query_string": b""}
+    fingerprint = idempotency.request_fingerprint(scope, {"content-type": "application/json"}, digest.hexdigest())
+    now = datetime.datetime.utcnow()
+
+    def write(db):
+        db.add(IdempotencyKey(key=f"file_case:testclient:{k}", fingerprint=fingerprint, status="in_progress", owner="crashed",
+                              lease_expires_at=now + datetime.timedelta(seconds=lease_seconds),
+                              expires_at=now + datetime.timedelta(hours=24)))
+
+    write_batcher.run(write)
+
+
+def test_retry_takes_over_a_claim_whose_lease_expired(app):
+    k = key()
+    stale_claim(k, -5)
+
+    retry = post(app, k)
+    assert retry.status_code == 201
+    assert "Idempotent-Replayed" not in retry.headers
+    assert post(app, k).headers["Idempotent-Replayed"] == "true"
+    assert len(app.calls) == 1
+
+
+def test_live_claim_is_not_taken_over(app, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_TIMEOUT", 0.3)
+    k = key()
+    stale_claim(k, 60)
+
+    assert post(app, k).status_code == 409
+    assert app.calls == []
+
+
+def test_waiting_duplicate_gives_up_once_the_lease_lapses(app):
+    k = key()
+    stale_claim(k, 0.3)
+
+    # Waits for the original until its lease runs out, not the full timeout
+    assert post(app, k).status_code == 409
+    # ... and the retry runs it
+    assert post(app, k).json() == {"run": 1}
+
+
+def test_original_that_lost_its_key_leaves_the_new_owner_alone(app):
+    k = key()
+    stale_claim(k, -5)
+    post(app, k)
+
+    # The first worker wasn't dead after all and finishes late
+    complete_key(f"file_case:testclient:{k}", "crashed", 500, "application/json", b"{}").result()
+    assert post(app, k).headers["Idempotent-Replayed"] == "true"
+
+
+def test_running_original_keeps_renewing_its_lease(app, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_LEASE_SECONDS", 0.3)
+    k = key()
+    assert post(app, k, {"sleep": 1, "key": f"file_case:testclient:{k}"}).status_code == 201
@@ -0,0 +1,97 @@
+import hashlib
+
+import pytest
+
+from integrity import add_to_tree, leaf_hash, node_hash, verify_proof
+from models import Case, Evidence
+from write_queue import write_batcher
+
+
+def make_case(count):
+    def write(db):
+        case = Case(title="integrity")
+        db.add(case)
+        db.flush()
+        ids = []
+        for i in range(count):
+            evidence = Evidence(case_id=case.id, file_path=f"/uploads/missing-{case.id}-{i}.jpg", file_type="image",
+                                content_hash=hashlib.sha256(f"{case.id}:{i}".encode()).hexdigest())
+            db.add(evidence)
+            db.flush()
+            add_to_tree(db, evidence)
+            ids.append(evidence.id)
+        return case.id, ids
+
+    return write_batcher.run(write)
+
+
+def root_of(leaves):
+    # Reference build from the manifest alone: pair up, carry an odd node up as is
+    level = leaves
+    while len(level) > 1:
+        level = [node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i] for i in range(0, len(level), 2)]
+    return level[0] if level else None
+
+
+def check_against_manifest(client, case_id):
+    manifest = client.get(f"/cases/{case_id}/manifest").json()
+    entries = sorted(manifest["evidence"], key=lambda e: e["position"])
+    assert [e["position"] for e in entries] == list(range(manifest["tree_size"]))
+    assert manifest["root"] == root_of([leaf_hash(e["id"], e["sha256"]) for e in entries])
+
+    for entry in entries:
+        proof = client.get(f"/evidence/{entry['id']}/proof").json()
+        assert proof["root"] == manifest["root"]
+        assert proof["leaf_hash"] == leaf_hash(entry["id"], entry["sha256"])
+        assert verify_proof(proof["leaf_hash"], proof["path"], manifest["root"])
+    return manifest
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8])
+def test_every_proof_verifies_against_the_manifest_root(client, count):
+    case_id, _ = make_case(count)
+    manifest = check_against_manifest(client, case_id)
+    assert manifest["tree_size"] == count
+
+
+def test_proof_fails_for_a_different_file(client):
+    case_id, ids = make_case(4)
+    proof = client.get(f"/evidence/{ids[2]}/proof").json()
+    forged = leaf_hash(ids[2], hashlib.sha256(b"swapped file").hexdigest())
+    assert not verify_proof(forged, proof["path"], proof["root"])
+    # Or the right file claimed at another item's id
+    assert not verify_proof(leaf_hash(ids[1], proof["sha256"]), proof["path"], proof["root"])
+
+
+@pytest.mark.parametrize("remove", [0, 2, 4])
+def test_proofs_still_verify_after_a_delete(client, remove):
+    case_id, ids = make_case(5)
+    before = client.get(f"/cases/{case_id}/manifest").json()["root"]
+
+    assert client.delete(f"/evidence/{ids[remove]}").status_code == 200
+
+    manifest = check_against_manifest(client, case_id)
+    assert manifest["tree_size"] == 4
+    assert manifest["root"] != before
+    assert ids[remove] not in [e["id"] for e in manifest["evidence"]]
+
+
+def test_removing_every_item_empties_the_tree(client):
+    case_id, ids = make_case(3)
+    for evidence_id in ids:
+        client.delete(f"/evidence/{evidence_id}")
+    manifest = client.get(f"/cases/{case_id}/manifest").json()
+    assert (manifest["tree_size"], manifest["root"]) == (0, None)
+
+
+def test_item_without_a_hash_has_no_proof(client):
+    def write(db):
+        case = Case(title="unhashed")
+        db.add(case)
+        db.flush()
+        evidence = Evidence(case_id=case.id, file_path="/uploads/legacy.jpg", file_type="image")
+        db.add(evidence)
+        db.flush()
+        return evidence.id
+
+    assert client.get(f"/evidence/{write_batcher.run(write)}/proof").status_code == 409
@@ -0,0 +1,136 @@
+import datetime
+import hashlib
+import os
+import time
+import uuid
+
+import pytest
+from PIL import Image
+from sqlalchemy import or_
+
+import media
+from compute import compute_engine
+from media import MediaPipeline, claim_next_media, render_media, store_renditions
+from models import Case, Evidence
+from write_queue import write_batcher
+
+
+@pytest.fixture(autouse=True)
+def idle_queue():
+    # Rows other tests left unrendered would be claimed first
+    def write(db):
+        db.query(Evidence).filter(or_(Evidence.media_status == None, Evidence.media_status.in_(["pending", "processing"]))).update(
+            {"media_status": "ready"}, synchronize_session=False)
+
+    write_batcher.run(write)
+
+
+def add_evidence(*rows):
+    # rows: (file_type, media_status[, file_path]); returns ids in the same order
+    def write(db):
+        case = Case(title="media", status="pending")
+        db.add(case)
+        db.flush()
+        ids = []
+        for file_type, media_status, *path in rows:
+            evidence = Evidence(case_id=case.id, file_path=path[0] if path else f"/uploads/{uuid.uuid4().hex}.jpg",
+                                file_type=file_type, media_status=media_status)
+            db.add(evidence)
+            db.flush()
+            ids.append(evidence.id)
+        return ids
+
+    return write_batcher.run(write)
+
+
+def make_image(size=(1600, 900)):
+    path = f"/uploads/media-{uuid.uuid4().hex[:8]}.jpg"
+    Image.new("RGB", size, (200, 40, 40)).save(path.lstrip("/"), "JPEG")
+    return path
+
+
+def media_status(db, evidence_id):
+    db.rollback()
+    return db.query(Evidence.media_status).filter(Evidence.id == evidence_id).scalar()
+
+
+def test_claims_unrendered_rows_in_id_order(db):
+    # NULL is how rows filed before the pipeline existed look: they're backfilled
+    legacy, pending, done, failed, document = add_evidence(
+        ("image", None), ("image", "pending"), ("image", "ready"), ("image", "failed"), ("document", None))
+
+    assert claim_next_media(["image"])[0] == legacy
+    assert claim_next_media(["image"])[0] == pending
+    assert claim_next_media(["image"]) is None
+    assert [media_status(db, i) for i in (legacy, pending, done, failed, document)] == [
+        "processing", "processing", "ready", "failed", None]
+
+
+def test_only_claims_the_enabled_file_types():
+    video, image = add_evidence(("video", None), ("image", None))
+
+    # Without ffmpeg the pipeline only asks for images
+    assert claim_next_media(["image"])[0] == image
+    assert claim_next_media(["image"]) is None
+    assert claim_next_media(["image", "video"])[0] == video
+
+
+def test_stale_claim_is_taken_over(monkeypatch):
+    # A worker that died mid-render leaves the row "processing"
+    evidence_id, = add_evidence(("image", "processing"))
+    assert claim_next_media(["image"]) is None
+
+    def age(db):
+        old = datetime.datetime.utcnow() - datetime.timedelta(seconds=media.MEDIA_STALE_SECONDS + 60)
+        db.query(Evidence).filter(Evidence.id == evidence_id).update({"updated_at": old}, synchronize_session=False)
+
+    write_batcher.run(age)
+    assert claim_next_media(["image"])[0] == evidence_id
+
+
+def test_stored_renditions_keep_the_upload_hash(db):
+    evidence_id, = add_evidence(("image", "processing"))
+    write_batcher.run(lambda w: w.query(Evidence).filter(Evidence.id == evidence_id).update({"content_hash": "upload-time"}))
+
+    store_renditions(evidence_id, {"content_hash": "rendered", "proxy_path": None,
+                                   "poster_path": os.path.join(media.MEDIA_DIR, "rendered", "poster.jpg"),
+                                   "sprite_path": None, "sprite_interval": None}).result()
+
+    db.rollback()
+    evidence = db.query(Evidence).filter(Evidence.id == evidence_id).one()
+    assert (evidence.media_status, evidence.content_hash) == ("ready", "upload-time")
+    assert evidence.poster_path == "/uploads/media/rendered/poster.jpg"
+
+
+def test_image_preview_is_rendered_once_per_content():
+    path = make_image()
+    with open(path.lstrip("/"), "rb") as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+
+    result = render_media(path, "image")
+    assert result["content_hash"] == content_hash
+    with Image.open(result["poster_path"]) as poster:
+        assert max(poster.size) == media.IMAGE_PREVIEW_MAX_SIDE
+    modified = os.path.getmtime(result["poster_path"])
+
+    # Same bytes filed again: the existing preview is reused
+    assert render_media(path, "image", content_hash) == result
+    assert os.path.getmtime(result["poster_path"]) == modified
+
+
+def test_pipeline_renders_and_fails_rows(db):
+    good, bad = add_evidence(("image", None, make_image()), ("image", None, "/uploads/missing.jpg"))
+    pipeline = MediaPipeline(max_queued=2)
+    pipeline.start()
+    try:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and {media_status(db, good), media_status(db, bad)} & {None, "processing"}:
+            time.sleep(0.05)
+    finally:
+        pipeline.stop()
+        compute_engine.shutdown()
+
+    assert (media_status(db, good), media_status(db, bad)) == ("ready", "failed")
+    poster = db.query(Evidence.poster_path).filter(Evidence.id == good).scalar()
+    assert os.path.exists(poster.lstrip("/"))
+    assert pipeline.stats == {"rendered": 1, "failed": 1}
@@ -0,0 +1,131 @@
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from models import Notification, User
+from notifications import advance_cursor, deliver_new, fan_out, insert_chunk, dedup_key
+from write_queue import write_batcher
+
+
+@pytest.fixture
+def audience(db):
+    prefix = f"fan{uuid.uuid4().hex[:8]}"
+    users = [User(name=f"{prefix} {i}", email=f"{prefix}-{i}@example.com", role="user", status="approved") for i in range(5)]
+    db.add_all(users)
+    db.commit()
+    user_ids = [user.id for user in users]
+    db.rollback()  # don't keep a read snapshot open while the writer thread works
+    return select(User.id.label("user_id")).where(User.email.like(f"{prefix}-%")), user_ids
+
+
+def inbox(db, user_id):
+    # Fresh snapshot: fan-out commits from the writer thread
+    db.rollback()
+    return db.query(Notification).filter(Notification.user_id == user_id).order_by(Notification.id).all()
+
+
+def test_reaches_every_user_once_across_chunks(db, audience):
+    query, user_ids = audience
+    assert fan_out(query, "Station closed", "alert", chunk_size=2) == 5
+    assert [len(inbox(db, user_id)) for user_id in user_ids] == [1] * 5
+
+
+def test_chunks_walk_the_audience_in_id_order(audience):
+    query, user_ids = audience
+    inserted, after = insert_chunk(query, 0, "m", "alert", None, dedup_key("alert", None, "m"), chunk_size=2)
+    assert (inserted, after) == (2, user_ids[1])
+    inserted, after = insert_chunk(query, after, "m", "alert", None, dedup_key("alert", None, "m"), chunk_size=2)
+    assert (inserted, after) == (2, user_ids[3])
+    inserted, after = insert_chunk(query, after, "m", "alert", None, dedup_key("alert", None, "m"), chunk_size=2)
+    assert (inserted, after) == (1, None)
+
+
+def test_repeat_broadcast_skips_users_with_it_unread(db, audience):
+    query, user_ids = audience
+    fan_out(query, "Road closed", "alert")
+    assert fan_out(query, "Road closed", "alert") == 0
+
+    first_id = inbox(db, user_ids[0])[0].id
+    db.rollback()
+    write_batcher.run(lambda w: w.query(Notification).filter(Notification.id == first_id).update({"is_read": True}))
+    # Only the user who already read it gets it again
+    assert fan_out(query, "Road closed", "alert") == 1
+    assert len(inbox(db, user_ids[0])) == 2
+    # A different message isn't deduplicated against it
+    assert fan_out(query, "Road reopened", "alert") == 5
+
+
+def test_cursor_delivers_each_notification_once_in_order(audience):
+    query, user_ids = audience
+    user_id = user_ids[0]
+    for i in range(5):
+        fan_out(query, f"update {i}", "alert")
+
+    first = deliver_new(user_id, limit=3)
+    assert [n["message"] for n in first["notifications"]] == ["update 0", "update 1", "update 2"]
+    assert first["more"]
+    rest = deliver_new(user_id, after=first["cursor"], limit=3)
+    assert [n["message"] for n in rest["notifications"]] == ["update 3", "update 4"]
+    assert not rest["more"]
+    assert advance_cursor(user_id, rest["cursor"]) == rest["cursor"]
+    idle = deliver_new(user_id, limit=3)
+    assert idle["notifications"] == [] and idle["cursor"] == rest["cursor"]
+
+    fan_out(query, "update 5", "alert")
+    assert [n["message"] for n in deliver_new(user_id)["notifications"]] == ["update 5"]
+
+
+def test_polling_alone_doesnt_move_the_cursor(audience):
+    # A response lost on the way to the client is delivered again
+    query, user_ids = audience
+    fan_out(query, "lost in transit", "alert")
+    assert [n["message"] for n in deliver_new(user_ids[0])["notifications"]] == ["lost in transit"]
+    assert [n["message"] for n in deliver_new(user_ids[0])["notifications"]] == ["lost in transit"]
+
+
+def test_ack_past_the_newest_notification_hides_nothing_later(audience):
+    query, user_ids = audience
+    user_id = user_ids[0]
+    fan_out(query, "seen", "alert")
+    seen = deliver_new(user_id)["cursor"]
+
+    assert advance_cursor(user_id, seen + 10_000) == seen
+    fan_out(query, "next", "alert")
+    assert [n["message"] for n in deliver_new(user_id)["notifications"]] == ["next"]
+
+
+def test_ack_endpoint_never_moves_backwards(client, audience):
+    query, user_ids = audience
+    user_id = user_ids[0]
+    fan_out(query, "one", "alert")
+    fan_out(query, "two", "alert")
+    feed = client.get(f"/user/notifications/{user_id}/new").json()
+    first, second = [n["id"] for n in feed["notifications"]]
+
+    assert client.post(f"/user/notifications/{user_id}/ack", json={"cursor": second}).json() == {"cursor": second}
+    assert client.post(f"/user/notifications/{user_id}/ack", json={"cursor": first}).json() == {"cursor": second}
+    assert client.get(f"/user/notifications/{user_id}/new").json()["notifications"] == []
+    assert [n["id"] for n in client.get(f"/user/notifications/{user_id}/new", params={"after": 0}).json()["notifications"]] == [first, second]
+
+
+def test_same_text_from_different_sources_isnt_collapsed(audience):
+    query, _ = audience
+    assert fan_out(query, "Station posted an update: Road closed", "news", source_id=1) == 5
+    assert fan_out(query, "Station posted an update: Road closed", "news", source_id=2) == 5
+    # The same post broadcast twice still is
+    assert fan_out(query, "Station posted an update: Road closed", "news", source_id=2) == 0
+
+
+def test_new_notification_lands_past_the_cursor_after_deletes(audience):
+    # Ids are never reused, so deleting the newest rows can't hide the next one
+    query, user_ids = audience
+    user_id = user_ids[0]
+    fan_out(query, "one", "alert")
+    fan_out(query, "two", "alert")
+    cursor = advance_cursor(user_id, deliver_new(user_id)["cursor"])
+
+    write_batcher.run(lambda w: w.query(Notification).filter(Notification.id >= cursor).delete())
+    fan_out(select(User.id.label("user_id")).where(User.id == user_id), "three", "alert")
+
+    assert [n["message"] for n in deliver_new(user_id)["notifications"]] == ["three"]
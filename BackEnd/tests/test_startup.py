@@ -0,0 +1,39 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from compute import compute_engine
+from media import media_pipeline
+
+
+def test_importing_main_starts_nothing(client):
+    # The session client never ran the lifespan, so no pool was spawned for it
+    assert media_pipeline._thread is None
+
+
+def test_lifespan_starts_and_stops_the_pools(client):
+    with TestClient(client.app):
+        assert compute_engine._thread.is_alive()
+        workers = [p.pid for p in compute_engine._pool._processes.values()]
+        assert len(workers) == compute_engine.workers
+        assert media_pipeline._thread.is_alive()
+        dispatcher = media_pipeline._thread
+
+    assert compute_engine._thread is None and compute_engine._pool is None
+    assert not dispatcher.is_alive()
+    for pid in workers:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+
+
+def test_queued_work_is_cancelled_on_shutdown():
+    compute_engine.start()
+    try:
+        futures = [compute_engine.submit(os.getpid) for _ in range(50)]
+    finally:
+        compute_engine.shutdown()
+    assert all(f.done() for f in futures)
+    # Work submitted after shutdown starts a fresh pool
+    assert compute_engine.run(os.getpid) != os.getpid()
+    compute_engine.shutdown()
@@ -0,0 +1,138 @@
+import base64
+import hashlib
+import uuid
+from urllib.parse import unquote
+
+import pytest
+
+import uploads
+from models import PendingUpload
+from storage import S3Storage, storage
+from uploads import UploadError, complete_upload, create_direct_case
+from write_queue import write_batcher
+
+
+def file_case(data, filename="photo.jpg"):
+    case_id, slots = create_direct_case(None, None, "direct", "", "2026-01-01", [
+        {"filename": filename, "content_type": "image/jpeg", "size": len(data), "sha256": hashlib.sha256(data).hexdigest()},
+    ])
+    return case_id, slots[0]
+
+
+def pending_upload(upload_id):
+    return write_batcher.run(lambda w: w.query(PendingUpload.status, PendingUpload.file_path).filter(PendingUpload.id == upload_id).first())
+
+
+def test_upload_then_complete(client):
+    data = b"\xff\xd8" + uuid.uuid4().bytes
+    case_id, slot = file_case(data)
+    assert client.put(slot["url"], content=data, headers=slot["headers"]).status_code == 200
+
+    first = client.post(f"/storage/uploads/{slot['upload_id']}/complete")
+    assert first.status_code == 200
+    # The client and a storage event may both complete it
+    assert client.post(f"/storage/uploads/{slot['upload_id']}/complete").json() == first.json()
+    manifest = client.get(f"/cases/{case_id}/manifest").json()
+    assert [e["id"] for e in manifest["evidence"]] == [first.json()["evidence_id"]]
+
+
+def test_unknown_upload_is_404(client):
+    assert client.post(f"/storage/uploads/{uuid.uuid4().hex}/complete").status_code == 404
+
+
+def test_completing_before_the_upload_is_409(client):
+    _, slot = file_case(b"not sent yet")
+    response = client.post(f"/storage/uploads/{slot['upload_id']}/complete")
+    assert response.status_code == 409
+    assert pending_upload(slot["upload_id"]).status == "pending"
+
+
+def test_wrong_size_is_refused_and_removed(client):
+    _, slot = file_case(b"declared body")
+    _, file_path = pending_upload(slot["upload_id"])
+    # A store that didn't check the body itself
+    with open(storage.path(file_path), "wb") as f:
+        f.write(b"something else entirely")
+
+    response = client.post(f"/storage/uploads/{slot['upload_id']}/complete")
+    assert response.status_code == 400
+    assert not storage.exists(file_path)
+    assert pending_upload(slot["upload_id"]).status == "failed"
+
+
+def test_case_deleted_while_completing_is_410(client, monkeypatch):
+    data = uuid.uuid4().bytes
+    case_id, slot = file_case(data)
+    client.put(slot["url"], content=data, headers=slot["headers"])
+    upload = uploads.load_upload(slot["upload_id"])
+
+    # The slot goes with the case (ON DELETE CASCADE) after it was looked up
+    assert client.delete(f"/user/cases/{case_id}").status_code == 200
+    monkeypatch.setattr(uploads, "load_upload", lambda upload_id: upload)
+
+    assert client.post(f"/storage/uploads/{slot['upload_id']}/complete").status_code == 410
+
+
+# --- S3 (moto) ---
+
+@pytest.fixture
+def s3(monkeypatch):
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="evidence")
+        store = S3Storage(bucket="evidence", endpoint_url=None, region="us-east-1")
+        monkeypatch.setattr(uploads, "storage", store)
+        yield store
+
+
+def put_object(store, slot, data):
+    # What the client does with the presigned request, minus the HTTP
+    _, file_path = pending_upload(slot["upload_id"])
+    store.client.put_object(Bucket=store.bucket, Key=file_path.lstrip("/"), Body=data,
+                            ContentType=slot["headers"]["Content-Type"],
+                            ChecksumSHA256=slot["headers"]["x-amz-checksum-sha256"])
+    return file_path
+
+
+def test_s3_presign_signs_the_checksum(s3):
+    data = uuid.uuid4().bytes
+    _, slot = file_case(data)
+    _, file_path = pending_upload(slot["upload_id"])
+
+    url = unquote(slot["url"])
+    assert slot["method"] == "PUT"
+    assert "evidence" in url and file_path.lstrip("/") in url
+    # Signed along with the request, so the store refuses any other body
+    assert "x-amz-checksum-sha256" in url.lower()
+    assert base64.b64decode(slot["headers"]["x-amz-checksum-sha256"]) == hashlib.sha256(data).digest()
+
+
+def test_s3_complete_reads_size_and_checksum_from_the_store(s3):
+    data = uuid.uuid4().bytes * 4
+    _, slot = file_case(data)
+    put_object(s3, slot, data)
+
+    evidence_id = complete_upload(slot["upload_id"])
+    assert evidence_id is not None
+    assert complete_upload(slot["upload_id"]) == evidence_id
+
+
+def test_s3_missing_object_is_409(s3):
+    _, slot = file_case(b"never uploaded")
+    with pytest.raises(UploadError) as error:
+        complete_upload(slot["upload_id"])
+    assert error.value.status_code == 409
+
+
+def test_s3_wrong_size_deletes_the_object(s3):
+    _, slot = file_case(b"declared")
+    _, file_path = pending_upload(slot["upload_id"])
+    s3.client.put_object(Bucket=s3.bucket, Key=file_path.lstrip("/"), Body=b"a different, longer body")
+
+    with pytest.raises(UploadError) as error:
+        complete_upload(slot["upload_id"])
+    assert error.value.status_code == 400
+    assert not s3.exists(file_path)
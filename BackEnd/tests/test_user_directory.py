@@ -0,0 +1,79 @@
+import uuid
+
+import pytest
+
+from models import User
+
+
+@pytest.fixture
+def directory(db):
+    # Names with ties and mixed case, under a prefix no other test uses
+    prefix = f"pg{uuid.uuid4().hex[:8]}"
+    for name in ["b", "A", "c", "a", "B", "a", "d"]:
+        db.add(User(name=f"{prefix} {name}", email=f"{prefix}-{uuid.uuid4().hex[:6]}@example.com", role="user"))
+    db.commit()
+    return prefix
+
+
+def pages(client, **params):
+    seen, cursors = [], 0
+    cursor = None
+    while True:
+        query = {**params, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/admin/users", params=query)
+        assert response.status_code == 200
+        seen += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return seen, cursors
+        cursors += 1
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_pages_cover_every_row_once_in_order(client, directory, order):
+    everything = client.get("/admin/users", params={"q": directory, "sort": "name", "order": order, "limit": 100}).json()
+    expected = sorted(everything, key=lambda user: (user["name"].lower(), user["id"]), reverse=order == "desc")
+    assert len(expected) == 7
+
+    seen, cursors = pages(client, q=directory, sort="name", order=order, limit=3)
+
+    assert [user["id"] for user in seen] == [user["id"] for user in expected]
+    assert cursors == 2
+
+
+def test_last_full_page_has_no_cursor(client, directory):
+    response = client.get("/admin/users", params={"q": directory, "limit": 7})
+    assert len(response.json()) == 7
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_rows_added_behind_the_cursor_are_not_repeated(client, directory, db):
+    first = client.get("/admin/users", params={"q": directory, "sort": "id", "limit": 4})
+    db.add(User(name=f"{directory} late", email=f"{directory}-late@example.com", role="user"))
+    db.commit()
+
+    rest, _ = pages(client, q=directory, sort="id", limit=4, cursor=first.headers["X-Next-Cursor"])
+
+    ids = [user["id"] for user in first.json() + rest]
+    assert len(ids) == len(set(ids)) == 8
+    assert ids == sorted(ids)
+
+
+def test_rejects_a_malformed_cursor(client):
+    assert client.get("/admin/users", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_null_names_are_paged_through(client, db, order):
+    # Rows without a name sort as '' rather than ending the listing
+    prefix = f"pn{uuid.uuid4().hex[:8]}"
+    for name in [None, "b", None, "a", None]:
+        db.add(User(name=name, email=f"{prefix}-{uuid.uuid4().hex[:6]}@example.com", role="user", status=prefix))
+    db.commit()
+
+    seen, cursors = pages(client, status=prefix, sort="name", order=order, limit=2)
+
+    names = [user["name"] for user in seen]
+    assert len(seen) == len({user["id"] for user in seen}) == 5
+    assert names == ([None, None, None, "a", "b"] if order == "asc" else ["b", "a", None, None, None])
+    assert cursors == 2
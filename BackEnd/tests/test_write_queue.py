@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from database import configure_sqlite
+from write_queue import WriteBatcher
+
+
+@pytest.fixture
+def batcher(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'writes.db'}", connect_args={"check_same_thread": False})
+    configure_sqlite(engine)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (name TEXT UNIQUE)"))
+    # A window long enough for everything a test submits to share one batch
+    batcher = WriteBatcher(bind=engine, window=0.2, retries=2)
+    batcher.engine = engine
+    return batcher
+
+
+def insert(name):
+    def write(db):
+        db.execute(text("INSERT INTO items (name) VALUES (:name)"), {"name": name})
+        return name
+    return write
+
+
+def names(batcher):
+    with batcher.engine.connect() as conn:
+        return sorted(name for (name,) in conn.execute(text("SELECT name FROM items")))
+
+
+def locked_error():
+    return OperationalError("INSERT", {}, Exception("database is locked"))
+
+
+def test_failing_write_is_rolled_back_alone(batcher):
+    def insert_then_fail(db):
+        insert("b")(db)
+        raise ValueError("bad input")
+
+    futures = [batcher.submit(insert("a")), batcher.submit(insert_then_fail), batcher.submit(insert("c"))]
+
+    assert futures[0].result(5) == "a"
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert futures[2].result(5) == "c"
+    assert names(batcher) == ["a", "c"]
+    assert batcher.stats["batches"] == 1
+
+
+def test_constraint_error_does_not_poison_the_batch(batcher):
+    batcher.run(insert("a"))
+    futures = [batcher.submit(insert("a")), batcher.submit(insert("b"))]
+
+    with pytest.raises(Exception):
+        futures[0].result(5)
+    assert futures[1].result(5) == "b"
+    assert names(batcher) == ["a", "b"]
+
+
+def test_locked_batch_is_retried_as_a_whole(batcher):
+    attempts = []
+
+    def flaky(db):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise locked_error()
+        return insert("flaky")(db)
+
+    futures = [batcher.submit(insert("sibling")), batcher.submit(flaky)]
+
+    assert [f.result(5) for f in futures] == ["sibling", "flaky"]
+    assert len(attempts) == 2
+    assert batcher.stats["retries"] == 1
+    # The sibling's first attempt was rolled back with the batch, not committed twice
+    assert names(batcher) == ["flaky", "sibling"]
+
+
+def test_gives_up_after_the_last_retry(batcher):
+    def always_locked(db):
+        raise locked_error()
+
+    futures = [batcher.submit(insert("sibling")), batcher.submit(always_locked)]
+
+    for future in futures:
+        with pytest.raises(OperationalError):
+            future.result(5)
+    assert batcher.stats["retries"] == 2
+    assert names(batcher) == []
+
+
+def test_waits_out_a_writer_in_another_connection(batcher):
+    # Another process holding the write lock: the batch waits for it instead of failing
+    conn = batcher.engine.raw_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    release = threading.Timer(0.3, conn.commit)
+    release.start()
+    try:
+        assert batcher.run(insert("after"), timeout=10) == "after"
+    finally:
+        release.join()
+        conn.close()
+    assert names(batcher) == ["after"]
@@ -0,0 +1,222 @@
+import asyncio
+import datetime
+import hashlib
+import os
+import re
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+from case_events import transition
+from database import SessionLocal
+from integrity import CaseTree
+from media import media_pipeline
+from models import Case, Evidence, PendingUpload
+from storage import storage, PRESIGN_EXPIRES_SECONDS
+from write_queue import write_batcher
+
+# Direct uploads: filing a case hands back one presigned URL per declared
+# file, the client PUTs the bytes straight to storage, and completing the
+# upload (client call or storage event) turns it into an Evidence row, adds
+# it to the case hash tree and wakes the media pipeline. The client declares
+# each file's size and SHA-256 up front; the store (or the local PUT handler)
+# refuses bodies that don't match.
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".gif"]
+SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def evidence_file_type(filename):
+    return "image" if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS else "video"
+
+
+def create_direct_case(user_id, police_id, title, description, incident_date, files):
+    """files: dicts with filename, content_type, size, sha256. Returns the
+    case id and an upload slot (presigned request) per file."""
+    for f in files:
+        if not 0 < f["size"] <= MAX_UPLOAD_BYTES:
+            raise UploadError(400, f"{f['filename']}: size must be between 1 and {MAX_UPLOAD_BYTES} bytes")
+        if not SHA256_HEX.match(f["sha256"].lower()):
+            raise UploadError(400, f"{f['filename']}: sha256 must be 64 hex characters")
+
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=PRESIGN_EXPIRES_SECONDS)
+
+    def write(db):
+        new_case = Case(
+            user_id=user_id,
+            police_id=police_id,
+            title=title,
+            description=description,
+            incident_date=incident_date
+        )
+        db.add(new_case)
+        db.flush()
+        transition(db, new_case, "pending", actor_id=user_id, actor_role="user")
+        slots = []
+        for f in files:
+            upload = PendingUpload(
+                id=uuid.uuid4().hex,
+                case_id=new_case.id,
+                file_path=f"/uploads/{uuid.uuid4()}{os.path.splitext(f['filename'])[1]}",
+                file_type=evidence_file_type(f["filename"]),
+                content_type=f["content_type"],
+                size=f["size"],
+                sha256=f["sha256"].lower(),
+                expires_at=expires_at,
+            )
+            db.add(upload)
+            slots.append((f["filename"], upload.id, upload.file_path, upload.content_type, upload.sha256))
+        purge_expired(db)
+        return new_case.id, slots
+
+    case_id, slots = write_batcher.run(write)
+    return case_id, [
+        dict(filename=filename, upload_id=upload_id, expires_at=expires_at,
+             **storage.presign_upload(upload_id, file_path, content_type, sha256))
+        for filename, upload_id, file_path, content_type, sha256 in slots
+    ]
+
+
+def purge_expired(db):
+    # Slots nobody completed; whatever was uploaded for them is left for the
+    # bucket lifecycle / a later cleanup
+    db.query(PendingUpload).filter(
+        PendingUpload.status.in_(["pending", "failed"]),
+        PendingUpload.expires_at < datetime.datetime.utcnow(),
+    ).delete(synchronize_session=False)
+
+
+def load_upload(upload_id):
+    db = SessionLocal()
+    try:
+        upload = db.query(PendingUpload).filter(PendingUpload.id == upload_id).first()
+        if upload:
+            db.expunge(upload)
+        return upload
+    finally:
+        db.close()
+
+
+def update_upload_status(upload_id, status):
+    def write(db):
+        db.query(PendingUpload).filter(PendingUpload.id == upload_id).update({"status": status}, synchronize_session=False)
+
+    return write_batcher.submit(write)
+
+
+def set_upload_status(upload_id, status):
+    update_upload_status(upload_id, status).result()
+
+
+async def receive_local_upload(upload_id, chunks):
+    """Local backend stand-in for a presigned PUT: streams the body to disk,
+    hashing as it goes, and only keeps it if size and SHA-256 match. Disk and
+    database work runs off the event loop."""
+    upload = await run_in_threadpool(load_upload, upload_id)
+    if not upload or upload.status not in ("pending", "failed"):
+        raise UploadError(404, "Upload not found")
+    if upload.expires_at < datetime.datetime.utcnow():
+        raise UploadError(410, "Upload URL has expired")
+
+    path = storage.path(upload.file_path)
+    partial = path + ".part"
+    digest = hashlib.sha256()
+    received = 0
+    buffer = await run_in_threadpool(open, partial, "wb")
+    try:
+        try:
+            async for chunk in chunks:
+                received += len(chunk)
+                if received > upload.size:
+                    raise UploadError(413, "Upload is larger than declared")
+                await run_in_threadpool(write_chunk, buffer, digest, chunk)
+        finally:
+            await run_in_threadpool(buffer.close)
+        if received != upload.size or digest.hexdigest() != upload.sha256:
+            raise UploadError(400, "Upload does not match the declared size / sha256")
+        await run_in_threadpool(os.replace, partial, path)
+    finally:
+        await run_in_threadpool(remove_if_exists, partial)
+    await asyncio.wrap_future(update_upload_status(upload_id, "uploaded"))
+
+
+def write_chunk(buffer, digest, chunk):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+def remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def complete_upload(upload_id):
+    """Registers the uploaded file as evidence. Safe to call more than once
+    (client and storage event both may). Returns the evidence id."""
+    upload = load_upload(upload_id)
+    if not upload:
+        raise UploadError(404, "Upload not found")
+    if upload.status == "completed":
+        return upload.evidence_id
+    if not storage.exists(upload.file_path):
+        raise UploadError(409, "File has not been uploaded yet")
+
+    # Cheap metadata checks only; the bytes never come through here
+    problem = None
+    if storage.size(upload.file_path) != upload.size:
+        problem = "Uploaded size does not match the declared size"
+    else:
+        checksum = storage.uploaded_checksum(upload.file_path)
+        if checksum and checksum != upload.sha256:
+            problem = "Uploaded sha256 does not match the declared sha256"
+    if problem:
+        storage.delete(upload.file_path)
+        set_upload_status(upload_id, "failed")
+        raise UploadError(400, problem)
+
+    def write(db):
+        pending = db.query(PendingUpload).filter(PendingUpload.id == upload_id).first()
+        if pending is None:
+            # Expired and purged, or its case was deleted, since load_upload
+            raise UploadError(410, "Upload is no longer available")
+        if pending.status == "completed":
+            return pending.evidence_id
+        case = db.query(Case).filter(Case.id == pending.case_id).first()
+        if case is None:
+            raise UploadError(410, "Case no longer exists")
+        evidence = Evidence(
+            case_id=pending.case_id,
+            file_path=pending.file_path,
+            file_type=pending.file_type,
+            content_hash=pending.sha256
+        )
+        db.add(evidence)
+        db.flush()
+        CaseTree(db, case).append(evidence)
+        pending.status = "completed"
+        pending.evidence_id = evidence.id
+        return evidence.id
+
+    evidence_id = write_batcher.run(write)
+    media_pipeline.wake()
+    return evidence_id
+
+
+def complete_by_key(key):
+    # Storage event callbacks identify the object by key ("uploads/<name>")
+    db = SessionLocal()
+    try:
+        upload_id = db.query(PendingUpload.id).filter(PendingUpload.file_path == "/" + key).scalar()
+    finally:
+        db.close()
+    if upload_id is None:
+        return None
+    return complete_upload(upload_id)
@@ -0,0 +1,130 @@
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from database import engine
+
+# Writes queued while the previous batch was committing always share the next
+# transaction; a non-zero window additionally lingers to let more pile up
+WRITE_BATCH_WINDOW = float(os.getenv("WRITE_BATCH_WINDOW_MS", "0")) / 1000
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "200"))
+# Retries for "database is locked" that outlast the busy timeout
+WRITE_RETRIES = int(os.getenv("WRITE_RETRIES", "5"))
+WRITE_RETRY_BACKOFF = 0.05
+
+
+def is_locked_error(e):
+    return isinstance(e, OperationalError) and "locked" in str(e).lower()
+
+
+class WriteBatcher:
+    """
+    Single writer thread per process. Request handlers submit small write
+    operations (callables taking a Session) and wait on a Future; the writer
+    drains whatever has queued up (optionally lingering for WRITE_BATCH_WINDOW)
+    and commits it all in one BEGIN IMMEDIATE transaction. Each operation runs
+    in its own SAVEPOINT so one failing write doesn't take the batch down.
+    Operations should return plain values (ids, row counts), not ORM objects.
+    """
+
+    def __init__(self, bind=None, window=WRITE_BATCH_WINDOW, max_batch=WRITE_BATCH_MAX, retries=WRITE_RETRIES):
+        bind = (bind or engine).execution_options(sqlite_begin="IMMEDIATE")
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=bind)
+        self.window = window
+        self.max_batch = max_batch
+        self.retries = retries
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "writes": 0, "retries": 0}
+
+    def _ensure_thread(self):
+        # Threads don't survive fork, so each uvicorn worker starts its own writer
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, fn):
+        """Queue fn(db) for the next batch. Returns a Future with fn's result."""
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def run(self, fn, timeout=None):
+        """Blocking helper for sync handlers: submit and wait for the commit."""
+        return self.submit(fn).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            batch = [(fn, fut) for fn, fut in batch if fut.set_running_or_notify_cancel()]
+            if batch:
+                self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        for attempt in range(self.retries + 1):
+            db = self.session_factory()
+            results = []
+            try:
+                for fn, _ in batch:
+                    savepoint = db.begin_nested()
+                    try:
+                        result = fn(db)
+                        savepoint.commit()
+                        results.append((True, result))
+                    except Exception as e:
+                        savepoint.rollback()
+                        if is_locked_error(e):
+                            raise
+                        results.append((False, e))
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                db.close()
+                if is_locked_error(e) and attempt < self.retries:
+                    self.stats["retries"] += 1
+                    time.sleep(WRITE_RETRY_BACKOFF * (2 ** attempt) * (1 + random.random()))
+                    continue
+                for _, fut in batch:
+                    fut.set_exception(e)
+                return
+            db.close()
+            self.stats["batches"] += 1
+            self.stats["writes"] += len(batch)
+            for (_, fut), (ok, value) in zip(batch, results):
+                if ok:
+                    fut.set_result(value)
+                else:
+                    fut.set_exception(value)
+            return
+
+
+write_batcher = WriteBatcher()